@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('products', '0007_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_option', models.CharField(choices=[('OUTRIGHT', 'Pay Outright'), ('PAY_LATER_40', 'Pay Later (40% upfront)'), ('PAY_LATER_0', 'Pay Later (0% upfront)')], max_length=20)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'payment_option'), name='unique_daily_sales')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_option', models.CharField(choices=[('OUTRIGHT', 'Pay Outright'), ('PAY_LATER_40', 'Pay Later (40% upfront)'), ('PAY_LATER_0', 'Pay Later (0% upfront)')], max_length=20)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.category')),
+            ],
+            options={
+                'verbose_name_plural': 'daily category sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'category', 'payment_option'), name='unique_daily_category_sales')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_option', models.CharField(choices=[('OUTRIGHT', 'Pay Outright'), ('PAY_LATER_40', 'Pay Later (40% upfront)'), ('PAY_LATER_0', 'Pay Later (0% upfront)')], max_length=20)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'daily product sales',
+                'constraints': [models.UniqueConstraint(fields=('day', 'product', 'payment_option'), name='unique_daily_product_sales')],
+            },
+        ),
+    ]
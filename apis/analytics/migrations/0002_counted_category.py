@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_counted_categories(apps, schema_editor):
+    """Records the categories live orders that count as sales were counted under: their products' current ones."""
+    CountedCategory = apps.get_model('analytics', 'CountedCategory')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Product = apps.get_model('products', 'Product')
+    lines = (OrderItem.objects.exclude(order__status__in=['CANCELLED', 'REFUNDED'])
+             .exclude(order__payment_status__in=['FAILED', 'REFUNDED'])
+             .values_list('order_id', 'product_id').distinct())
+    categories = {}
+    for product_id, category_id in Product.categories.through.objects.values_list('product_id', 'category_id'):
+        categories.setdefault(product_id, []).append(category_id)
+    CountedCategory.objects.bulk_create((
+        CountedCategory(order_id=order_id, product_id=product_id, category_id=category_id)
+        for order_id, product_id in lines.iterator() for category_id in categories.get(product_id, ())
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+        ('orders', '0008_repayment_alter_paymentoutbox_kind_and_more'),
+        ('products', '0007_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountedCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+                ('order', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'counted categories',
+            },
+        ),
+        migrations.RunPython(backfill_counted_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.db import models
+
+from orders.models import Order
+from products.models import Category, Product
+
+class SalesRollup(models.Model):
+    """
+    Counters for one day and payment option, kept up to date incrementally
+    as orders are placed (see analytics/rollups.py). Days are in TIME_ZONE.
+    """
+    day = models.DateField()
+    payment_option = models.CharField(max_length=20, choices=Order.PAYMENT_OPTION_CHOICES)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class DailySales(SalesRollup):
+    """Store-wide totals."""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'payment_option'], name='unique_daily_sales'),
+        ]
+        verbose_name_plural = 'daily sales'
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'payment_option'], name='unique_daily_product_sales'),
+        ]
+        verbose_name_plural = 'daily product sales'
+
+class DailyCategorySales(SalesRollup):
+    """An order line counts towards every category its product is in."""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category', 'payment_option'], name='unique_daily_category_sales'),
+        ]
+        verbose_name_plural = 'daily category sales'
+
+class CountedCategory(models.Model):
+    """
+    A category an order's lines for `product` were counted under in
+    DailyCategorySales. Taking the order back out subtracts from exactly
+    these rows, however the product's categories have changed since.
+    """
+    # Unconstrained: archive_orders deletes orders with raw SQL, and these
+    # rows are dropped on its orders_archived signal instead
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, db_constraint=False, related_name='+')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        verbose_name_plural = 'counted categories'
@@ -0,0 +1,245 @@
+# analytics/rollups.py
+"""
+Daily sales rollups.
+
+Each placed order adds its units, revenue and a count of one to the
+DailySales, DailyProductSales and DailyCategorySales rows for its day and
+payment option. The increments are applied with INSERT ... ON CONFLICT DO
+UPDATE SET x = x + excluded.x, so a row is created on a day's first sale
+and bumped in place afterwards, without reading it first. That upsert
+syntax is shared by SQLite (3.24+) and PostgreSQL.
+
+Only orders that count as sales are in the rollups: not cancelled or
+refunded, and whose payment hasn't failed. record_transition() takes an
+order back out when a transition makes it stop counting, and puts it back
+if it counts again (a failed payment that is retried).
+
+A line counts towards its product's categories at the time it is counted,
+and CountedCategory remembers which they were. Taking the order out
+subtracts from those rows, not from the product's categories now.
+
+rebuild_rollups() replays the whole order history, archived orders
+included, through the same code, one chunk of orders per transaction.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from apis.streaming import chunked
+from orders.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+from products.models import Product
+from .models import CountedCategory, DailyCategorySales, DailyProductSales, DailySales
+
+# Rollup model -> the columns that identify one of its rows
+ROLLUP_KEYS = {
+    DailySales: ('day', 'payment_option'),
+    DailyProductSales: ('day', 'payment_option', 'product_id'),
+    DailyCategorySales: ('day', 'payment_option', 'category_id'),
+}
+COUNTERS = ('units', 'revenue', 'order_count')
+UPSERT_BATCH_SIZE = 500
+
+# Orders in either of these aren't sales
+UNCOUNTED_STATUSES = ('CANCELLED', 'REFUNDED')
+UNCOUNTED_PAYMENT_STATUSES = ('FAILED', 'REFUNDED')
+LINE_FIELDS = ('order_id', 'order__created_at', 'order__payment_option', 'product_id', 'quantity', 'price')
+
+
+def counts_as_sale(status, payment_status):
+    return status not in UNCOUNTED_STATUSES and payment_status not in UNCOUNTED_PAYMENT_STATUSES
+
+
+def counted_orders(queryset):
+    """Narrows an Order queryset to the orders counts_as_sale() is true for."""
+    return queryset.exclude(status__in=UNCOUNTED_STATUSES).exclude(payment_status__in=UNCOUNTED_PAYMENT_STATUSES)
+
+
+def accumulate(lines, categories, sign=1):
+    """
+    Sums order lines into {model: {key: [units, revenue, order_count]}}.
+    `lines` are (order_id, created_at, payment_option, product_id, quantity,
+    price) tuples, and `categories` maps (order_id, product_id) to the
+    category ids a line counts towards. An order counts once per rollup row
+    however many of its lines land there. With sign=-1 the sums are
+    negative, to take orders out.
+    """
+    totals = {model: {} for model in ROLLUP_KEYS}
+    counted = set()
+    for order_id, created_at, payment_option, product_id, quantity, price in lines:
+        day = timezone.localdate(created_at)
+        keys = [(DailySales, (day, payment_option)), (DailyProductSales, (day, payment_option, product_id))]
+        keys += [(DailyCategorySales, (day, payment_option, category_id))
+                 for category_id in categories.get((order_id, product_id), ())]
+        for model, key in keys:
+            counters = totals[model].setdefault(key, [0, Decimal('0.00'), 0])
+            counters[0] += sign * quantity
+            counters[1] += sign * price * quantity
+            if (model, key, order_id) not in counted:
+                counted.add((model, key, order_id))
+                counters[2] += sign
+    return totals
+
+
+def _upsert_increments(model, rows):
+    """Adds each row's counters to the stored row with the same key, creating it if needed."""
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    key_columns = ROLLUP_KEYS[model]
+    revenue_field = model._meta.get_field('revenue')
+    columns = ', '.join(quote(column) for column in key_columns + COUNTERS)
+    updates = ', '.join(f"{quote(c)} = {table}.{quote(c)} + excluded.{quote(c)}" for c in COUNTERS)
+    row_placeholder = '(' + ', '.join(['%s'] * (len(key_columns) + len(COUNTERS))) + ')'
+
+    # Sorted so concurrent checkouts touch rows in the same order and can't deadlock
+    with connection.cursor() as cursor:
+        for batch in chunked(sorted(rows.items()), UPSERT_BATCH_SIZE):
+            params = []
+            for (day, *key), (units, revenue, order_count) in batch:
+                params += [connection.ops.adapt_datefield_value(day), *key, units,
+                           connection.ops.adapt_decimalfield_value(
+                               revenue, revenue_field.max_digits, revenue_field.decimal_places),
+                           order_count]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_placeholder] * len(batch))} "
+                f"ON CONFLICT ({', '.join(quote(c) for c in key_columns)}) DO UPDATE SET {updates}",
+                params,
+            )
+
+
+def _apply_decrements(model, rows):
+    """
+    Subtracts from rows that must already exist, one UPDATE per row sent as
+    one executemany(). An upsert won't do: the unsigned columns' CHECK
+    constraints reject the negative row it proposes before the conflict is
+    resolved. Counters stop at zero rather than fail the transition, should
+    a row hold less than is taken out (e.g. one rebuilt meanwhile).
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    revenue_field = model._meta.get_field('revenue')
+    updates = ', '.join(f"{quote(c)} = CASE WHEN {quote(c)} + %s > 0 THEN {quote(c)} + %s ELSE 0 END"
+                        for c in COUNTERS)
+    where = ' AND '.join(f"{quote(c)} = %s" for c in ROLLUP_KEYS[model])
+    params = []
+    for (day, *key), (units, revenue, order_count) in sorted(rows.items()):
+        revenue = connection.ops.adapt_decimalfield_value(revenue, revenue_field.max_digits, revenue_field.decimal_places)
+        params.append([units, units, revenue, revenue, order_count, order_count,
+                       connection.ops.adapt_datefield_value(day), *key])
+    with connection.cursor() as cursor:
+        cursor.executemany(f"UPDATE {table} SET {updates} WHERE {where}", params)
+
+
+def current_categories(lines):
+    """{(order_id, product_id): [category ids]} for order lines, from their products' categories now."""
+    by_product = {}
+    for product_id, category_id in Product.categories.through.objects.filter(
+        product_id__in={line[3] for line in lines}
+    ).values_list('product_id', 'category_id'):
+        by_product.setdefault(product_id, []).append(category_id)
+    return {(line[0], line[3]): by_product.get(line[3], []) for line in lines}
+
+
+def record_lines(lines, categories, sign=1):
+    """Adds order lines to the rollups (sign=-1 subtracts them); run inside the transaction that wrote them."""
+    for model, rows in accumulate(lines, categories, sign).items():
+        if rows:
+            (_upsert_increments if sign > 0 else _apply_decrements)(model, rows)
+
+
+def count_lines(lines, remember=True):
+    """
+    Counts order lines towards the rollups, under their products' current
+    categories. With remember=True (live orders) the categories are kept in
+    CountedCategory for uncount_orders().
+    """
+    lines = list(lines)
+    if not lines:
+        return
+    categories = current_categories(lines)
+    if remember:
+        CountedCategory.objects.bulk_create([
+            CountedCategory(order_id=order_id, product_id=product_id, category_id=category_id)
+            for (order_id, product_id), category_ids in sorted(categories.items()) for category_id in category_ids
+        ])
+    record_lines(lines, categories)
+
+
+def uncount_orders(order_ids):
+    """Takes counted orders back out of the rollups, from the category rows they were counted under."""
+    counted = CountedCategory.objects.filter(order_id__in=order_ids)
+    categories = {}
+    for order_id, product_id, category_id in counted.values_list('order_id', 'product_id', 'category_id'):
+        categories.setdefault((order_id, product_id), []).append(category_id)
+    record_lines(list(OrderItem.objects.filter(order_id__in=order_ids).values_list(*LINE_FIELDS)), categories, sign=-1)
+    counted.delete()
+
+
+def record_order(order, items):
+    count_lines(
+        (order.pk, order.created_at, order.payment_option, item.product_id, item.quantity, item.price)
+        for item in items
+    )
+
+
+def record_transition(field, changed):
+    """
+    Keeps the rollups in step with a transition_orders() call: orders that
+    stopped counting as sales are subtracted, orders that started counting
+    again are added back. `changed` maps order ids to their previous value
+    of `field`. Run inside the transition's transaction.
+    """
+    removed, restored = [], []
+    for pk, status, payment_status in Order.objects.filter(pk__in=list(changed)).values_list(
+        'pk', 'status', 'payment_status'
+    ):
+        before = {'status': status, 'payment_status': payment_status, field: changed[pk]}
+        counted_before, counted_now = counts_as_sale(**before), counts_as_sale(status, payment_status)
+        if counted_before and not counted_now:
+            removed.append(pk)
+        elif counted_now and not counted_before:
+            restored.append(pk)
+    if removed:
+        uncount_orders(removed)
+    if restored:
+        count_lines(OrderItem.objects.filter(order_id__in=restored).values_list(*LINE_FIELDS))
+
+
+def forget_orders(order_ids):
+    """Drops the CountedCategory rows of orders that can no longer change (archived)."""
+    CountedCategory.objects.filter(order_id__in=order_ids).delete()
+
+
+def _replay(order_model, item_model, last_id, chunk_size):
+    """Replays order_model's orders up to last_id into the rollups, a chunk per transaction."""
+    replayed, after = 0, 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(order_model.objects.filter(pk__gt=after, pk__lte=last_id)
+                             .order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not order_ids:
+                return replayed
+            count_lines(item_model.objects.filter(
+                order_id__in=counted_orders(order_model.objects.filter(pk__in=order_ids)).values('pk')
+            ).values_list(*LINE_FIELDS), remember=order_model is Order)
+        replayed += len(order_ids)
+        after = order_ids[-1]
+
+
+def rebuild_rollups(chunk_size=1000):
+    """
+    Recomputes every rollup from the order history, archived orders
+    included, chunk_size orders per transaction, and returns how many
+    orders were replayed (counted as sales or not). Orders placed after the
+    rollups are cleared are counted by the live handler instead. Don't run
+    it alongside archive_orders: an order moved mid-rebuild could be
+    replayed twice or not at all.
+    """
+    with transaction.atomic():
+        for model in (*ROLLUP_KEYS, CountedCategory):
+            model.objects.all().delete()
+        last_archived_id = ArchivedOrder.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    return (_replay(ArchivedOrder, ArchivedOrderItem, last_archived_id, chunk_size)
+            + _replay(Order, OrderItem, last_id, chunk_size))
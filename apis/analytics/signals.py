@@ -0,0 +1,23 @@
+# analytics/signals.py
+from django.dispatch import receiver
+
+from orders.signals import order_placed, orders_archived, orders_transitioned
+from .rollups import forget_orders, record_order, record_transition
+
+
+@receiver(order_placed)
+def roll_up_placed_order(sender, order, items, **kwargs):
+    # Runs in the checkout transaction, so an order and its rollup increments commit together
+    record_order(order, items)
+
+
+@receiver(orders_transitioned)
+def roll_up_transitioned_orders(sender, field, target, changed, **kwargs):
+    # Cancelled, refunded and failed-payment orders aren't sales; a retried payment makes one count again
+    record_transition(field, changed)
+
+
+@receiver(orders_archived)
+def forget_archived_orders(sender, order_ids, **kwargs):
+    # Archived orders can't be cancelled or refunded, so what they were counted under isn't needed
+    forget_orders(order_ids)
@@ -0,0 +1,168 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order, OrderItem
+from orders.archive import archive_orders
+from orders.transitions import transition_orders
+from products.models import Category, Product
+from .models import CountedCategory, DailyCategorySales, DailyProductSales, DailySales
+from .rollups import rebuild_rollups
+
+User = get_user_model()
+
+
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.audio = Category.objects.create(name='Audio')
+        self.phones = Category.objects.create(name='Phones')
+        self.headset = Product.objects.create(name='Headset', price=Decimal('20.00'), stock=50)
+        self.headset.categories.set([self.audio, self.phones])
+        self.phone = Product.objects.create(name='Phone', price=Decimal('150.00'), stock=50)
+        self.phone.categories.set([self.phones])
+
+    def checkout(self, *lines, payment_option='OUTRIGHT'):
+        payload = {
+            'payment_option': payment_option,
+            'delivery_address': '1 Market Road',
+            'delivery_phone_number': '08000000000',
+            'items': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in lines],
+        }
+        response = self.client.post(reverse('order-create'), payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response
+
+    def snapshot(self):
+        return {
+            model.__name__: sorted(model.objects.values_list(
+                'day', 'payment_option', *(['product_id'] if model is DailyProductSales else
+                                          ['category_id'] if model is DailyCategorySales else []),
+                'units', 'revenue', 'order_count'))
+            for model in (DailySales, DailyProductSales, DailyCategorySales)
+        }
+
+    def test_checkout_increments_the_rollups(self):
+        self.checkout((self.headset, 2), (self.phone, 1))
+        self.checkout((self.headset, 1))
+        today = timezone.localdate()
+
+        sales = DailySales.objects.get()
+        self.assertEqual((sales.day, sales.units, sales.revenue, sales.order_count), (today, 4, Decimal('210.00'), 2))
+        headset = DailyProductSales.objects.get(product=self.headset)
+        self.assertEqual((headset.units, headset.revenue, headset.order_count), (3, Decimal('60.00'), 2))
+        # Both lines of the first order are phones, but it is one phones order
+        phones = DailyCategorySales.objects.get(category=self.phones)
+        self.assertEqual((phones.units, phones.revenue, phones.order_count), (4, Decimal('210.00'), 2))
+
+    def test_cancelled_refunded_and_failed_orders_leave_the_rollups(self):
+        kept = self.checkout((self.phone, 1)).data['id']
+        cancelled = self.checkout((self.headset, 2)).data['id']
+        failed = self.checkout((self.headset, 1), (self.phone, 1)).data['id']
+        transition_orders([cancelled], 'status', 'CANCELLED')
+        transition_orders([failed], 'payment_status', 'FAILED')
+        sales = DailySales.objects.get()
+        self.assertEqual((sales.units, sales.revenue, sales.order_count), (1, Decimal('150.00'), 1))
+        headset = DailyProductSales.objects.get(product=self.headset)
+        self.assertEqual((headset.units, headset.revenue, headset.order_count), (0, Decimal('0.00'), 0))
+
+        transition_orders([failed], 'payment_status', 'PENDING') # Payment retried: a sale again
+        transition_orders([failed], 'status', 'CANCELLED')        # Then cancelled: out once, not twice
+        self.assertEqual(DailySales.objects.get().order_count, 1)
+        transition_orders([kept], 'payment_status', 'PAID')
+        transition_orders([kept], 'status', 'PROCESSING')
+        self.assertEqual(DailySales.objects.get().revenue, Decimal('150.00'))
+
+        # A rebuild agrees, apart from the emptied rows the live rollups keep
+        live = {name: [row for row in rows if row[-1]] for name, rows in self.snapshot().items()}
+        rebuild_rollups()
+        self.assertEqual(self.snapshot(), live)
+
+    def test_orders_leave_the_categories_they_were_counted_under(self):
+        order_id = self.checkout((self.headset, 2)).data['id']
+        self.headset.categories.set([self.phones, Category.objects.create(name='Gaming')])
+        transition_orders([order_id], 'payment_status', 'FAILED')
+        audio = DailyCategorySales.objects.get(category=self.audio)
+        self.assertEqual((audio.units, audio.revenue, audio.order_count), (0, Decimal('0.00'), 0))
+        self.assertFalse(DailyCategorySales.objects.filter(order_count__gt=0).exists())
+        self.assertFalse(CountedCategory.objects.exists())
+
+        # Retried, it counts under the categories the headset has now, and leaves those
+        transition_orders([order_id], 'payment_status', 'PENDING')
+        self.assertEqual(sorted(DailyCategorySales.objects.filter(order_count=1).values_list('category__name', flat=True)),
+                         ['Gaming', 'Phones'])
+        self.headset.categories.set([self.audio])
+        transition_orders([order_id], 'status', 'CANCELLED')
+        self.assertFalse(DailyCategorySales.objects.filter(order_count__gt=0).exists())
+
+    def test_archiving_forgets_the_counted_categories(self):
+        order_id = self.checkout((self.headset, 1)).data['id']
+        self.assertEqual(CountedCategory.objects.filter(order_id=order_id).count(), 2)
+        Order.objects.filter(pk=order_id).update(status='COMPLETED', created_at=timezone.now() - timedelta(days=400))
+        self.assertEqual(archive_orders(), 1)
+        self.assertFalse(CountedCategory.objects.exists())
+
+    def test_backfill_matches_the_live_rollups(self):
+        self.checkout((self.headset, 2), (self.phone, 1))
+        self.checkout((self.phone, 3), (self.headset, 1))
+        live = self.snapshot()
+
+        # Orders that predate the rollups
+        order = Order.objects.create(
+            user=self.user, total_amount=Decimal('20.00'), payment_option='OUTRIGHT',
+            delivery_address='1 Market Road', delivery_phone_number='08000000000',
+        )
+        OrderItem.objects.create(order=order, product=self.headset, quantity=1, price=Decimal('20.00'))
+
+        self.assertEqual(rebuild_rollups(chunk_size=1), 3)
+        self.assertEqual(DailySales.objects.get().order_count, 3)
+        OrderItem.objects.filter(order=order).delete()
+        order.delete()
+        call_command('backfill_sales_rollups', chunk_size=2, stdout=StringIO())
+        self.assertEqual(self.snapshot(), live)
+
+    def test_rebuild_keeps_archived_sales(self):
+        old = self.checkout((self.phone, 2)).data['id']
+        self.checkout((self.headset, 1))
+        Order.objects.filter(pk=old).update(status='COMPLETED', created_at=timezone.now() - timedelta(days=400))
+        self.assertEqual(archive_orders(), 1)
+        self.assertEqual(rebuild_rollups(), 2)
+        old_day = timezone.localdate() - timedelta(days=400)
+        self.assertEqual(DailySales.objects.get(day=old_day).revenue, Decimal('300.00'))
+        self.assertEqual(DailySales.objects.get(day=timezone.localdate()).revenue, Decimal('20.00'))
+
+    def test_reports_are_staff_only_and_read_only_rollups(self):
+        self.checkout((self.headset, 2), (self.phone, 1))
+        self.checkout((self.headset, 5))
+        self.assertEqual(self.client.get(reverse('analytics-sales')).status_code, 403)
+
+        staff = User.objects.create_user(username='finance', password='pass12345', is_staff=True)
+        self.client.force_authenticate(staff)
+        with CaptureQueriesContext(connection) as queries:
+            sales = self.client.get(reverse('analytics-sales')).data
+            products = self.client.get(reverse('analytics-products'), {'limit': 1}).data
+            categories = self.client.get(reverse('analytics-categories')).data
+        self.assertFalse([q for q in queries.captured_queries if 'orders_order' in q['sql']])
+
+        self.assertEqual(sales['totals']['revenue'], '290.00')
+        self.assertEqual(sales['totals']['by_payment_option']['OUTRIGHT']['order_count'], 2)
+        self.assertEqual(len(sales['days']), 1)
+        self.assertEqual([row['product_name'] for row in products['results']], ['Phone'])
+        self.assertEqual([(row['category_name'], row['revenue']) for row in categories['results']],
+                         [('Phones', '290.00'), ('Audio', '140.00')])
+
+        for params in ({'start': 'yesterday'}, {'start': '2025-02-01', 'end': '2025-01-01'},
+                       {'start': '2020-01-01', 'end': '2025-01-01'}, {'payment_option': 'CASH'}):
+            self.assertEqual(self.client.get(reverse('analytics-products'), params).status_code, 400)
@@ -0,0 +1,11 @@
+from django.urls import path
+from rest_framework.urlpatterns import format_suffix_patterns
+from analytics import views
+
+urlpatterns = [
+    path('sales/', views.SalesSummaryView.as_view(), name='analytics-sales'),
+    path('products/', views.ProductSalesView.as_view(), name='analytics-products'),
+    path('categories/', views.CategorySalesView.as_view(), name='analytics-categories'),
+]
+
+urlpatterns = format_suffix_patterns(urlpatterns)
@@ -0,0 +1,141 @@
+# analytics/views.py
+"""
+Staff-only sales reporting. Every endpoint reads only the daily rollup
+tables, so a report costs O(days in range) rows however many orders were
+placed.
+
+    GET /api/analytics/sales/?start=2025-06-01&end=2025-06-30
+    GET /api/analytics/products/?start=...&end=...&payment_option=OUTRIGHT&limit=20
+    GET /api/analytics/categories/?start=...&end=...
+
+`start` and `end` are inclusive dates; the default is the last 30 days.
+"""
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from orders.models import Order
+from .models import DailyCategorySales, DailyProductSales, DailySales
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 366
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+PAYMENT_OPTIONS = [value for value, _ in Order.PAYMENT_OPTION_CHOICES]
+
+
+def _parse_day(params, name, default):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: "Must be a date (YYYY-MM-DD)."})
+    return day
+
+
+def get_date_range(params):
+    end = _parse_day(params, 'end', timezone.localdate())
+    start = _parse_day(params, 'start', end - timedelta(days=DEFAULT_RANGE_DAYS - 1))
+    if start > end:
+        raise ValidationError({'start': "Must not be after end."})
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValidationError({'start': f"The range can span at most {MAX_RANGE_DAYS} days."})
+    return start, end
+
+
+def _counters(units=0, revenue=None, order_count=0):
+    return {'units': units or 0, 'revenue': f"{revenue or 0:.2f}", 'order_count': order_count or 0}
+
+
+class RollupReportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get_rollups(self, model):
+        """Rollup rows in the requested range, optionally for one payment option."""
+        start, end = get_date_range(self.request.query_params)
+        queryset = model.objects.filter(day__gte=start, day__lte=end)
+        payment_option = self.request.query_params.get('payment_option')
+        if payment_option is not None:
+            if payment_option not in PAYMENT_OPTIONS:
+                raise ValidationError({'payment_option': f"Must be one of: {', '.join(PAYMENT_OPTIONS)}."})
+            queryset = queryset.filter(payment_option=payment_option)
+        return start, end, queryset
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': "Must be a whole number."})
+        return max(1, min(limit, MAX_LIMIT))
+
+
+class SalesSummaryView(RollupReportView):
+    """Totals per day, each broken down by payment option."""
+
+    def get(self, request, *args, **kwargs):
+        start, end, rollups = self.get_rollups(DailySales)
+        days = {}
+        totals = {'units': 0, 'revenue': 0, 'order_count': 0, 'by_payment_option': {}}
+        for row in rollups.order_by('day', 'payment_option'):
+            day = days.setdefault(row.day, {'units': 0, 'revenue': 0, 'order_count': 0, 'by_payment_option': {}})
+            for bucket in (day, totals):
+                bucket['units'] += row.units
+                bucket['revenue'] += row.revenue
+                bucket['order_count'] += row.order_count
+                option = bucket['by_payment_option'].setdefault(row.payment_option, [0, 0, 0])
+                option[0] += row.units
+                option[1] += row.revenue
+                option[2] += row.order_count
+
+        def render(bucket):
+            rendered = _counters(bucket['units'], bucket['revenue'], bucket['order_count'])
+            rendered['by_payment_option'] = {
+                option: _counters(*counters) for option, counters in bucket['by_payment_option'].items()
+            }
+            return rendered
+
+        return Response({
+            'start': start, 'end': end,
+            'totals': render(totals),
+            'days': [{'day': day, **render(bucket)} for day, bucket in days.items()],
+        })
+
+
+class ProductSalesView(RollupReportView):
+    """Best-selling products in the range, by revenue."""
+
+    def get(self, request, *args, **kwargs):
+        start, end, rollups = self.get_rollups(DailyProductSales)
+        rows = rollups.values('product_id', 'product__name').annotate(
+            units=Sum('units'), revenue=Sum('revenue'), order_count=Sum('order_count')
+        ).order_by('-revenue', 'product_id')[:self.get_limit()]
+        return Response({'start': start, 'end': end, 'results': [
+            {'product_id': row['product_id'], 'product_name': row['product__name'],
+             **_counters(row['units'], row['revenue'], row['order_count'])}
+            for row in rows
+        ]})
+
+
+class CategorySalesView(RollupReportView):
+    """Sales per category in the range, by revenue."""
+
+    def get(self, request, *args, **kwargs):
+        start, end, rollups = self.get_rollups(DailyCategorySales)
+        rows = rollups.values('category_id', 'category__name').annotate(
+            units=Sum('units'), revenue=Sum('revenue'), order_count=Sum('order_count')
+        ).order_by('-revenue', 'category_id')[:self.get_limit()]
+        return Response({'start': start, 'end': end, 'results': [
+            {'category_id': row['category_id'], 'category_name': row['category__name'],
+             **_counters(row['units'], row['revenue'], row['order_count'])}
+            for row in rows
+        ]})
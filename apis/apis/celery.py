@@ -0,0 +1,14 @@
+import os
+
+from celery import Celery
+
+# Set the default Django settings module for the 'celery' program.
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apis.settings')
+
+app = Celery('apis')
+
+# Read CELERY_* settings from Django's settings, e.g. CELERY_BEAT_SCHEDULE
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Load tasks.py from every installed app
+app.autodiscover_tasks()
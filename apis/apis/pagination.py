@@ -0,0 +1,142 @@
+# apis/pagination.py
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class OptInCursorPagination(BasePagination):
+    """
+    Page-number pagination by default, switching to keyset (cursor) pagination
+    when the client asks for it with `?pagination=cursor` or sends a `cursor`.
+
+    Page numbers need a COUNT(*) and an OFFSET scan that gets slower the deeper
+    the page. Cursor pages seek straight to the last row seen through an index,
+    so every page costs the same; that is what infinite-scroll clients want.
+    Subclasses set `ordering` to match an index on the paginated table.
+    """
+    ordering = None
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+
+    def wants_cursor(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_query_param in request.query_params
+        )
+
+    def get_cursor_paginator(self, view=None):
+        paginator = CursorPagination()
+        # Views with client-selectable sorting expose it as `cursor_ordering`
+        paginator.ordering = getattr(view, 'cursor_ordering', None) or self.ordering
+        paginator.cursor_query_param = self.cursor_query_param
+        return paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.wants_cursor(request):
+            self.paginator = self.get_cursor_paginator(view)
+        else:
+            self.paginator = PageNumberPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return PageNumberPagination().get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        paginator = getattr(self, 'paginator', None)
+        return bool(paginator and paginator.display_page_controls)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+
+class ProductCursorPagination(OptInCursorPagination):
+    # On SQLite the `name` index already ends in the rowid primary key, so
+    # (name, id) is served by the existing index with no extra sort.
+    ordering = ('name', 'id')
+
+
+class OrderHistoryCursorPagination(BasePagination):
+    """
+    Keyset pagination, newest first, over one or more querysets read as a
+    single list: the order history pages through the hot Order table and
+    ArchivedOrder together. Every page takes up to page_size + 1 rows from
+    each queryset, seeking to the cursor through its (user, -created_at)
+    index, and merges them; there is never a COUNT(*) or an OFFSET.
+
+    Pages only go forward (`next`), which is what infinite-scroll clients
+    use. Rows must have unique ids across the querysets.
+    """
+    ordering_field = 'created_at' # Descending, then id ascending as the tie-breaker
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            value, pk = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').rsplit('|', 1)
+            position = (datetime.fromisoformat(value), int(pk))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, row):
+        value = f"{getattr(row, self.ordering_field).isoformat()}|{row.pk}"
+        encoded = urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+
+        rows = []
+        for source in querysets:
+            if position is not None:
+                # A range the index can seek to, minus the rows already shown at the boundary
+                value, pk = position
+                source = source.filter(**{f'{self.ordering_field}__lte': value}).exclude(
+                    **{self.ordering_field: value, 'pk__lte': pk}
+                )
+            rows += list(source.order_by(f'-{self.ordering_field}', 'pk')[:page_size + 1])
+        rows.sort(key=lambda row: row.pk)
+        rows.sort(key=lambda row: getattr(row, self.ordering_field), reverse=True)
+
+        page = rows[:page_size]
+        self.next_url = self.encode_cursor(page[-1]) if len(rows) > page_size else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.next_url, 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -15,6 +15,7 @@ from pathlib import Path
 import os
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
     'orders',
     'users',
     'paylater',
+    'idempotency',
+    'analytics',
 
 ]
 
@@ -76,6 +79,35 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10, # Example: default number of items per page
 }
 
+# Cache
+# Local memory is per process; point this at Redis (e.g. redis://localhost:6379/1)
+# in production so every worker sees the same catalog generation.
+# The 'crc' cache holds state every worker must share, so in production set
+# CRC_STATE_REDIS_URL to the broker's Redis server, in a database of its own
+# (e.g. redis://localhost:6379/2). Unset, it is kept in process (development, tests).
+CRC_STATE_REDIS_URL = os.environ.get('CRC_STATE_REDIS_URL', '')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Cached credit bureau results (paylater/crc_cache.py) and the bureau's circuit
+    # breaker and rate limit state (paylater/bureau_guard.py)
+    'crc': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CRC_STATE_REDIS_URL,
+    } if CRC_STATE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crc',
+    },
+}
+
+# Seconds a cached catalog response lives (it is also invalidated on every catalog change)
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Upper bound on ranked matches returned by /api/search/
+PRODUCT_SEARCH_MAX_RESULTS = 1000
+
 # --- SIMPLE JWT SETTINGS ---
 from datetime import timedelta
 
@@ -111,6 +143,70 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Delta sync (/api/sync/)
+SYNC_PAGE_SIZE = 500 # Rows (upserts + deletions) per response
+SYNC_WATERMARK_OVERLAP = timedelta(seconds=5) # Re-read window for writes that committed late
+SYNC_TOMBSTONE_RETENTION = timedelta(days=30) # Older watermarks get a full resync
+
+# Idempotency-Key support on create endpoints
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24) # How long a key's stored response can be replayed
+IDEMPOTENCY_CLAIM_TTL = timedelta(minutes=5) # How long a request holds its key before a retry may take it over
+
+# Stock reservations (cart holds) taken before payment
+STOCK_RESERVATION_TTL = timedelta(minutes=15) # How long a hold lasts before the sweeper frees it
+STOCK_RESERVATION_SWEEP_INTERVAL = timedelta(minutes=1)
+STOCK_RESERVATION_SWEEP_BATCH = 500 # Reservations expired per transaction
+
+# Payment outbox (checkout queues payments; a beat task sends them to the gateway)
+# Shared with the gateway. The development fallback is public, so outside DEBUG it must be set
+PAYMENT_WEBHOOK_SECRET = os.environ.get('PAYMENT_WEBHOOK_SECRET', 'dev-payment-webhook-secret' if DEBUG else '')
+if not PAYMENT_WEBHOOK_SECRET:
+    raise ImproperlyConfigured('Set PAYMENT_WEBHOOK_SECRET; without it anyone could forge payment webhooks.')
+PAYMENT_OUTBOX_DISPATCH_INTERVAL = timedelta(seconds=5)
+PAYMENT_OUTBOX_BATCH_SIZE = 50 # Rows claimed per dispatcher transaction
+PAYMENT_OUTBOX_CLAIM_TTL = timedelta(minutes=2) # After this a crashed dispatcher's rows are re-sent
+PAYMENT_OUTBOX_MAX_ATTEMPTS = 8 # Then the order's payment is marked FAILED
+
+# Order archival (finished orders move to the archive tables)
+ORDER_ARCHIVE_AFTER = timedelta(days=365) # Age after which a COMPLETED/CANCELLED/REFUNDED order is archived
+ORDER_ARCHIVE_CHUNK_SIZE = 1000 # Orders moved per transaction
+
+# Pay Later credit checks (claim a lease, call the bureau outside any transaction, commit)
+CRC_CHECK_LEASE_TTL = timedelta(seconds=90) # Longer than a bureau call; then another worker may take over
+CRC_LEASE_SWEEP_INTERVAL = timedelta(minutes=1) # How often checks with expired leases are re-queued
+CRC_API_ENDPOINT = os.environ.get('CRC_API_ENDPOINT', '') # Unset: responses are simulated (development)
+CRC_API_KEY = os.environ.get('CRC_API_KEY', '')
+CRC_CONNECT_TIMEOUT = 3.05 # Seconds to open a connection to the bureau
+CRC_READ_TIMEOUT = 30 # Seconds to wait for the bureau's answer
+CRC_MAX_IN_FLIGHT = 32 # Concurrent bureau calls (and pooled keep-alive connections) per worker process
+CRC_CACHE_SALT = os.environ.get('CRC_CACHE_SALT', SECRET_KEY) # HMAC key for national IDs in cache keys
+CRC_CACHE_TTL = timedelta(hours=24) # A cached bureau result is reused without a new call for this long
+# Then still served, while a fresh one is fetched, for this long more. A
+# stale result decides the application it is served to, so keep this short:
+# no decision rests on a bureau answer older than CRC_CACHE_TTL + this
+CRC_CACHE_STALE_TTL = timedelta(hours=1)
+CRC_API_BULK_ENDPOINT = os.environ.get('CRC_API_BULK_ENDPOINT', '') # Unset: batches fan out as concurrent single calls
+CRC_BATCH_SIZE = 100 # Applications per bureau batch; this many new submissions also flush a batch early
+CRC_BATCH_WINDOW = timedelta(seconds=5) # Longest a new application waits for its batch
+CRC_MAX_ATTEMPTS = 5 # Claims before the collector leaves an application for staff to look at
+
+# Credit bureau circuit breaker and rate limit; state lives in CACHES['crc'],
+# shared by every worker
+CRC_BREAKER_FAILURE_THRESHOLD = 5 # Consecutive failed bureau calls that open the breaker
+CRC_BREAKER_RESET_TIMEOUT = timedelta(seconds=30) # Open this long, then one trial call is let through (half-open)
+CRC_RATE_LIMIT = 20 # Bureau requests per second, across all workers
+CRC_RATE_BURST = 60 # Requests that may go out at once after a quiet spell
+CRC_RATE_MAX_WAIT = 2.0 # Seconds a call may wait for the rate limit; longer and the check is deferred
+CRC_RETRY_BASE_DELAY = timedelta(seconds=10) # Deferred checks retry after a random delay up to base * 2^retries,
+CRC_RETRY_MAX_DELAY = timedelta(minutes=5)   # capped at this
+
+# A batch fanned out as single calls needs a token per check; one bigger
+# than the bucket can hand over within CRC_RATE_MAX_WAIT would never be let through
+if CRC_BATCH_SIZE > CRC_RATE_BURST + CRC_RATE_LIMIT * CRC_RATE_MAX_WAIT:
+    raise ImproperlyConfigured(
+        'CRC_BATCH_SIZE must be no more than CRC_RATE_BURST + CRC_RATE_LIMIT * CRC_RATE_MAX_WAIT.'
+    )
+
 # CORS Headers (important for React Native)
 CORS_ALLOW_ALL_ORIGINS = True # For development, broaden restrictions in production
 # CORS_ALLOWED_ORIGINS = [
@@ -127,10 +223,14 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
+    'if-modified-since',
+    'idempotency-key',
 ]
+CORS_EXPOSE_HEADERS = ['etag', 'last-modified', 'idempotent-replayed']
 
 # Celery Configuration
-CELERY_BROKER_URL = 'redis://localhost:6379/0' # Use your Redis URL
+CELERY_BROKER_URL = 'redis://localhost:6379/0' # Use your Redis URL; CRC_STATE_REDIS_URL (see CACHES) uses another database on it
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -138,6 +238,36 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Africa/Lagos' # IMPORTANT: Set your actual timezone
 CELERY_TASK_TRACK_STARTED = True # Track task status
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True # Important for Docker/startup
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-payment-outbox': {
+        'task': 'orders.tasks.dispatch_payment_outbox_task',
+        'schedule': PAYMENT_OUTBOX_DISPATCH_INTERVAL,
+    },
+    'expire-stock-reservations': {
+        'task': 'orders.tasks.expire_stock_reservations_task',
+        'schedule': STOCK_RESERVATION_SWEEP_INTERVAL,
+    },
+    'purge-expired-idempotency-keys': {
+        'task': 'idempotency.tasks.purge_expired_idempotency_keys_task',
+        'schedule': timedelta(hours=1),
+    },
+    'archive-orders': {
+        'task': 'orders.tasks.archive_orders_task',
+        'schedule': timedelta(days=1),
+    },
+    'prune-sync-tombstones': {
+        'task': 'products.tasks.prune_sync_tombstones_task',
+        'schedule': timedelta(days=1),
+    },
+    'submit-crc-batches': {
+        'task': 'paylater.tasks.submit_crc_batches_task',
+        'schedule': CRC_BATCH_WINDOW,
+    },
+    'reclaim-stale-crc-checks': {
+        'task': 'paylater.tasks.reclaim_stale_crc_checks_task',
+        'schedule': CRC_LEASE_SWEEP_INTERVAL,
+    },
+}
 
 
 ROOT_URLCONF = 'apis.urls'
@@ -167,6 +297,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # checkouts queue up (for up to `timeout` seconds) instead of
+            # failing with "database is locked" when a reader tries to write.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            # WAL lets readers keep going while a checkout is writing
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
+        'TEST': {
+            # A file rather than shared-cache memory, so the concurrency tests'
+            # threads get SQLite's normal locking and busy timeout
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -0,0 +1,52 @@
+# apis/streaming.py
+"""
+Helpers for streaming large exports as NDJSON or CSV.
+
+Rows are produced lazily by a generator and written to the client as they
+are encoded, so memory use stays constant however many rows are exported.
+"""
+import csv
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+
+class _Echo:
+    """File-like object whose write() hands the encoded line back to the caller."""
+    def write(self, value):
+        return value
+
+
+def chunked(iterable, size):
+    """Yields lists of up to `size` items from any iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_response(rows, filename):
+    encoder = DjangoJSONEncoder()
+    response = StreamingHttpResponse(
+        (encoder.encode(row) + '\n' for row in rows), content_type='application/x-ndjson'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.ndjson"'
+    return response
+
+
+def csv_response(rows, fieldnames, filename):
+    writer = csv.DictWriter(_Echo(), fieldnames=fieldnames, extrasaction='ignore')
+
+    def lines():
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
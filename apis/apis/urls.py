@@ -19,6 +19,7 @@ urlpatterns = [
     path('api/users/', include('users.urls')),
     path('api/paylater/', include('paylater.urls')),
     path('api/orders/', include('orders.urls')),
+    path('api/analytics/', include('analytics.urls')),
     # ... other app urls
 ]
 
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idempotency', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, help_text='When a retry may take over the key if no response was stored by then.', null=True),
+        ),
+    ]
@@ -0,0 +1,125 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+def request_fingerprint(request):
+    """SHA-256 over the method, path and a canonical encoding of the request body."""
+    data = request.data
+    if hasattr(data, 'lists'): # QueryDict from form/multipart bodies
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), cls=JSONEncoder, default=str)
+    return hashlib.sha256(f"{request.method}\n{request.path}\n{body}".encode()).hexdigest()
+
+def purge_expired_keys(now=None):
+    """Deletes keys past their TTL; returns how many were removed."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
+class IdempotentCreateMixin:
+    """
+    Makes a create endpoint safe to retry. When the client sends an
+    Idempotency-Key header, the first request claims the key (committed before
+    the view runs, so a concurrent retry sees it) and its response is stored
+    against it. Retries with the same key and body get the stored response
+    back without running the view again. The same key with a different body
+    is rejected with 422. A retry that arrives while the first request is
+    still running gets 409, until the claim's lease (IDEMPOTENCY_CLAIM_TTL)
+    runs out: then the first request is presumed dead and the retry takes
+    the key over. A request that lost its key stores nothing.
+
+    Requests without the header behave as before.
+    """
+    idempotency_scope = None
+
+    def post(self, request, *args, **kwargs):
+        # Wraps post() rather than create() so views can keep overriding create()
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return super().post(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"detail": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        record, early_response = self._claim_idempotency_key(request, key)
+        if early_response is not None:
+            return early_response
+
+        # Only while this request still holds the claim, not a retry that took it over
+        claim = IdempotencyKey.objects.filter(pk=record.pk, claimed_until=record.claimed_until)
+        try:
+            response = super().post(request, *args, **kwargs)
+        except Exception:
+            # Nothing was stored, so let the client retry with the same key
+            claim.delete()
+            raise
+
+        if response.status_code >= 500:
+            claim.delete()
+        else:
+            # Stored through the renderer's encoder so Decimals/dates replay as sent
+            claim.update(
+                status_code=response.status_code,
+                response_body=json.loads(json.dumps(response.data, cls=JSONEncoder)),
+            )
+        return response
+
+    def _claim_idempotency_key(self, request, key):
+        """Returns (record, None) when this request owns the key, else (None, response)."""
+        now = timezone.now()
+        fingerprint = request_fingerprint(request)
+        lookup = {'user': request.user, 'scope': self.idempotency_scope or self.__class__.__name__, 'key': key}
+
+        existing = IdempotencyKey.objects.filter(**lookup).first()
+        if existing is not None and existing.expires_at <= now:
+            existing.delete()
+            existing = None
+
+        if existing is not None:
+            if existing.fingerprint != fingerprint:
+                return None, Response(
+                    {"detail": f"This {IDEMPOTENCY_HEADER} was already used with a different request."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if existing.status_code is None:
+                if existing.claimed_until is None or existing.claimed_until <= now:
+                    # The lease ran out: take the key over, unless another retry just did
+                    if IdempotencyKey.objects.filter(
+                        pk=existing.pk, status_code__isnull=True, claimed_until=existing.claimed_until
+                    ).update(claimed_until=now + settings.IDEMPOTENCY_CLAIM_TTL):
+                        existing.claimed_until = now + settings.IDEMPOTENCY_CLAIM_TTL
+                        return existing, None
+                return None, Response(
+                    {"detail": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."},
+                    status=status.HTTP_409_CONFLICT
+                )
+            return None, Response(
+                existing.response_body, status=existing.status_code, headers={REPLAYED_HEADER: 'true'}
+            )
+
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    fingerprint=fingerprint, expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                    claimed_until=now + settings.IDEMPOTENCY_CLAIM_TTL, **lookup
+                )
+        except IntegrityError:
+            # Another request with this key claimed it between our read and insert
+            return None, Response(
+                {"detail": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."},
+                status=status.HTTP_409_CONFLICT
+            )
+        return record, None
@@ -0,0 +1,31 @@
+from django.db import models
+from django.contrib.auth import get_user_model
+
+User = get_user_model()
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied Idempotency-Key together with the request it was first
+    used for and the response that request produced. status_code stays null
+    while the first request is still being processed, which it holds the key
+    for until claimed_until.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=100, help_text="The endpoint the key was used on.")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of the method, path and request body.")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    claimed_until = models.DateTimeField(
+        null=True, blank=True, help_text="When a retry may take over the key if no response was stored by then."
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} for {self.user.username}"
@@ -0,0 +1,11 @@
+from celery import shared_task
+
+from .mixins import purge_expired_keys
+
+@shared_task
+def purge_expired_idempotency_keys_task():
+    """
+    Celery task to delete Idempotency-Key records past IDEMPOTENCY_KEY_TTL.
+    """
+    deleted = purge_expired_keys()
+    print(f"Purged {deleted} expired idempotency keys.")
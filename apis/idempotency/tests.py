@@ -0,0 +1,137 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order, PaymentOutbox
+from paylater.models import PayLaterApplication
+from products.models import Product
+from .mixins import purge_expired_keys
+from .models import IdempotencyKey
+
+User = get_user_model()
+
+
+class OrderIdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='pass12345')
+        self.product = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, key=None, quantity=2):
+        payload = {
+            'payment_option': 'OUTRIGHT',
+            'delivery_address': '1 Market Road',
+            'delivery_phone_number': '08000000000',
+            'items': [{'product_id': self.product.pk, 'quantity': quantity}],
+        }
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post(reverse('order-create'), payload, format='json', **headers)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.checkout('retry-1')
+        self.assertEqual(first.status_code, 201)
+
+        # One lookup of the stored key; no transaction, stock or payment work
+        with self.assertNumQueries(1):
+            retry = self.checkout('retry-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+        self.assertEqual(PaymentOutbox.objects.count(), 1)
+
+    def test_key_reused_with_a_different_body_is_rejected(self):
+        self.assertEqual(self.checkout('retry-2').status_code, 201)
+        response = self.checkout('retry-2', quantity=3)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_still_in_progress_is_a_conflict(self):
+        response = self.checkout('retry-3')
+        IdempotencyKey.objects.filter(key='retry-3').update(status_code=None, response_body=None)
+        self.assertEqual(self.checkout('retry-3').status_code, 409)
+        self.assertEqual(response.status_code, 201)
+
+    def test_retry_takes_over_a_claim_whose_lease_ran_out(self):
+        self.checkout('retry-6')
+        Order.objects.all().delete()
+        # The first request died after claiming the key
+        IdempotencyKey.objects.filter(key='retry-6').update(
+            status_code=None, response_body=None, claimed_until=timezone.now() - timedelta(seconds=1)
+        )
+        retry = self.checkout('retry-6')
+        self.assertEqual(retry.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.checkout('retry-6')['Idempotent-Replayed'], 'true')
+
+    def test_request_that_lost_its_claim_stores_nothing(self):
+        self.checkout('retry-7')
+        record = IdempotencyKey.objects.get(key='retry-7')
+        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=None, response_body=None)
+        with mock.patch('idempotency.mixins.IdempotentCreateMixin._claim_idempotency_key',
+                        return_value=(record, None)):
+            # claimed_until moved on: a retry took the key over meanwhile
+            IdempotencyKey.objects.filter(pk=record.pk).update(claimed_until=timezone.now() + timedelta(minutes=1))
+            self.assertEqual(self.checkout('retry-7').status_code, 201)
+        self.assertIsNone(IdempotencyKey.objects.get(pk=record.pk).status_code)
+
+    def test_client_errors_are_replayed_too(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        self.assertEqual(self.checkout('retry-4').status_code, 400)
+        Product.objects.filter(pk=self.product.pk).update(stock=10)
+        replay = self.checkout('retry-4')
+        self.assertEqual(replay.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        self.checkout('retry-5')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertNotIn('Idempotent-Replayed', self.checkout('retry-5'))
+        self.assertEqual(Order.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+
+    def test_requests_without_a_key_are_not_recorded(self):
+        self.checkout()
+        self.checkout()
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_keys_are_scoped_per_user(self):
+        self.checkout('shared')
+        other = User.objects.create_user(username='other', password='pass12345')
+        self.client.force_authenticate(other)
+        self.assertNotIn('Idempotent-Replayed', self.checkout('shared'))
+        self.assertEqual(Order.objects.filter(user=other).count(), 1)
+
+
+class PayLaterApplicationIdempotencyTests(TestCase):
+
+    def test_retry_does_not_queue_a_second_crc_check(self):
+        user = User.objects.create_user(username='applicant', password='pass12345')
+        client = APIClient()
+        client.force_authenticate(user)
+        payload = {
+            'full_name': 'Test Applicant', 'national_id_number': 'NIN-42', 'date_of_birth': '1990-01-01',
+            'address': '1 Market Road', 'phone_number': '08000000000', 'monthly_income': '250000.00',
+        }
+        with mock.patch('paylater.views.queue_crc_check') as queue_crc_check:
+            first = client.post(reverse('pay_later_apply'), payload, format='json', HTTP_IDEMPOTENCY_KEY='apply-1')
+            retry = client.post(reverse('pay_later_apply'), payload, format='json', HTTP_IDEMPOTENCY_KEY='apply-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(queue_crc_check.call_count, 1)
+        self.assertEqual(PayLaterApplication.objects.count(), 1)
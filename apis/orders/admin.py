@@ -1,3 +1,68 @@
-from django.contrib import admin
+# orders/admin.py
+from django.contrib import admin, messages
 
-# Register your models here.
+from .models import Order, OrderStatusHistory, Repayment
+from .transitions import transition_orders
+
+
+def transition_action(field, target):
+    """Builds an admin action that moves the selected orders with one set-based UPDATE."""
+    def action(modeladmin, request, queryset):
+        result = transition_orders(queryset.values_list('pk', flat=True), field, target,
+                                   user=request.user, note='Admin bulk action')
+        modeladmin.message_user(request, f"{result.updated} order(s) moved to {target}.", messages.SUCCESS)
+        if result.skipped:
+            modeladmin.message_user(
+                request, f"{len(result.skipped)} order(s) skipped; their current {field} can't move to {target}.",
+                messages.WARNING,
+            )
+    action.__name__ = f'mark_{field}_{target.lower()}'
+    label = 'payment ' if field == 'payment_status' else ''
+    return admin.action(description=f"Mark selected orders {label}{target.replace('_', ' ').lower()}")(action)
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'payment_status', 'payment_option', 'total_amount', 'created_at']
+    list_filter = ['status', 'payment_status', 'payment_option']
+    list_select_related = ['user']
+    search_fields = ['id', 'user__username', 'transaction_ref']
+    raw_id_fields = ('user', 'pay_later_application')
+    # Status fields only change through the actions, so every change is validated and logged
+    readonly_fields = ['status', 'payment_status']
+    actions = [
+        transition_action('status', 'PROCESSING'),
+        transition_action('status', 'SHIPPED'),
+        transition_action('status', 'DELIVERED'),
+        transition_action('status', 'COMPLETED'),
+        transition_action('status', 'CANCELLED'),
+        transition_action('payment_status', 'REFUNDED'),
+    ]
+
+
+class AppendOnlyAdmin(admin.ModelAdmin):
+    """Ledgers are written by the app only; the admin can read them."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OrderStatusHistory)
+class OrderStatusHistoryAdmin(AppendOnlyAdmin):
+    list_display = ['order_id', 'field', 'from_value', 'to_value', 'changed_by', 'changed_at', 'note']
+    list_filter = ['field', 'to_value']
+    search_fields = ['=order__id']
+
+
+@admin.register(Repayment)
+class RepaymentAdmin(AppendOnlyAdmin):
+    list_display = ['order_id', 'user', 'source', 'amount', 'balance_after', 'reference', 'created_at']
+    list_filter = ['source']
+    list_select_related = ['user']
+    search_fields = ['=order__id', 'reference', 'user__username']
@@ -0,0 +1,89 @@
+# orders/archive.py
+"""
+Moves finished orders out of the hot Order/OrderItem tables.
+
+An order is archived once it is in a final status (ARCHIVABLE_STATUSES),
+was placed more than ORDER_ARCHIVE_AFTER ago and owes nothing: a Pay Later
+balance still being repaid keeps the order where the repayment ledger,
+overdue listings and exposure reconciliation read it. Each chunk of orders is
+copied into ArchivedOrder/ArchivedOrderItem and deleted from the hot
+tables in one short transaction, so readers always find an order in
+exactly one of the two places. Rows are copied with INSERT ... SELECT and
+never loaded into Python.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, PaymentOutbox
+from .signals import orders_archived
+
+ARCHIVABLE_STATUSES = ('COMPLETED', 'CANCELLED', 'REFUNDED')
+
+ORDER_COLUMNS = [
+    'id', 'user_id', 'created_at', 'updated_at', 'status', 'payment_status',
+    'delivery_address', 'delivery_phone_number', 'total_amount', 'payment_option',
+    'transaction_ref', 'pay_later_application_id', 'instalment_paid_amount',
+    'remaining_balance', 'repayment_due_date',
+]
+ITEM_COLUMNS = ['order_id', 'product_id', 'quantity', 'price']
+
+
+def archivable_orders(older_than=None):
+    cutoff = timezone.now() - (older_than or settings.ORDER_ARCHIVE_AFTER)
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff, remaining_balance=0)
+
+
+def _move_chunk(order_ids, archived_at):
+    """Copies orders and their lines into the archive with INSERT ... SELECT, then deletes them."""
+    quote = connection.ops.quote_name
+    in_ids = ', '.join(['%s'] * len(order_ids))
+    order_columns = ', '.join(quote(column) for column in ORDER_COLUMNS)
+    item_columns = ', '.join(quote(column) for column in ITEM_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(ArchivedOrder._meta.db_table)} ({order_columns}, {quote('archived_at')}) "
+            f"SELECT {order_columns}, %s FROM {quote(Order._meta.db_table)} WHERE {quote('id')} IN ({in_ids})",
+            [connection.ops.adapt_datetimefield_value(archived_at), *order_ids],
+        )
+        cursor.execute(
+            f"INSERT INTO {quote(ArchivedOrderItem._meta.db_table)} ({item_columns}) "
+            f"SELECT {item_columns} FROM {quote(OrderItem._meta.db_table)} "
+            f"WHERE {quote('order_id')} IN ({in_ids}) ORDER BY {quote('id')}",
+            order_ids,
+        )
+    # Nothing references lines or outbox rows, so these are single DELETEs; with
+    # them gone the orders can be deleted without loading them into memory
+    OrderItem.objects.filter(order_id__in=order_ids).delete()
+    PaymentOutbox.objects.filter(order_id__in=order_ids).delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(Order._meta.db_table)} WHERE {quote('id')} IN ({in_ids})", order_ids
+        )
+    orders_archived.send(sender=Order, order_ids=order_ids)
+
+
+def archive_orders(older_than=None, chunk_size=None):
+    """Archives every eligible order, chunk_size per transaction; returns how many moved."""
+    chunk_size = chunk_size or settings.ORDER_ARCHIVE_CHUNK_SIZE
+    archived_at = timezone.now()
+    moved, after = 0, 0
+    while True:
+        with transaction.atomic():
+            candidates = archivable_orders(older_than).filter(pk__gt=after).order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            order_ids = list(candidates.values_list('pk', flat=True)[:chunk_size])
+            if not order_ids:
+                return moved
+            _move_chunk(order_ids, archived_at)
+        moved += len(order_ids)
+        after = order_ids[-1]
+
+
+def archived_order_detail_queryset():
+    """ArchivedOrders with what OrderDetailSerializer reads, like order_detail_queryset()."""
+    return ArchivedOrder.objects.select_related('user', 'pay_later_application').prefetch_related(
+        Prefetch('items', queryset=ArchivedOrderItem.objects.select_related('product'))
+    )
@@ -0,0 +1,80 @@
+# orders/exports.py
+"""
+Order history export rows. Orders are read in chunks with their user, items
+and products prefetched once per chunk rather than once per order. Archived
+orders are included, marked `archived`, so an export covers the whole history.
+"""
+from django.db.models import Prefetch
+from rest_framework.fields import DateTimeField
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ORDER_FIELDS = [
+    'id', 'archived', 'user', 'created_at', 'updated_at', 'status', 'payment_status', 'payment_option',
+    'total_amount', 'instalment_paid_amount', 'remaining_balance', 'repayment_due_date',
+    'transaction_ref', 'delivery_address', 'delivery_phone_number',
+]
+
+ITEM_FIELDS = ['product_id', 'product_name', 'quantity', 'price']
+
+# The CSV export has one line per order item, repeating the order columns
+CSV_FIELDS = ORDER_FIELDS + [f'item_{name}' for name in ITEM_FIELDS]
+
+_format_datetime = DateTimeField().to_representation
+
+
+def order_export_rows(queryset=None, chunk_size=500, archived_queryset=None):
+    """
+    Yields one dict per order, with its lines under `items`: archived orders
+    first (they are the oldest), then the rest. Without arguments that's
+    every order in both tables; a custom `queryset` only gets archived
+    orders if `archived_queryset` is given too.
+    """
+    if queryset is None and archived_queryset is None:
+        archived_queryset = ArchivedOrder.objects.all()
+    if archived_queryset is not None:
+        yield from _rows(archived_queryset, ArchivedOrderItem, chunk_size, archived=True)
+    yield from _rows(Order.objects.all() if queryset is None else queryset, OrderItem, chunk_size, archived=False)
+
+
+def _rows(queryset, item_model, chunk_size, archived):
+    queryset = queryset.select_related('user').prefetch_related(
+        Prefetch('items', queryset=item_model.objects.select_related('product').only(
+            'order_id', 'product_id', 'quantity', 'price', 'product__name'
+        ).order_by('pk'))
+    ).order_by('pk')
+    # With a chunk_size, iterator() runs the prefetch once per chunk of orders
+    for order in queryset.iterator(chunk_size=chunk_size):
+        yield {
+            'id': order.id,
+            'archived': archived,
+            'user': order.user.username,
+            'created_at': _format_datetime(order.created_at),
+            'updated_at': _format_datetime(order.updated_at),
+            'status': order.status,
+            'payment_status': order.payment_status,
+            'payment_option': order.payment_option,
+            'total_amount': order.total_amount,
+            'instalment_paid_amount': order.instalment_paid_amount,
+            'remaining_balance': order.remaining_balance,
+            'repayment_due_date': order.repayment_due_date,
+            'transaction_ref': order.transaction_ref,
+            'delivery_address': order.delivery_address,
+            'delivery_phone_number': order.delivery_phone_number,
+            'items': [
+                {
+                    'product_id': item.product_id,
+                    'product_name': item.product.name,
+                    'quantity': item.quantity,
+                    'price': item.price,
+                }
+                for item in order.items.all()
+            ],
+        }
+
+
+def order_csv_rows(rows):
+    for row in rows:
+        items = row.pop('items')
+        for item in items:
+            yield {**row, **{f'item_{name}': value for name, value in item.items()}}
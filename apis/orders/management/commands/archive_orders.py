@@ -0,0 +1,27 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from orders.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Moves COMPLETED/CANCELLED/REFUNDED orders older than ORDER_ARCHIVE_AFTER into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help="Archive orders placed more than this many days ago (default: ORDER_ARCHIVE_AFTER).")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Number of orders moved per transaction (default: ORDER_ARCHIVE_CHUNK_SIZE).")
+
+    def handle(self, *args, **options):
+        older_than = options['older_than_days']
+        started = time.monotonic()
+        archived = archive_orders(
+            older_than=timedelta(days=older_than) if older_than is not None else None,
+            chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} orders in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.repayments import reconcile_exposure
+
+
+class Command(BaseCommand):
+    help = "Recomputes every Pay Later user's credit exposure from their open orders and reports any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of applications checked per transaction.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report drift without correcting it.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        drift = reconcile_exposure(chunk_size=options['chunk_size'], fix=not options['dry_run'])
+        for application_id, (cached, actual) in sorted(drift.items()):
+            self.stdout.write(f"Application {application_id}: cached {cached}, actual {actual} ({actual - cached:+})")
+        verb = "Found" if options['dry_run'] else "Corrected"
+        style = self.style.WARNING if drift else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{verb} {len(drift)} drifted credit exposure(s) in {time.monotonic() - started:.1f}s."
+        ))
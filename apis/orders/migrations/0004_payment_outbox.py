@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('FULL_PAYMENT', 'Full payment'), ('UPFRONT_INSTALMENT', '40% upfront instalment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('IN_FLIGHT', 'In flight'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(help_text='Not dispatched before this time (retry backoff).')),
+                ('claimed_until', models.DateTimeField(blank=True, help_text='A dispatcher that crashed mid-send loses its claim after this.', null=True)),
+                ('transaction_ref', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_requests', to='orders.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='orders_paym_status_2ce89d_idx')],
+            },
+        ),
+    ]
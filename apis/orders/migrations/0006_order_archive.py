@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_user_status_created_at_index'),
+        ('paylater', '0001_initial'),
+        ('products', '0007_product_reserved_stock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending Payment'), ('PROCESSING', 'Processing'), ('SHIPPED', 'Shipped'), ('DELIVERED', 'Delivered'), ('CANCELLED', 'Cancelled'), ('COMPLETED', 'Completed'), ('REFUNDED', 'Refunded')], max_length=50)),
+                ('payment_status', models.CharField(choices=[('PENDING', 'Pending'), ('PAID', 'Paid'), ('PARTIALLY_PAID', 'Partially Paid'), ('FULLY_REPAID', 'Fully Repaid'), ('FAILED', 'Failed'), ('REFUNDED', 'Refunded')], max_length=50)),
+                ('delivery_address', models.TextField()),
+                ('delivery_phone_number', models.CharField(max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('payment_option', models.CharField(choices=[('OUTRIGHT', 'Pay Outright'), ('PAY_LATER_40', 'Pay Later (40% upfront)'), ('PAY_LATER_0', 'Pay Later (0% upfront)')], max_length=20)),
+                ('transaction_ref', models.CharField(blank=True, max_length=255, null=True)),
+                ('instalment_paid_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('remaining_balance', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('repayment_due_date', models.DateField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('pay_later_application', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to='paylater.paylaterapplication')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=2, help_text='Price of product at time of order', max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created_at'], name='orders_arch_user_id_6febd8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'status', '-created_at'], name='orders_arch_user_id_a98e9b_idx'),
+        ),
+    ]
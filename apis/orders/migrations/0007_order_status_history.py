@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('status', 'Order status'), ('payment_status', 'Payment status')], max_length=20)),
+                ('from_value', models.CharField(max_length=50)),
+                ('to_value', models.CharField(max_length=50)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('changed_at', models.DateTimeField()),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='status_history', to='orders.order')),
+            ],
+            options={
+                'verbose_name_plural': 'order status history',
+                'indexes': [models.Index(fields=['order', 'changed_at'], name='orders_orde_order_i_7978aa_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_outstanding_balances(apps, schema_editor):
+    """Seeds each application's outstanding_balance from its user's open orders, in one UPDATE."""
+    Order = apps.get_model('orders', 'Order')
+    PayLaterApplication = apps.get_model('paylater', 'PayLaterApplication')
+    owed = (Order.objects.filter(user=OuterRef('user'), payment_option__in=['PAY_LATER_40', 'PAY_LATER_0'])
+            .values('user').annotate(total=Sum('remaining_balance')).values('total'))
+    PayLaterApplication.objects.update(outstanding_balance=Coalesce(
+        Subquery(owed, output_field=DecimalField(max_digits=12, decimal_places=2)), Value(0),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_status_history'),
+        ('paylater', '0002_paylaterapplication_outstanding_balance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Repayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('UPFRONT', '40% upfront instalment'), ('REPAYMENT', 'Repayment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('balance_after', models.DecimalField(decimal_places=2, help_text="The order's remaining balance once this was applied.", max_digits=10)),
+                ('reference', models.CharField(help_text="Payment reference; a webhook delivered twice can't pay twice.", max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='paymentoutbox',
+            name='kind',
+            field=models.CharField(choices=[('FULL_PAYMENT', 'Full payment'), ('UPFRONT_INSTALMENT', '40% upfront instalment'), ('REPAYMENT', 'Pay Later repayment')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('remaining_balance__gt', 0)), fields=['repayment_due_date'], name='order_open_repayment_due_idx'),
+        ),
+        migrations.AddField(
+            model_name='repayment',
+            name='order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='repayments', to='orders.order'),
+        ),
+        migrations.AddField(
+            model_name='repayment',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='repayments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='repayment',
+            index=models.Index(fields=['order', 'created_at'], name='orders_repa_order_i_502d2c_idx'),
+        ),
+        migrations.RunPython(backfill_outstanding_balances, migrations.RunPython.noop),
+    ]
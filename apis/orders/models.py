@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 from products.models import Product # Assuming products app is available
@@ -58,9 +60,18 @@ class Order(models.Model):
                                            help_text="Remaining amount to be paid for Pay Later.")
     repayment_due_date = models.DateField(null=True, blank=True,
                                          help_text="Date by which the remaining balance must be paid.")
-    
-    # For tracking multiple repayments for Pay Later (optional, more advanced)
-    # You might have a separate `Repayment` model linked to Order for this.
+
+    # Individual repayments are recorded in the Repayment ledger; remaining_balance
+    # is kept in step with it by orders/repayments.py
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at']), # Index for a user's order history
+            models.Index(fields=['user', 'status', '-created_at']), # Index for history filtered by status
+            # Index for "due in N days" and "overdue" scans over orders that still owe money
+            models.Index(fields=['repayment_due_date'], condition=models.Q(remaining_balance__gt=0),
+                         name='order_open_repayment_due_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username} - {self.status}"
@@ -72,4 +83,213 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Price of product at time of order")
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
+
+class StockReservation(models.Model):
+    """
+    A time-limited hold on stock while the user goes through payment. Held
+    units are counted in Product.reserved_stock until the reservation is
+    confirmed by an order, released by the user or swept once it expires.
+    """
+    ACTIVE = 'ACTIVE'
+    CONFIRMED = 'CONFIRMED'
+    RELEASED = 'RELEASED'
+    EXPIRED = 'EXPIRED'
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (CONFIRMED, 'Confirmed'), # Converted into an order
+        (RELEASED, 'Released'),   # Given back by the user
+        (EXPIRED, 'Expired'),     # Given back by the sweeper
+    ]
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=ACTIVE)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']), # Index for the expiry sweep
+        ]
+
+    def __str__(self):
+        return f"Reservation {self.token} by {self.user.username} - {self.status}"
+
+class StockReservationItem(models.Model):
+    reservation = models.ForeignKey(StockReservation, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} held by reservation {self.reservation.token}"
+
+class PaymentOutbox(models.Model):
+    """
+    A payment the gateway still has to be asked for, written in the same
+    transaction as its order. The dispatcher task sends these after commit,
+    so checkout never holds the database write lock across a network call.
+    """
+    FULL_PAYMENT = 'FULL_PAYMENT'
+    UPFRONT_INSTALMENT = 'UPFRONT_INSTALMENT'
+    REPAYMENT = 'REPAYMENT'
+    KIND_CHOICES = [
+        (FULL_PAYMENT, 'Full payment'),
+        (UPFRONT_INSTALMENT, '40% upfront instalment'),
+        (REPAYMENT, 'Pay Later repayment'),
+    ]
+
+    PENDING = 'PENDING'
+    IN_FLIGHT = 'IN_FLIGHT'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),     # Waiting for the dispatcher
+        (IN_FLIGHT, 'In flight'), # Claimed by a dispatcher until claimed_until
+        (SENT, 'Sent'),           # Gateway accepted it; the webhook reports the outcome
+        (FAILED, 'Failed'),       # Gave up after PAYMENT_OUTBOX_MAX_ATTEMPTS
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_requests')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(help_text="Not dispatched before this time (retry backoff).")
+    claimed_until = models.DateTimeField(null=True, blank=True,
+                                         help_text="A dispatcher that crashed mid-send loses its claim after this.")
+    transaction_ref = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']), # Index for the dispatcher's claim query
+        ]
+
+    @property
+    def reference(self):
+        """Our idempotency reference for the gateway, stable across retries."""
+        return f"minimart-{self.order_id}-{self.pk}"
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.amount} for order {self.order_id} - {self.status}"
+
+class ArchivedOrder(models.Model):
+    """
+    An order moved out of the hot Order table by orders/archive.py once it
+    reached a final status and aged past ORDER_ARCHIVE_AFTER. It keeps the
+    original order id, so ids stay unique across both tables.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    status = models.CharField(max_length=50, choices=Order.ORDER_STATUS_CHOICES)
+    payment_status = models.CharField(max_length=50, choices=Order.PAYMENT_STATUS_CHOICES)
+
+    delivery_address = models.TextField()
+    delivery_phone_number = models.CharField(max_length=20)
+
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    payment_option = models.CharField(max_length=20, choices=Order.PAYMENT_OPTION_CHOICES)
+    transaction_ref = models.CharField(max_length=255, blank=True, null=True)
+
+    pay_later_application = models.ForeignKey(
+        PayLaterApplication, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders'
+    )
+    instalment_paid_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    remaining_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    repayment_due_date = models.DateField(null=True, blank=True)
+
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at']), # Index for a user's order history
+            models.Index(fields=['user', 'status', '-created_at']), # Index for history filtered by status
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id} by {self.user.username} - {self.status}"
+
+class ArchivedOrderItem(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Price of product at time of order")
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} in archived order {self.order_id}"
+
+class OrderStatusHistory(models.Model):
+    """
+    Append-only log of order status and payment status changes, written by
+    orders/transitions.py in the same transaction as the change. It is not
+    a foreign key constraint, so the log outlives archiving.
+    """
+    FIELD_CHOICES = [
+        ('status', 'Order status'),
+        ('payment_status', 'Payment status'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name='status_history')
+    field = models.CharField(max_length=20, choices=FIELD_CHOICES)
+    from_value = models.CharField(max_length=50)
+    to_value = models.CharField(max_length=50)
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    note = models.CharField(max_length=255, blank=True)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'changed_at']), # Index for one order's timeline
+        ]
+        verbose_name_plural = 'order status history'
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Order status history is append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Order {self.order_id} {self.field}: {self.from_value} -> {self.to_value}"
+
+class Repayment(models.Model):
+    """
+    Append-only ledger of money paid towards a Pay Later order's balance,
+    written by orders/repayments.py in the same transaction that lowers
+    Order.remaining_balance and the user's outstanding balance. Like
+    OrderStatusHistory it has no FK constraint, so it outlives archiving.
+    """
+    UPFRONT = 'UPFRONT'
+    REPAYMENT = 'REPAYMENT'
+    SOURCE_CHOICES = [
+        (UPFRONT, '40% upfront instalment'),
+        (REPAYMENT, 'Repayment'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name='repayments')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='repayments')
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2,
+                                        help_text="The order's remaining balance once this was applied.")
+    reference = models.CharField(max_length=255, unique=True,
+                                 help_text="Payment reference; a webhook delivered twice can't pay twice.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'created_at']), # Index for one order's statement
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Repayments are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Repayment of {self.amount} on order {self.order_id}"
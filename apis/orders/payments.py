@@ -0,0 +1,189 @@
+# orders/payments.py
+"""
+Payment gateway integration through a transactional outbox.
+
+Checkout only inserts a PaymentOutbox row next to the order, so its write
+transaction covers local database work alone. The dispatcher task then
+claims due rows in batches, commits the claim, and calls the gateway
+outside any transaction. The gateway reports the outcome to
+PaymentWebhookView, which moves the order's payment_status along. A
+payment that finally fails cancels its order (fail_payments()).
+
+Calls carry PaymentOutbox.reference, which doesn't change across retries,
+so a row re-sent after a crash can't charge the customer twice.
+"""
+import hashlib
+import hmac
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Order, OrderItem, PaymentOutbox, Repayment
+from .repayments import record_repayment, settle_repayment
+from .stock import restock
+from .transitions import transition_orders
+
+SIGNATURE_HEADER = 'X-Gateway-Signature'
+
+class PaymentGatewayError(Exception):
+    """The gateway refused the request or couldn't be reached; it is retried later."""
+
+def initiate_payment(payment):
+    """
+    Asks the gateway to start collecting `payment` and returns its transaction
+    reference. This would call your chosen payment gateway (e.g., Paystack,
+    Stripe) with payment.reference as the idempotency key, and raise
+    PaymentGatewayError on a refusal or network error.
+
+    For this example, we just simulate success.
+    """
+    print(f"Simulating payment initiation for order {payment.order_id}, amount {payment.amount}, "
+          f"for: {payment.get_kind_display()}")
+    return f"SIM-{payment.reference}"
+
+def queue_payment(order, kind, amount):
+    """Adds the outbox row for `order`; call inside the transaction that creates the order."""
+    return PaymentOutbox.objects.create(order=order, kind=kind, amount=amount, available_at=timezone.now())
+
+def retry_delay(attempts):
+    """Exponential backoff: 10s, 20s, 40s, ... capped at an hour."""
+    return min(timedelta(seconds=10 * 2 ** (attempts - 1)), timedelta(hours=1))
+
+def claim_payments(batch_size, now=None):
+    """
+    Claims up to batch_size due rows (including ones whose dispatcher died
+    mid-send) in one short transaction, and returns them. Where the
+    database supports it, rows another dispatcher is claiming are skipped.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = PaymentOutbox.objects.filter(
+            Q(status=PaymentOutbox.PENDING, available_at__lte=now) |
+            Q(status=PaymentOutbox.IN_FLIGHT, claimed_until__lt=now)
+        ).order_by('available_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        PaymentOutbox.objects.filter(pk__in=ids).update(
+            status=PaymentOutbox.IN_FLIGHT, attempts=F('attempts') + 1,
+            claimed_until=now + settings.PAYMENT_OUTBOX_CLAIM_TTL, updated_at=now,
+        )
+    return list(PaymentOutbox.objects.filter(pk__in=ids).order_by('available_at'))
+
+def _record_sent(payment, transaction_ref):
+    with transaction.atomic():
+        PaymentOutbox.objects.filter(pk=payment.pk, status=PaymentOutbox.IN_FLIGHT).update(
+            status=PaymentOutbox.SENT, transaction_ref=transaction_ref, claimed_until=None,
+            last_error='', updated_at=timezone.now(),
+        )
+        Order.objects.filter(pk=payment.order_id, transaction_ref__isnull=True).update(
+            transaction_ref=transaction_ref, updated_at=timezone.now()
+        )
+
+def fail_payments(order_ids, note=''):
+    """
+    Marks the orders' payment FAILED and cancels them, in one transaction:
+    cancelling writes off their Pay Later credit (orders/repayments.py),
+    and the stock checkout took for them goes back on hand. Orders whose
+    payment has already moved on are left alone. Returns the payment
+    status TransitionResult.
+    """
+    with transaction.atomic():
+        failed = transition_orders(order_ids, 'payment_status', 'FAILED', note=note)
+        cancelled = transition_orders(list(failed.changed), 'status', 'CANCELLED', note=note)
+        if cancelled.changed:
+            restock(dict(
+                OrderItem.objects.filter(order_id__in=list(cancelled.changed)).values('product_id')
+                .annotate(total=Sum('quantity')).values_list('product_id', 'total')
+            ))
+    return failed
+
+def _record_failure(payment, error):
+    now = timezone.now()
+    with transaction.atomic():
+        if payment.attempts >= settings.PAYMENT_OUTBOX_MAX_ATTEMPTS:
+            PaymentOutbox.objects.filter(pk=payment.pk, status=PaymentOutbox.IN_FLIGHT).update(
+                status=PaymentOutbox.FAILED, claimed_until=None, last_error=str(error), updated_at=now
+            )
+            if payment.kind != PaymentOutbox.REPAYMENT: # A failed repayment leaves the order as it was
+                fail_payments([payment.order_id], note=f"Gateway: {error}"[:255])
+        else:
+            PaymentOutbox.objects.filter(pk=payment.pk, status=PaymentOutbox.IN_FLIGHT).update(
+                status=PaymentOutbox.PENDING, claimed_until=None, last_error=str(error),
+                available_at=now + retry_delay(payment.attempts), updated_at=now,
+            )
+
+def dispatch_payments(batch_size=None):
+    """Sends every due outbox row to the gateway; returns (sent, failed) counts."""
+    batch_size = batch_size or settings.PAYMENT_OUTBOX_BATCH_SIZE
+    sent = failed = 0
+    while True:
+        batch = claim_payments(batch_size)
+        if not batch:
+            return sent, failed
+        for payment in batch:
+            try:
+                transaction_ref = initiate_payment(payment)
+            except PaymentGatewayError as exc:
+                print(f"Payment initiation failed for order {payment.order_id} (attempt {payment.attempts}): {exc}")
+                _record_failure(payment, exc)
+                failed += 1
+            else:
+                _record_sent(payment, transaction_ref)
+                sent += 1
+
+def sign_payload(body):
+    """Hex HMAC-SHA256 of a webhook body with PAYMENT_WEBHOOK_SECRET."""
+    return hmac.new(settings.PAYMENT_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+def verify_signature(body, signature):
+    """Whether `signature` is the gateway's for `body`; with no secret configured nothing is."""
+    return bool(settings.PAYMENT_WEBHOOK_SECRET and signature) and hmac.compare_digest(sign_payload(body), signature)
+
+def find_payment(reference):
+    """The outbox row for one of our `minimart-<order>-<id>` references, or None."""
+    try:
+        _, order_id, payment_id = reference.rsplit('-', 2)
+        return PaymentOutbox.objects.get(pk=int(payment_id), order_id=int(order_id))
+    except (AttributeError, ValueError, PaymentOutbox.DoesNotExist):
+        return None
+
+def apply_payment_result(payment, succeeded, transaction_ref=None):
+    """
+    Records the gateway's verdict on the order; a failed payment cancels it
+    (fail_payments()). Only an order whose payment is still PENDING is
+    changed, so a webhook delivered twice is a no-op.
+    Returns True if the order changed. Repayments are recorded in the
+    ledger instead, by orders/repayments.py.
+    """
+    now = timezone.now()
+    extra = {}
+    if transaction_ref:
+        extra['transaction_ref'] = transaction_ref
+    if payment.kind == PaymentOutbox.UPFRONT_INSTALMENT:
+        target = 'PARTIALLY_PAID'
+        extra['instalment_paid_amount'] = F('instalment_paid_amount') + payment.amount
+    else:
+        target = 'PAID'
+    with transaction.atomic():
+        if transaction_ref:
+            PaymentOutbox.objects.filter(pk=payment.pk, transaction_ref__isnull=True).update(
+                transaction_ref=transaction_ref, updated_at=now
+            )
+        if payment.kind == PaymentOutbox.REPAYMENT:
+            return succeeded and settle_repayment(payment)
+        if not succeeded:
+            return bool(fail_payments([payment.order_id], note='Payment webhook').updated)
+        result = transition_orders([payment.order_id], 'payment_status', target, note='Payment webhook', extra=extra)
+        if result.updated:
+            if payment.kind == PaymentOutbox.UPFRONT_INSTALMENT:
+                # The upfront share comes off the balance through the ledger
+                record_repayment(payment.order_id, payment.amount, payment.reference, Repayment.UPFRONT)
+            # Payment received, the order can be prepared
+            transition_orders([payment.order_id], 'status', 'PROCESSING', note='Payment received')
+        return bool(result.updated)
@@ -0,0 +1,172 @@
+# orders/repayments.py
+"""
+The Pay Later repayment ledger and credit exposure.
+
+Every amount paid towards a Pay Later balance is appended to Repayment,
+and in the same transaction it is taken off two running balances:
+Order.remaining_balance and PayLaterApplication.outstanding_balance (the
+user's total across orders). Both are relative UPDATEs, so reading what
+an order or a user owes is a single row lookup and never sums the ledger.
+
+outstanding_balance is also the user's credit exposure. Checkout adds an
+order's total to it only if that keeps it within approved_credit_limit,
+in one conditional UPDATE (take_credit), and cancelling or refunding an
+order writes its balance off again (release_credit).
+reconcile_exposure() recomputes it from the orders.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, DecimalField, F, Sum, When
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apis.streaming import chunked
+from paylater.models import PayLaterApplication
+from .models import Order, Repayment
+from .signals import orders_transitioned
+from .transitions import transition_orders
+
+PAY_LATER_OPTIONS = ('PAY_LATER_40', 'PAY_LATER_0')
+CLOSED_STATUSES = ('CANCELLED', 'REFUNDED') # Nothing is owed on these
+
+
+class RepaymentError(Exception):
+    """The repayment can't be applied to the order."""
+
+
+def add_outstanding(user, amount):
+    """Adds amount (negative to subtract) to the user's cached outstanding balance."""
+    PayLaterApplication.objects.filter(user=user).update(outstanding_balance=F('outstanding_balance') + amount)
+
+
+def take_credit(application, amount):
+    """
+    Adds amount to the application's exposure if the result stays within
+    its approved credit limit, and returns whether it did. The check and
+    the increment are one UPDATE, so concurrent checkouts can't both fit
+    into the same headroom. An application without a limit always fits.
+    """
+    applications = PayLaterApplication.objects.filter(pk=application.pk)
+    if application.approved_credit_limit:
+        applications = applications.filter(outstanding_balance__lte=F('approved_credit_limit') - amount)
+    return bool(applications.update(outstanding_balance=F('outstanding_balance') + amount))
+
+
+def release_credit(order_ids):
+    """
+    Writes off what the given Pay Later orders still owe: their balances
+    drop to zero and come off their users' exposure. Costs one aggregate
+    query and two UPDATEs per 1000 orders, however many users they span.
+    """
+    for chunk in chunked(sorted(order_ids), 1000):
+        owing = Order.objects.filter(pk__in=chunk, payment_option__in=PAY_LATER_OPTIONS, remaining_balance__gt=0)
+        owed = dict(owing.order_by().values('user_id').annotate(total=Sum('remaining_balance'))
+                    .values_list('user_id', 'total'))
+        if not owed:
+            continue
+        PayLaterApplication.objects.filter(user_id__in=owed).update(outstanding_balance=Case(
+            *[When(user_id=user_id, then=F('outstanding_balance') - total) for user_id, total in sorted(owed.items())],
+            default=F('outstanding_balance'), output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
+        owing.update(remaining_balance=0, updated_at=timezone.now())
+
+
+@receiver(orders_transitioned)
+def release_credit_of_closed_orders(sender, field, target, changed, **kwargs):
+    # Runs in the transition's transaction, with the orders already locked
+    if field == 'status' and target in CLOSED_STATUSES:
+        release_credit(changed)
+
+
+def reconcile_exposure(chunk_size=1000, fix=True):
+    """
+    Recomputes every application's exposure from its user's open Pay Later
+    orders, chunk_size applications per transaction, and returns
+    {application id: (cached, actual)} for the ones that had drifted.
+    With fix=True the drifted rows are corrected with one bulk_update per
+    chunk.
+    """
+    drift, after = {}, 0
+    while True:
+        with transaction.atomic():
+            applications = PayLaterApplication.objects.filter(pk__gt=after).order_by('pk')
+            if fix and connection.features.has_select_for_update:
+                applications = applications.select_for_update()
+            applications = list(applications.only('pk', 'user_id', 'outstanding_balance')[:chunk_size])
+            if not applications:
+                return drift
+            actual = dict(
+                open_balances().filter(user_id__in=[application.user_id for application in applications])
+                .order_by().values('user_id').annotate(total=Sum('remaining_balance')).values_list('user_id', 'total')
+            )
+            drifted = []
+            for application in applications:
+                owed = (actual.get(application.user_id) or Decimal('0')).quantize(Decimal('0.01'))
+                if application.outstanding_balance != owed:
+                    drift[application.pk] = (application.outstanding_balance, owed)
+                    application.outstanding_balance = owed
+                    drifted.append(application)
+            if fix and drifted:
+                PayLaterApplication.objects.bulk_update(drifted, ['outstanding_balance'])
+        after = applications[-1].pk
+
+
+def record_repayment(order_id, amount, reference, source=Repayment.REPAYMENT):
+    """
+    Appends a repayment and lowers the order's and the user's balances with
+    it. Returns the Repayment, or None if `reference` was already recorded
+    (a redelivered webhook). Raises RepaymentError if the amount is more
+    than the order still owes.
+    """
+    try:
+        with transaction.atomic():
+            # The balance condition makes overpaying impossible without reading first
+            if not Order.objects.filter(pk=order_id, remaining_balance__gte=amount).update(
+                remaining_balance=F('remaining_balance') - amount, updated_at=timezone.now()
+            ):
+                raise RepaymentError(f"Repayment of {amount} is more than order {order_id} still owes.")
+            order = Order.objects.only('user_id', 'remaining_balance').get(pk=order_id)
+            add_outstanding(order.user_id, -amount)
+            return Repayment.objects.create(
+                order_id=order_id, user_id=order.user_id, source=source, amount=amount,
+                balance_after=order.remaining_balance, reference=reference,
+            )
+    except IntegrityError:
+        if Repayment.objects.filter(reference=reference).exists():
+            return None
+        raise
+
+
+def settle_repayment(payment):
+    """
+    Applies a repayment the gateway collected. The order moves to
+    FULLY_REPAID once nothing is owed, and a PAY_LATER_0 order that was
+    waiting for its first payment moves on to PROCESSING.
+    """
+    with transaction.atomic():
+        repayment = record_repayment(payment.order_id, payment.amount, payment.reference)
+        if repayment is None:
+            return False
+        target = 'PARTIALLY_PAID' if repayment.balance_after else 'FULLY_REPAID'
+        transition_orders([payment.order_id], 'payment_status', target, note='Repayment received')
+        transition_orders([payment.order_id], 'status', 'PROCESSING', note='Repayment received')
+        return True
+
+
+def open_balances():
+    """Pay Later orders that still owe money; filtered the way the partial due-date index expects."""
+    return Order.objects.filter(remaining_balance__gt=0, payment_option__in=PAY_LATER_OPTIONS).exclude(
+        status__in=CLOSED_STATUSES
+    )
+
+
+def due_within(days, today=None):
+    """Open balances due in the next `days` days (including today)."""
+    today = today or timezone.localdate()
+    return open_balances().filter(repayment_due_date__range=(today, today + timedelta(days=days)))
+
+
+def overdue(today=None):
+    return open_balances().filter(repayment_due_date__lt=today or timezone.localdate())
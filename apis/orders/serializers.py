@@ -1,10 +1,33 @@
+from decimal import Decimal
+
 from rest_framework import serializers
-from .models import Order, OrderItem
+from .models import (
+    ArchivedOrder, Order, OrderItem, PaymentOutbox, Repayment, StockReservation, StockReservationItem
+)
+from .transitions import TRANSITIONS, TransitionError, allowed_sources
 from products.models import Product
 
+class ProductIdField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves product ids from the `products_by_id` map the parent serializer
+    loads in one query, instead of issuing a `get()` per order line.
+    """
+    def to_internal_value(self, data):
+        products_by_id = self.context.get('products_by_id')
+        if products_by_id is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return products_by_id[int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
 class OrderItemSerializer(serializers.ModelSerializer):
     # For incoming data from frontend, expect product_id
-    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product')
+    product_id = ProductIdField(queryset=Product.objects.all(), source='product')
     # For outgoing data (read-only), show product name and current price
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_current_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
@@ -15,12 +38,21 @@ class OrderItemSerializer(serializers.ModelSerializer):
         # The 'price' field in OrderItem model is set by backend at time of order.
         # It's not exposed for direct write from frontend.
 
-class OrderCreateSerializer(serializers.Serializer):
-    # Frontend sends: payment option, delivery details, and list of items
-    payment_option = serializers.ChoiceField(choices=Order.PAYMENT_OPTION_CHOICES)
-    delivery_address = serializers.CharField(max_length=500)
-    delivery_phone_number = serializers.CharField(max_length=20)
-    items = OrderItemSerializer(many=True, write_only=True)
+class OrderLinesMixin:
+    """Shared `items` handling for serializers that take a list of order lines."""
+
+    def to_internal_value(self, data):
+        # Load every referenced product up front so item validation is one query
+        items = data.get('items') if hasattr(data, 'get') else None
+        if isinstance(items, list):
+            product_ids = set()
+            for item in items:
+                try:
+                    product_ids.add(int(item['product_id']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self.context['products_by_id'] = Product.objects.in_bulk(product_ids)
+        return super().to_internal_value(data)
 
     def validate_items(self, items):
         if not items:
@@ -30,6 +62,55 @@ class OrderCreateSerializer(serializers.Serializer):
                 raise serializers.ValidationError("Quantity must be positive for all items.")
         return items
 
+class OrderCreateSerializer(OrderLinesMixin, serializers.Serializer):
+    # Frontend sends: payment option, delivery details, and either a list of items
+    # or the token of a stock reservation holding them
+    payment_option = serializers.ChoiceField(choices=Order.PAYMENT_OPTION_CHOICES)
+    delivery_address = serializers.CharField(max_length=500)
+    delivery_phone_number = serializers.CharField(max_length=20)
+    items = OrderItemSerializer(many=True, write_only=True, required=False)
+    reservation = serializers.UUIDField(write_only=True, required=False)
+
+    def validate(self, attrs):
+        if 'reservation' in attrs and 'items' in attrs:
+            raise serializers.ValidationError("Send either items or a reservation, not both.")
+        if 'reservation' not in attrs and 'items' not in attrs:
+            raise serializers.ValidationError({'items': "Order must contain at least one item."})
+        return attrs
+
+class StockReservationCreateSerializer(OrderLinesMixin, serializers.Serializer):
+    items = OrderItemSerializer(many=True, write_only=True)
+
+class OrderTransitionSerializer(serializers.Serializer):
+    # Staff send the orders to move, which field to move and where to
+    order_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000)
+    field = serializers.ChoiceField(choices=list(TRANSITIONS), default='status')
+    to = serializers.CharField(max_length=50)
+    note = serializers.CharField(max_length=255, required=False, default='')
+
+    def validate(self, attrs):
+        try:
+            allowed_sources(attrs['field'], attrs['to'])
+        except TransitionError as e:
+            raise serializers.ValidationError({'to': str(e)})
+        return attrs
+
+class StockReservationItemSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(read_only=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = StockReservationItem
+        fields = ['product_id', 'product_name', 'quantity']
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    items = StockReservationItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = ['token', 'status', 'expires_at', 'created_at', 'items']
+        read_only_fields = fields
+
 class OrderDetailSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True) # Nested serializer for order items
     user = serializers.StringRelatedField(read_only=True) # Shows username
@@ -49,4 +130,68 @@ class OrderDetailSerializer(serializers.ModelSerializer):
             'instalment_paid_amount', 'remaining_balance', 'repayment_due_date',
             'pay_later_application_status', 'pay_later_approved_limit'
         ]
-        read_only_fields = fields # All fields are read-only when viewing an existing order
\ No newline at end of file
+        read_only_fields = fields # All fields are read-only when viewing an existing order
+
+class OrderSummaryItemSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(read_only=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ['product_id', 'product_name', 'quantity', 'price']
+        read_only_fields = fields
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """
+    Compact order representation for history lists; OrderDetailSerializer has
+    everything. Serializes ArchivedOrders too, which have the same fields.
+    """
+    item_count = serializers.SerializerMethodField()
+    archived = serializers.SerializerMethodField()
+    items = OrderSummaryItemSerializer(many=True, read_only=True)
+    pay_later_application_status = serializers.CharField(
+        source='pay_later_application.status', read_only=True, allow_null=True
+    )
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'created_at', 'status', 'payment_status', 'payment_option',
+            'total_amount', 'remaining_balance', 'repayment_due_date',
+            'pay_later_application_status', 'item_count', 'items', 'archived'
+        ]
+        read_only_fields = fields
+
+    def get_item_count(self, obj):
+        # Counted from the prefetched lines, so it costs no query
+        return sum(item.quantity for item in obj.items.all())
+
+    def get_archived(self, obj):
+        return isinstance(obj, ArchivedOrder)
+
+class RepaymentCreateSerializer(serializers.Serializer):
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+
+class RepaymentRequestSerializer(serializers.ModelSerializer):
+    """A queued repayment; the ledger entry appears once the gateway confirms it."""
+    reference = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = PaymentOutbox
+        fields = ['reference', 'order', 'amount', 'status', 'created_at']
+        read_only_fields = fields
+
+class RepaymentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Repayment
+        fields = ['id', 'order', 'source', 'amount', 'balance_after', 'reference', 'created_at']
+        read_only_fields = fields
+
+class RepaymentDueSerializer(serializers.ModelSerializer):
+    """Staff view of an open Pay Later balance."""
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'user', 'username', 'payment_option', 'total_amount', 'remaining_balance', 'repayment_due_date']
+        read_only_fields = fields
@@ -0,0 +1,15 @@
+# orders/signals.py
+from django.dispatch import Signal
+
+# Sent inside the checkout transaction once an order and all of its lines
+# are written. Arguments: order, items (the OrderItems just created).
+order_placed = Signal()
+
+# Sent inside the transaction of every transition_orders() call that changed
+# something. Arguments: field ('status' or 'payment_status'), target,
+# changed ({order id: previous value}), user.
+orders_transitioned = Signal()
+
+# Sent inside archive_orders()'s transaction for every chunk it moves, once
+# the orders are gone from the hot tables. Arguments: order_ids.
+orders_archived = Signal()
@@ -0,0 +1,154 @@
+# orders/stock.py
+"""
+Stock accounting for checkout and reservations.
+
+Product.stock is what's physically on hand and Product.reserved_stock is
+what active StockReservations are holding; a product can be sold or
+reserved only up to stock - reserved_stock. Every change is a conditional
+or relative UPDATE, so concurrent checkouts never read-modify-write a
+product row.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.utils import timezone
+from rest_framework import status
+
+from products.cache import bump_stock_generation_on_commit
+from products.models import Product
+from .models import StockReservation, StockReservationItem
+
+class CheckoutError(Exception):
+    """Aborts checkout and rolls back its transaction; turned into an error response."""
+    def __init__(self, detail, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+def _take_available(quantities, **changes):
+    """
+    Applies `changes` to each product in {product_id: quantity}, but only
+    while that much is still available to sell. Products are updated in id
+    order so concurrent checkouts lock rows in the same order and can't
+    deadlock. Raises CheckoutError if any product runs short.
+    """
+    now = timezone.now()
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        updated = Product.objects.filter(
+            pk=product_id, stock__gte=F('reserved_stock') + quantity
+        ).update(updated_at=now, **{field: change(quantity) for field, change in changes.items()})
+        if not updated:
+            name, stock, reserved = Product.objects.filter(pk=product_id).values_list(
+                'name', 'stock', 'reserved_stock').get()
+            raise CheckoutError(f"Not enough stock for product {name}. Available: {max(stock - reserved, 0)}")
+    # Cached catalog pages read stock fresh; only those filtered on it are dropped
+    bump_stock_generation_on_commit()
+
+def _per_product(field, quantities, sign):
+    """F(field) moved by `sign * quantity` for each product, as one CASE expression."""
+    return Case(
+        *[When(pk=product_id, then=F(field) + sign * quantity) for product_id, quantity in quantities.items()],
+        default=F(field), output_field=IntegerField(),
+    )
+
+def decrement_stock(quantities):
+    """Takes stock for {product_id: quantity} outright, leaving other users' holds alone."""
+    _take_available(quantities, stock=lambda quantity: F('stock') - quantity)
+
+def restock(quantities):
+    """Puts {product_id: quantity} back on hand, e.g. for an order cancelled before it shipped."""
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            stock=_per_product('stock', quantities, 1), updated_at=timezone.now()
+        )
+        bump_stock_generation_on_commit()
+
+def reserve_stock(user, quantities, ttl=None):
+    """
+    Holds {product_id: quantity} for `user` until the reservation expires.
+    Must run inside a transaction; raises CheckoutError if anything is short.
+    """
+    _take_available(quantities, reserved_stock=lambda quantity: F('reserved_stock') + quantity)
+    reservation = StockReservation.objects.create(
+        user=user, expires_at=timezone.now() + (ttl or settings.STOCK_RESERVATION_TTL)
+    )
+    StockReservationItem.objects.bulk_create([
+        StockReservationItem(reservation=reservation, product_id=product_id, quantity=quantity)
+        for product_id, quantity in quantities.items()
+    ])
+    return reservation
+
+def confirm_reservation(token, user, quantities):
+    """
+    Turns a live reservation into sold stock. The hold already guarantees the
+    units, so this is one status flip plus one UPDATE across its products
+    instead of a checked update per line. Must run inside the checkout's
+    transaction; raises CheckoutError if the reservation is no longer active.
+    """
+    confirmed = StockReservation.objects.filter(
+        token=token, user=user, status=StockReservation.ACTIVE, expires_at__gt=timezone.now()
+    ).update(status=StockReservation.CONFIRMED, updated_at=timezone.now())
+    if not confirmed:
+        raise CheckoutError("This reservation has expired or was already used.", status.HTTP_409_CONFLICT)
+    Product.objects.filter(pk__in=quantities).update(
+        stock=_per_product('stock', quantities, -1),
+        reserved_stock=_per_product('reserved_stock', quantities, -1),
+        updated_at=timezone.now(),
+    )
+    bump_stock_generation_on_commit()
+
+def _end_reservations(reservation_ids, new_status):
+    """
+    Moves still-active reservations to RELEASED/EXPIRED and gives their units
+    back. The status update only matches ACTIVE rows, so a reservation that
+    was confirmed or released meanwhile is left alone. Runs inside the
+    caller's transaction; returns how many reservations were ended.
+    """
+    ended_ids = list(StockReservation.objects.filter(
+        pk__in=reservation_ids, status=StockReservation.ACTIVE
+    ).values_list('pk', flat=True))
+    if not ended_ids:
+        return 0
+    StockReservation.objects.filter(pk__in=ended_ids).update(status=new_status, updated_at=timezone.now())
+    quantities = dict(
+        StockReservationItem.objects.filter(reservation_id__in=ended_ids)
+        .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            reserved_stock=_per_product('reserved_stock', quantities, -1), updated_at=timezone.now()
+        )
+        bump_stock_generation_on_commit()
+    return len(ended_ids)
+
+def release_reservation(reservation):
+    """Gives back an active reservation's units. Returns False if it had already ended."""
+    with transaction.atomic():
+        locked = StockReservation.objects.filter(pk=reservation.pk)
+        if connection.features.has_select_for_update:
+            locked = locked.select_for_update()
+        list(locked)
+        return bool(_end_reservations([reservation.pk], StockReservation.RELEASED))
+
+def expire_reservations(batch_size=None, now=None):
+    """
+    Releases every reservation past its expiry, batch_size at a time, walking
+    the (status, expires_at) index. Each batch is its own short transaction;
+    where the database supports it, rows another sweeper already holds are
+    skipped rather than waited on. Returns how many reservations expired.
+    """
+    batch_size = batch_size or settings.STOCK_RESERVATION_SWEEP_BATCH
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            due = StockReservation.objects.filter(
+                status=StockReservation.ACTIVE, expires_at__lte=now
+            ).order_by('status', 'expires_at')
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            batch = list(due.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return expired
+            expired += _end_reservations(batch, StockReservation.EXPIRED)
@@ -0,0 +1,34 @@
+from celery import shared_task
+
+from .archive import archive_orders
+from .payments import dispatch_payments
+from .stock import expire_reservations
+
+@shared_task
+def expire_stock_reservations_task():
+    """
+    Celery beat task to give back the stock of reservations past their
+    expiry. Runs every STOCK_RESERVATION_SWEEP_INTERVAL.
+    """
+    expired = expire_reservations()
+    if expired:
+        print(f"Expired {expired} stock reservations.")
+
+@shared_task
+def dispatch_payment_outbox_task():
+    """
+    Celery beat task to send queued checkout payments to the gateway, outside
+    the checkout transaction. Runs every PAYMENT_OUTBOX_DISPATCH_INTERVAL.
+    """
+    sent, failed = dispatch_payments()
+    if sent or failed:
+        print(f"Dispatched {sent} payments, {failed} failed.")
+
+@shared_task
+def archive_orders_task():
+    """
+    Celery beat task to move finished orders older than ORDER_ARCHIVE_AFTER
+    into the archive tables.
+    """
+    archived = archive_orders()
+    print(f"Archived {archived} orders.")
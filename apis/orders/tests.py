@@ -1,3 +1,838 @@
-from django.test import TestCase
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from paylater.models import PayLaterApplication
+from products.models import Product
+from .archive import archive_orders
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Order, OrderItem, OrderStatusHistory, PaymentOutbox, Repayment,
+    StockReservation
+)
+from .exports import order_export_rows
+from .filters import filter_orders
+from .stock import expire_reservations
+from .payments import PaymentGatewayError, dispatch_payments, sign_payload
+from .repayments import due_within, overdue, reconcile_exposure
+from .transitions import TransitionError, transition_orders
+
+User = get_user_model()
+
+
+class OrderTestMixin:
+    """Helpers for building users, products and orders with many lines."""
+
+    def create_user(self, username='shopper', **extra):
+        return User.objects.create_user(username=username, password='pass12345', **extra)
+
+    def create_products(self, count, stock=100, price='25.00'):
+        offset = Product.objects.count()
+        return [
+            Product.objects.create(name=f'Item {i:04d}', price=Decimal(price), stock=stock)
+            for i in range(offset, offset + count)
+        ]
+
+    def create_order(self, user, products, pay_later_application=None, **extra):
+        order = Order.objects.create(
+            user=user,
+            total_amount=sum((p.price for p in products), Decimal('0.00')),
+            payment_option=extra.pop('payment_option', 'OUTRIGHT'),
+            delivery_address='1 Market Road',
+            delivery_phone_number='08000000000',
+            pay_later_application=pay_later_application,
+            **extra,
+        )
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product=p, quantity=1, price=p.price) for p in products]
+        )
+        return order
+
+
+class OrderQueryBudgetTests(OrderTestMixin, TestCase):
+    """
+    Order endpoints must cost a fixed number of queries no matter how many
+    lines an order has or how many orders are on the page.
+    """
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.application = PayLaterApplication.objects.create(
+            user=self.user, status='APPROVED_ELIGIBLE', is_eligible=True,
+            full_name='Test Shopper', national_id_number='NIN-1', date_of_birth='1990-01-01',
+            address='1 Market Road', phone_number='08000000000', approved_credit_limit=Decimal('100000.00'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_order_detail_budget_is_independent_of_line_count(self):
+        for line_count in (1, 30):
+            order = self.create_order(self.user, self.create_products(line_count), self.application)
+            # Order joined with user and application, then items joined with products
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('order-detail', args=[order.pk]))
+            self.assertEqual(len(response.data['items']), line_count)
+            self.assertEqual(response.data['pay_later_application_status'], 'APPROVED_ELIGIBLE')
+
+    def test_order_list_budget_is_independent_of_page_size(self):
+        products = self.create_products(5)
+        for _ in range(12):
+            self.create_order(self.user, products, self.application)
+
+        # The page of orders joined with their applications, then all of their items and
+        # products, and the (empty) page of archived orders
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('order-history'))
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_order_create_validates_all_lines_in_one_query(self):
+        for line_count in (1, 20):
+            products = self.create_products(line_count)
+            payload = {
+                'payment_option': 'OUTRIGHT',
+                'delivery_address': '1 Market Road',
+                'delivery_phone_number': '08000000000',
+                'items': [{'product_id': p.pk, 'quantity': 1} for p in products],
+            }
+            # One SELECT validates every line; the only per-line cost is its conditional stock UPDATE.
+            # Fixed: savepoint and release, the order and item INSERTs, the categories lookup and two
+            # rollup upserts, the payment outbox row, then the order and its items read back
+            with self.assertNumQueries(11 + line_count):
+                response = self.client.post(reverse('order-create'), payload, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), line_count)
+
+    def test_order_create_rejects_unknown_product(self):
+        payload = {
+            'payment_option': 'OUTRIGHT',
+            'delivery_address': '1 Market Road',
+            'delivery_phone_number': '08000000000',
+            'items': [{'product_id': 999999, 'quantity': 1}],
+        }
+        response = self.client.post(reverse('order-create'), payload, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderHistoryTests(OrderTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = self.create_products(2)
+
+    def test_pages_walk_every_order_once_newest_first(self):
+        orders = [self.create_order(self.user, self.products) for _ in range(7)]
+        self.create_order(self.create_user('other'), self.products)
+
+        seen, url = [], reverse('order-history') + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [order.pk for order in reversed(orders)])
+
+        row = response.data['results'][-1]
+        self.assertEqual(row['item_count'], 2)
+        self.assertEqual({item['product_name'] for item in row['items']}, {p.name for p in self.products})
+        self.assertNotIn('delivery_address', row)
+
+    def test_status_and_date_filters(self):
+        delivered = self.create_order(self.user, self.products, status='DELIVERED')
+        pending = self.create_order(self.user, self.products)
+        Order.objects.filter(pk=pending.pk).update(created_at=timezone.now() - timedelta(days=10))
+
+        def ids(**params):
+            response = self.client.get(reverse('order-history'), params)
+            self.assertEqual(response.status_code, 200, response.data)
+            return [row['id'] for row in response.data['results']]
+
+        self.assertEqual(ids(status='delivered'), [delivered.pk])
+        self.assertEqual(ids(status='PENDING,DELIVERED'), [delivered.pk, pending.pk])
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        self.assertEqual(ids(created_after=since), [delivered.pk])
+        self.assertEqual(ids(created_before=since), [pending.pk])
+        for params in ({'status': 'LOST'}, {'created_after': 'last week'}):
+            self.assertEqual(self.client.get(reverse('order-history'), params).status_code, 400)
+
+    def test_history_pages_are_read_from_an_index_without_sorting(self):
+        for params in ({}, {'status': 'PENDING'}, {'created_after': '2025-01-01'}):
+            queryset = filter_orders(Order.objects.filter(user=self.user), params)
+            plan = queryset[:10].explain()
+            self.assertNotIn('TEMP B-TREE', plan, params)
+            self.assertNotRegex(plan, r'SCAN orders_order(?! USING)', params)
+
+
+class OrderArchiveTests(OrderTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = self.create_products(2)
+
+    def create_aged_order(self, days, status='COMPLETED', user=None):
+        order = self.create_order(user or self.user, self.products, status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+        return order
+
+    def test_only_old_finished_orders_are_moved(self):
+        old = [self.create_aged_order(400, status) for status in ('COMPLETED', 'CANCELLED', 'REFUNDED')]
+        old_but_open = self.create_aged_order(400, 'SHIPPED')
+        old_but_owing = self.create_aged_order(400)
+        Order.objects.filter(pk=old_but_owing.pk).update(payment_option='PAY_LATER_0', remaining_balance=Decimal('20.00'))
+        recent = self.create_aged_order(10)
+
+        self.assertEqual(archive_orders(chunk_size=2), 3)
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)),
+                         {old_but_open.pk, old_but_owing.pk, recent.pk})
+        self.assertEqual(set(ArchivedOrder.objects.values_list('pk', flat=True)), {order.pk for order in old})
+        self.assertEqual(ArchivedOrderItem.objects.count(), 6)
+        self.assertEqual(OrderItem.objects.count(), 6)
+        self.assertEqual(archive_orders(), 0)
+
+    def test_export_includes_archived_orders(self):
+        old, recent = self.create_aged_order(400), self.create_aged_order(10)
+        archive_orders()
+        rows = list(order_export_rows())
+        self.assertEqual([(row['id'], row['archived']) for row in rows], [(old.pk, True), (recent.pk, False)])
+        self.assertEqual(len(rows[0]['items']), 2)
+
+    def test_history_and_detail_read_both_tables(self):
+        orders = [self.create_aged_order(days) for days in (500, 400, 30, 20, 10)]
+        self.create_aged_order(450, user=self.create_user('other'))
+        archive_orders()
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+
+        seen, url = [], reverse('order-history') + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            seen += [(row['id'], row['archived']) for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [(order.pk, days > 365) for order, days in
+                                zip(reversed(orders), (10, 20, 30, 400, 500))])
+        self.assertEqual(self.client.get(reverse('order-history'), {'status': 'PENDING'}).data['results'], [])
+
+        archived = orders[0]
+        response = self.client.get(reverse('order-detail', args=[archived.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 2)
+        other = ArchivedOrder.objects.exclude(user=self.user).get()
+        self.assertEqual(self.client.get(reverse('order-detail', args=[other.pk])).status_code, 404)
+
+
+@skipUnless(os.environ.get('ORDER_ARCHIVE_BENCHMARK_ROWS'), "set ORDER_ARCHIVE_BENCHMARK_ROWS to run")
+class OrderArchiveBenchmark(OrderTestMixin, TestCase):
+    """
+    Hot-path query latency before and after archiving a synthetic history:
+
+        ORDER_ARCHIVE_BENCHMARK_ROWS=2000000 python manage.py test orders.tests.OrderArchiveBenchmark
+
+    90% of the orders are finished and older than ORDER_ARCHIVE_AFTER.
+    """
+    USERS = 1000
+    RUNS = 25
+
+    def setUp(self):
+        self.rows = int(os.environ['ORDER_ARCHIVE_BENCHMARK_ROWS'])
+        self.users = User.objects.bulk_create(
+            [User(username=f'bench{i}', password='!') for i in range(self.USERS)]
+        )
+        self.product = self.create_products(1)[0]
+        self.generate_history()
+
+    def generate_history(self):
+        ops = connection.ops
+        now = timezone.now()
+        recent = self.rows // 10
+        order_sql = (
+            'INSERT INTO orders_order (id, user_id, created_at, updated_at, status, payment_status, '
+            'delivery_address, delivery_phone_number, total_amount, payment_option, instalment_paid_amount, '
+            'remaining_balance) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+        )
+        item_sql = 'INSERT INTO orders_orderitem (order_id, product_id, quantity, price) VALUES (%s, %s, %s, %s)'
+        with connection.cursor() as cursor:
+            for start in range(1, self.rows + 1, 20000):
+                orders, items = [], []
+                for pk in range(start, min(start + 20000, self.rows + 1)):
+                    age = timedelta(minutes=(self.rows - pk) * 3 * 60 * 24 * 365 // self.rows)
+                    if pk <= self.rows - recent:
+                        age += timedelta(days=400)
+                        status = ('COMPLETED', 'CANCELLED', 'REFUNDED')[pk % 3]
+                    else:
+                        status = ('PENDING', 'PROCESSING', 'SHIPPED', 'COMPLETED')[pk % 4]
+                    created = ops.adapt_datetimefield_value(now - age)
+                    orders.append((pk, self.users[pk % self.USERS].pk, created, created, status, 'PAID',
+                                   '1 Market Road', '08000000000', '25.00', 'OUTRIGHT', '0.00', '0.00'))
+                    items.append((pk, self.product.pk, 1, '25.00'))
+                cursor.executemany(order_sql, orders)
+                cursor.executemany(item_sql, items)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def measure(self):
+        client = APIClient()
+        client.force_authenticate(self.users[7])
+        probes = {
+            'history page (API)': lambda: client.get(reverse('order-history')),
+            'history page, status filter (API)': lambda: client.get(reverse('order-history'), {'status': 'SHIPPED'}),
+            'admin list: COUNT(*)': lambda: Order.objects.count(),
+            'admin list: newest 100': lambda: list(Order.objects.order_by('-created_at')[:100]),
+            'open orders: status count': lambda: Order.objects.filter(status='PROCESSING').count(),
+        }
+        timings = {}
+        for name, probe in probes.items():
+            samples = []
+            for _ in range(self.RUNS):
+                started = time.perf_counter()
+                probe()
+                samples.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(samples)
+        return timings
+
+    def test_hot_path_latency_before_and_after_archiving(self):
+        before = self.measure()
+        started = time.monotonic()
+        archived = archive_orders(chunk_size=5000)
+        archive_seconds = time.monotonic() - started
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        after = self.measure()
+
+        self.assertEqual(archived, self.rows - self.rows // 10)
+        self.assertEqual(Order.objects.count(), self.rows // 10)
+        print(f"\n{self.rows} orders, {archived} archived in {archive_seconds:.1f}s "
+              f"({archived / archive_seconds:.0f} orders/sec). Median of {self.RUNS} runs:")
+        print(f"{'query':40} {'before ms':>10} {'after ms':>10}")
+        for name in before:
+            print(f"{name:40} {before[name]:10.2f} {after[name]:10.2f}")
+
+
+class OrderExportTests(OrderTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.create_user()
+        products = self.create_products(3)
+        for _ in range(5):
+            self.create_order(self.user, products)
+        self.client = APIClient()
+
+    def test_export_is_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(reverse('order-export')).status_code, 403)
+
+    def test_ndjson_and_csv_exports_include_items(self):
+        self.client.force_authenticate(self.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('order-export'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['user'], 'shopper')
+        self.assertEqual([item['quantity'] for item in rows[0]['items']], [1, 1, 1])
+
+        response = self.client.get(reverse('order-export'), {'export_format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 5 * 3) # Header, then one line per item
+
+    def test_items_are_prefetched_per_chunk(self):
+        # A read of the (empty) archive, then one streamed read of orders and items with products per chunk of 2
+        with self.assertNumQueries(5):
+            self.assertEqual(len(list(order_export_rows(chunk_size=2))), 5)
+
+
+class CheckoutStockTests(OrderTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, *lines):
+        payload = {
+            'payment_option': 'OUTRIGHT',
+            'delivery_address': '1 Market Road',
+            'delivery_phone_number': '08000000000',
+            'items': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in lines],
+        }
+        return self.client.post(reverse('order-create'), payload, format='json')
+
+    def test_order_lines_are_written_in_one_statement(self):
+        products = self.create_products(25, stock=5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.checkout(*[(product, 2) for product in products])
+        self.assertEqual(response.status_code, 201)
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "orders_orderitem"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {3})
+
+    def test_short_stock_rolls_back_every_line(self):
+        plenty, scarce = self.create_products(2, stock=5)
+        Product.objects.filter(pk=scarce.pk).update(stock=1)
+        response = self.checkout((plenty, 2), (scarce, 2))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 1', response.data['detail'])
+        self.assertEqual(Product.objects.get(pk=plenty.pk).stock, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_repeated_product_lines_are_checked_together(self):
+        product = self.create_products(1, stock=3)[0]
+        self.assertEqual(self.checkout((product, 2), (product, 2)).status_code, 400)
+        self.assertEqual(self.checkout((product, 2), (product, 1)).status_code, 201)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 0)
+
+
+class StockReservationTests(OrderTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = self.create_products(1, stock=5)[0]
+
+    def reserve(self, quantity, client=None):
+        payload = {'items': [{'product_id': self.product.pk, 'quantity': quantity}]}
+        return (client or self.client).post(reverse('stock-reservation-create'), payload, format='json')
+
+    def checkout(self, client=None, **payload):
+        payload.update(payment_option='OUTRIGHT', delivery_address='1 Market Road', delivery_phone_number='08000000000')
+        return (client or self.client).post(reverse('order-create'), payload, format='json')
+
+    def stock(self):
+        return Product.objects.values_list('stock', 'reserved_stock').get(pk=self.product.pk)
+
+    def test_holds_are_not_sold_to_anyone_else(self):
+        self.assertEqual(self.reserve(4).status_code, 201)
+        self.assertEqual(self.stock(), (5, 4))
+
+        other = APIClient()
+        other.force_authenticate(self.create_user('other'))
+        self.assertEqual(self.reserve(2, client=other).status_code, 400)
+        response = self.checkout(client=other, items=[{'product_id': self.product.pk, 'quantity': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 1', response.data['detail'])
+
+        detail = self.client.get(reverse('product-detail', args=[self.product.pk]))
+        self.assertEqual(detail.data['available_to_sell'], 1)
+
+    def test_order_confirms_the_reservation_in_one_product_update(self):
+        token = self.reserve(3).data['token']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.checkout(reservation=token)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['items'][0]['quantity'], 3)
+        product_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "products_product"')]
+        self.assertEqual(len(product_updates), 1)
+        self.assertEqual(self.stock(), (2, 0))
+        self.assertEqual(StockReservation.objects.get(token=token).status, StockReservation.CONFIRMED)
+
+        # A reservation can only be used once
+        self.assertEqual(self.checkout(reservation=token).status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_or_foreign_reservations_are_refused(self):
+        token = self.reserve(2).data['token']
+        other = APIClient()
+        other.force_authenticate(self.create_user('other'))
+        self.assertEqual(self.checkout(client=other, reservation=token).status_code, 404)
+
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.checkout(reservation=token).status_code, 409)
+        self.assertEqual(self.stock(), (5, 2))
+
+    def test_release_gives_the_stock_back(self):
+        token = self.reserve(2).data['token']
+        url = reverse('stock-reservation-detail', args=[token])
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.stock(), (5, 0))
+        self.assertEqual(self.client.get(url).data['status'], StockReservation.RELEASED)
+
+    def test_sweep_expires_holds_in_batches(self):
+        for _ in range(5):
+            self.reserve(1)
+        live = self.create_products(1, stock=5)[0]
+        self.client.post(reverse('stock-reservation-create'),
+                         {'items': [{'product_id': live.pk, 'quantity': 1}]}, format='json')
+        StockReservation.objects.filter(items__product=self.product).update(expires_at=timezone.now())
+
+        self.assertEqual(expire_reservations(batch_size=2), 5)
+        self.assertEqual(self.stock(), (5, 0))
+        self.assertEqual(Product.objects.get(pk=live.pk).reserved_stock, 1)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.EXPIRED).count(), 5)
+        self.assertEqual(expire_reservations(), 0)
+
+
+class PaymentTestMixin(OrderTestMixin):
+    """Checkout through the API and signed gateway webhooks."""
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = self.create_products(1, stock=5, price='100.00')[0]
+
+    def create_application(self, user, credit_limit='1000.00'):
+        return PayLaterApplication.objects.create(
+            user=user, status='APPROVED_ELIGIBLE', is_eligible=True,
+            full_name='Test Shopper', national_id_number=f'NIN-{user.pk}', date_of_birth='1990-01-01',
+            address='1 Market Road', phone_number='08000000000', approved_credit_limit=Decimal(credit_limit),
+        )
+
+    def checkout(self, payment_option='OUTRIGHT'):
+        payload = {
+            'payment_option': payment_option,
+            'delivery_address': '1 Market Road',
+            'delivery_phone_number': '08000000000',
+            'items': [{'product_id': self.product.pk, 'quantity': 1}],
+        }
+        return self.client.post(reverse('order-create'), payload, format='json')
+
+    def webhook(self, payload, signature=None):
+        body = json.dumps(payload).encode()
+        return APIClient().post(
+            reverse('payment-webhook'), body, content_type='application/json',
+            HTTP_X_GATEWAY_SIGNATURE=signature or sign_payload(body),
+        )
+
+
+
+class PaymentOutboxTests(PaymentTestMixin, TestCase):
+
+    def test_checkout_queues_the_payment_without_calling_the_gateway(self):
+        with mock.patch('orders.payments.initiate_payment') as initiate:
+            response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        initiate.assert_not_called()
+        self.assertEqual((response.data['status'], response.data['payment_status']), ('PENDING', 'PENDING'))
+        payment = PaymentOutbox.objects.get()
+        self.assertEqual((payment.kind, payment.amount, payment.status),
+                         (PaymentOutbox.FULL_PAYMENT, Decimal('100.00'), PaymentOutbox.PENDING))
+
+    def test_dispatch_then_webhook_settles_the_order(self):
+        order_id = self.checkout().data['id']
+        self.assertEqual(dispatch_payments(), (1, 0))
+        payment = PaymentOutbox.objects.get()
+        self.assertEqual(payment.status, PaymentOutbox.SENT)
+        self.assertEqual(Order.objects.get(pk=order_id).transaction_ref, payment.transaction_ref)
+        self.assertEqual(dispatch_payments(), (0, 0))
+
+        event = {'reference': payment.reference, 'status': 'success', 'transaction_ref': payment.transaction_ref}
+        self.assertEqual(self.webhook(event).data['detail'], 'Payment recorded.')
+        self.assertEqual(self.webhook(event).data['detail'], 'Payment already recorded.')
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.payment_status), ('PROCESSING', 'PAID'))
+        self.assertEqual(
+            list(order.status_history.order_by('pk').values_list('field', 'from_value', 'to_value')),
+            [('payment_status', 'PENDING', 'PAID'), ('status', 'PENDING', 'PROCESSING')],
+        )
+
+    def test_upfront_instalment_moves_the_balance(self):
+        application = self.create_application(self.user)
+        order_id = self.checkout('PAY_LATER_40').data['id']
+        payment = PaymentOutbox.objects.get()
+        self.assertEqual(payment.amount, Decimal('40.00'))
+        self.webhook({'reference': payment.reference, 'status': 'success'})
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual(order.payment_status, 'PARTIALLY_PAID')
+        self.assertEqual((order.instalment_paid_amount, order.remaining_balance), (Decimal('40.00'), Decimal('60.00')))
+        self.assertEqual(list(Repayment.objects.values_list('source', 'amount', 'balance_after')),
+                         [(Repayment.UPFRONT, Decimal('40.00'), Decimal('60.00'))])
+        application.refresh_from_db()
+        self.assertEqual(application.outstanding_balance, Decimal('60.00'))
+
+    def test_gateway_errors_are_retried_with_backoff_then_failed(self):
+        order_id = self.checkout().data['id']
+        with mock.patch('orders.payments.initiate_payment', side_effect=PaymentGatewayError('timeout')):
+            self.assertEqual(dispatch_payments(), (0, 1))
+            payment = PaymentOutbox.objects.get()
+            self.assertEqual((payment.status, payment.attempts), (PaymentOutbox.PENDING, 1))
+            self.assertGreater(payment.available_at, timezone.now())
+            self.assertEqual(dispatch_payments(), (0, 0)) # Not due yet
+
+            with self.settings(PAYMENT_OUTBOX_MAX_ATTEMPTS=2):
+                PaymentOutbox.objects.update(available_at=timezone.now())
+                dispatch_payments()
+        self.assertEqual(PaymentOutbox.objects.get().status, PaymentOutbox.FAILED)
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.payment_status), ('CANCELLED', 'FAILED'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5) # Given back
+
+    def test_failed_payment_cancels_the_order_and_gives_back_stock_and_credit(self):
+        application = self.create_application(self.user)
+        order_id = self.checkout('PAY_LATER_40').data['id']
+        self.product.refresh_from_db()
+        application.refresh_from_db()
+        self.assertEqual((self.product.stock, application.outstanding_balance), (4, Decimal('100.00')))
+
+        payment = PaymentOutbox.objects.get()
+        self.assertEqual(self.webhook({'reference': payment.reference, 'status': 'failed'}).data['detail'],
+                         'Payment recorded.')
+        self.assertEqual(self.webhook({'reference': payment.reference, 'status': 'failed'}).data['detail'],
+                         'Payment already recorded.')
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.payment_status, order.remaining_balance),
+                         ('CANCELLED', 'FAILED', Decimal('0.00')))
+        self.product.refresh_from_db()
+        application.refresh_from_db()
+        self.assertEqual((self.product.stock, application.outstanding_balance), (5, Decimal('0.00')))
+
+    def test_stale_claims_are_sent_again(self):
+        self.checkout()
+        PaymentOutbox.objects.update(status=PaymentOutbox.IN_FLIGHT, claimed_until=timezone.now(), attempts=1)
+        self.assertEqual(dispatch_payments(), (1, 0))
+        self.assertEqual(PaymentOutbox.objects.get().attempts, 2)
+
+    def test_webhook_rejects_bad_signatures_and_unknown_references(self):
+        self.checkout()
+        payment = PaymentOutbox.objects.get()
+        self.assertEqual(self.webhook({'reference': payment.reference, 'status': 'success'}, 'forged').status_code, 403)
+        self.assertEqual(self.webhook({'reference': 'minimart-999-999', 'status': 'success'}).status_code, 404)
+        with self.settings(PAYMENT_WEBHOOK_SECRET=''): # Fails closed, even for a payload signed with no key
+            self.assertEqual(self.webhook({'reference': payment.reference, 'status': 'success'}).status_code, 403)
+        self.assertEqual(Order.objects.get().payment_status, 'PENDING')
+
+
+class RepaymentTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.application = self.create_application(self.user)
+
+    def repay(self, order_id, amount):
+        return self.client.post(reverse('order-repayments', args=[order_id]), {'amount': amount}, format='json')
+
+    def settle(self, succeeded=True):
+        """Sends every queued payment and confirms the newest one."""
+        dispatch_payments()
+        payment = PaymentOutbox.objects.latest('pk')
+        return self.webhook({'reference': payment.reference, 'status': 'success' if succeeded else 'failed'})
+
+    def test_repayments_are_ledgered_and_update_both_balances(self):
+        order_id = self.checkout('PAY_LATER_0').data['id']
+        self.application.refresh_from_db()
+        self.assertEqual(self.application.outstanding_balance, Decimal('100.00'))
+
+        response = self.repay(order_id, '30.00')
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertFalse(Repayment.objects.exists()) # Not until the gateway confirms it
+        self.settle(succeeded=False)
+        self.assertEqual(Order.objects.get(pk=order_id).payment_status, 'PENDING')
+
+        self.repay(order_id, '30.00')
+        self.assertEqual(self.settle().data['detail'], 'Payment recorded.')
+        self.assertEqual(self.settle().data['detail'], 'Payment already recorded.')
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.remaining_balance, order.payment_status, order.status),
+                         (Decimal('70.00'), 'PARTIALLY_PAID', 'PROCESSING'))
+
+        self.assertEqual(self.repay(order_id, '70.01').status_code, 400)
+        self.repay(order_id, '70.00')
+        self.settle()
+        order.refresh_from_db()
+        self.application.refresh_from_db()
+        self.assertEqual((order.remaining_balance, order.payment_status), (Decimal('0.00'), 'FULLY_REPAID'))
+        self.assertEqual(self.application.outstanding_balance, Decimal('0.00'))
+
+        ledger = self.client.get(reverse('order-repayments', args=[order_id])).data['results']
+        self.assertEqual([(row['amount'], row['balance_after']) for row in ledger],
+                         [('30.00', '70.00'), ('70.00', '0.00')])
+        with self.assertRaises(ValueError):
+            Repayment.objects.first().save()
+
+    def test_only_open_pay_later_balances_can_be_repaid(self):
+        outright = self.checkout().data['id']
+        self.assertEqual(self.repay(outright, '10.00').status_code, 409)
+        upfront_unpaid = self.checkout('PAY_LATER_40').data['id']
+        self.assertEqual(self.repay(upfront_unpaid, '10.00').status_code, 409)
+        someone_else = self.create_order(self.create_user('other'), [self.product], payment_option='PAY_LATER_0')
+        self.assertEqual(self.repay(someone_else.pk, '10.00').status_code, 404)
+
+    def test_due_and_overdue_balances_are_index_range_scans(self):
+        today = timezone.localdate()
+        for days, balance in ((-3, '10.00'), (2, '20.00'), (5, '0.00'), (20, '30.00')):
+            self.create_order(self.user, [self.product], payment_option='PAY_LATER_0',
+                              remaining_balance=Decimal(balance), repayment_due_date=today + timedelta(days=days))
+
+        self.assertEqual([o.remaining_balance for o in due_within(7)], [Decimal('20.00')])
+        self.assertEqual([o.remaining_balance for o in overdue()], [Decimal('10.00')])
+        for queryset in (due_within(7), overdue()):
+            self.assertIn('order_open_repayment_due_idx', queryset.explain())
+
+        staff = self.create_user('finance', is_staff=True)
+        self.client.force_authenticate(staff)
+        response = self.client.get(reverse('repayments-due'), {'within_days': 30})
+        self.assertEqual([row['remaining_balance'] for row in response.data['results']], ['20.00', '30.00'])
+        self.assertEqual(self.client.get(reverse('repayments-due'), {'overdue': 'true'}).data['count'], 1)
+
+
+class CreditExposureTests(PaymentTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.application = self.create_application(self.user, credit_limit='250.00')
+
+    def exposure(self):
+        self.application.refresh_from_db()
+        return self.application.outstanding_balance
+
+    def test_checkout_counts_unpaid_orders_against_the_limit(self):
+        self.assertEqual(self.checkout('PAY_LATER_0').status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.checkout('PAY_LATER_0').status_code, 201)
+        credit_updates = [q['sql'] for q in queries.captured_queries
+                          if q['sql'].startswith('UPDATE "paylater_paylaterapplication"')]
+        self.assertEqual(len(credit_updates), 1)
+        self.assertEqual(self.exposure(), Decimal('200.00'))
+
+        response = self.checkout('PAY_LATER_40')
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('available credit of $50.00', response.data['detail'])
+        self.assertEqual(self.exposure(), Decimal('200.00'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3) # The refused checkout took nothing
+
+    def test_cancelling_writes_the_balance_off(self):
+        first, second = self.checkout('PAY_LATER_0').data['id'], self.checkout('PAY_LATER_0').data['id']
+        result = transition_orders([first, self.create_order(self.user, [self.product]).pk], 'status', 'CANCELLED')
+        self.assertEqual(result.updated, 2)
+        self.assertEqual(self.exposure(), Decimal('100.00'))
+        self.assertEqual(Order.objects.get(pk=first).remaining_balance, Decimal('0.00'))
+        self.assertEqual(Order.objects.get(pk=second).remaining_balance, Decimal('100.00'))
+        self.assertEqual(self.checkout('PAY_LATER_0').status_code, 201)
+
+    def test_reconcile_reports_and_corrects_drift(self):
+        self.checkout('PAY_LATER_0')
+        other = self.create_user('other')
+        other_application = self.create_application(other)
+        PayLaterApplication.objects.filter(pk=self.application.pk).update(outstanding_balance=Decimal('5.00'))
+
+        out = StringIO()
+        call_command('reconcile_credit_exposure', dry_run=True, chunk_size=1, stdout=out)
+        self.assertIn(f'Application {self.application.pk}: cached 5.00, actual 100.00 (+95.00)', out.getvalue())
+        self.assertIn('Found 1 drifted', out.getvalue())
+        self.assertEqual(self.exposure(), Decimal('5.00'))
+
+        call_command('reconcile_credit_exposure', stdout=StringIO())
+        self.assertEqual(self.exposure(), Decimal('100.00'))
+        other_application.refresh_from_db()
+        self.assertEqual(other_application.outstanding_balance, Decimal('0.00'))
+        self.assertEqual(reconcile_exposure(), {})
+
+
+class OrderTransitionTests(OrderTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = self.create_user()
+        self.staff = self.create_user('warehouse', is_staff=True, is_superuser=True)
+        self.product = self.create_products(1)[0]
+        self.orders = [self.create_order(self.user, [self.product], status='PROCESSING') for _ in range(5)]
+        self.delivered = self.create_order(self.user, [self.product], status='DELIVERED')
+        self.client = APIClient()
+
+    def test_orders_move_with_one_update_and_one_history_insert(self):
+        order_ids = [order.pk for order in self.orders] + [self.delivered.pk, 999999]
+        with CaptureQueriesContext(connection) as queries:
+            result = transition_orders(order_ids, 'status', 'SHIPPED', user=self.staff, note='Truck 4')
+        writes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len(writes), 2)
+        self.assertIn('"status" IN', writes[0])
+
+        self.assertEqual(result.updated, 5)
+        self.assertEqual(result.skipped, {self.delivered.pk: 'DELIVERED', 999999: None})
+        self.assertEqual(Order.objects.filter(status='SHIPPED').count(), 5)
+        self.assertEqual(
+            set(OrderStatusHistory.objects.values_list('from_value', 'to_value', 'changed_by', 'note')),
+            {('PROCESSING', 'SHIPPED', self.staff.pk, 'Truck 4')},
+        )
+        with self.assertRaises(TransitionError):
+            transition_orders(order_ids, 'status', 'LOST')
+        with self.assertRaises(ValueError):
+            OrderStatusHistory.objects.first().save()
+
+    def test_api_is_staff_only_and_reports_skipped_orders(self):
+        payload = {'order_ids': [self.orders[0].pk, self.delivered.pk], 'to': 'CANCELLED'}
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post(reverse('order-transitions'), payload, format='json').status_code, 403)
+
+        self.client.force_authenticate(self.staff)
+        response = self.client.post(reverse('order-transitions'), payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 1, 'skipped': [{'id': self.delivered.pk, 'current': 'DELIVERED'}]})
+        bad = dict(payload, field='payment_status')
+        self.assertEqual(self.client.post(reverse('order-transitions'), bad, format='json').status_code, 400)
+
+    def test_admin_action_moves_the_selection(self):
+        self.client.force_login(self.staff)
+        response = self.client.post(reverse('admin:orders_order_changelist'), {
+            'action': 'mark_status_shipped',
+            '_selected_action': [order.pk for order in self.orders[:3]] + [self.delivered.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.filter(status='SHIPPED').count(), 3)
+        self.assertEqual(OrderStatusHistory.objects.filter(changed_by=self.staff).count(), 3)
+
+
+class ConcurrentCheckoutTests(OrderTestMixin, TransactionTestCase):
+    """Many shoppers racing for the same scarce stock must never oversell it."""
+
+    THREADS = 16
+    ATTEMPTS_PER_THREAD = 8
+    STOCK = 40
+
+    def test_concurrent_checkouts_never_oversell(self):
+        products = self.create_products(3, stock=self.STOCK)
+        users = [self.create_user(f'shopper{i}') for i in range(self.THREADS)]
+        results = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def shop(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            payload = {
+                'payment_option': 'OUTRIGHT',
+                'delivery_address': '1 Market Road',
+                'delivery_phone_number': '08000000000',
+                # Every order takes one unit of each product, listed in a different order
+                'items': [{'product_id': p.pk, 'quantity': 1} for p in random.sample(products, len(products))],
+            }
+            barrier.wait()
+            try:
+                for _ in range(self.ATTEMPTS_PER_THREAD):
+                    results.append(client.post(reverse('order-create'), payload, format='json').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shop, args=(user,)) for user in users]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(len(results), self.THREADS * self.ATTEMPTS_PER_THREAD)
+        self.assertEqual(results.count(201), self.STOCK)
+        self.assertEqual(results.count(400), len(results) - self.STOCK)
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {0})
+        for product in products:
+            sold = OrderItem.objects.filter(product=product).aggregate(total=Sum('quantity'))['total']
+            self.assertEqual(sold, self.STOCK)
+        print(f"\n{len(results)} concurrent checkouts in {elapsed:.2f}s "
+              f"({len(results) / elapsed:.0f} requests/sec, {self.STOCK / elapsed:.0f} orders/sec)")
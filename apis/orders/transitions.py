@@ -0,0 +1,107 @@
+# orders/transitions.py
+"""
+The order status and payment status state machines.
+
+Every change to Order.status or Order.payment_status goes through
+transition_orders(), which moves any number of orders with one
+`UPDATE ... WHERE id IN (...) AND status IN (<allowed sources>)` per chunk
+of ids and logs every change to OrderStatusHistory with one bulk INSERT.
+Orders whose current value can't move to the target are left alone and
+reported back as skipped.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apis.streaming import chunked
+from .models import Order, OrderStatusHistory
+from .signals import orders_transitioned
+
+# current value -> values it may move to
+ORDER_STATUS_TRANSITIONS = {
+    'PENDING': {'PROCESSING', 'CANCELLED'},
+    'PROCESSING': {'SHIPPED', 'CANCELLED'},
+    'SHIPPED': {'DELIVERED'},
+    'DELIVERED': {'COMPLETED', 'REFUNDED'},
+    'COMPLETED': {'REFUNDED'},
+    'CANCELLED': set(),
+    'REFUNDED': set(),
+}
+
+PAYMENT_STATUS_TRANSITIONS = {
+    'PENDING': {'PAID', 'PARTIALLY_PAID', 'FULLY_REPAID', 'FAILED'}, # FULLY_REPAID: PAY_LATER_0 repaid in one go
+    'FAILED': {'PENDING'}, # Payment retried
+    'PARTIALLY_PAID': {'FULLY_REPAID', 'REFUNDED'},
+    'PAID': {'REFUNDED'},
+    'FULLY_REPAID': {'REFUNDED'},
+    'REFUNDED': set(),
+}
+
+TRANSITIONS = {
+    'status': ORDER_STATUS_TRANSITIONS,
+    'payment_status': PAYMENT_STATUS_TRANSITIONS,
+}
+
+CHUNK_SIZE = 1000 # Ids per UPDATE, well under every backend's parameter limit
+
+
+class TransitionError(ValueError):
+    """The requested target isn't a state of that field."""
+
+
+class TransitionResult:
+
+    def __init__(self):
+        self.changed = {} # order id -> value it moved from
+        self.skipped = {} # order id -> current value it can't move from (None if not found)
+
+    @property
+    def updated(self):
+        return len(self.changed)
+
+
+def allowed_sources(field, target):
+    try:
+        transitions = TRANSITIONS[field]
+    except KeyError:
+        raise TransitionError(f"Unknown field {field!r}; must be one of: {', '.join(TRANSITIONS)}.")
+    if target not in transitions:
+        raise TransitionError(f"{target!r} is not a valid {field}; must be one of: {', '.join(transitions)}.")
+    return sorted(source for source, targets in transitions.items() if target in targets)
+
+
+def transition_orders(order_ids, field, target, user=None, note='', extra=None):
+    """
+    Moves the given orders' `field` to `target` wherever the state machine
+    allows it, applying `extra` column updates (values or expressions) to
+    the same rows in the same statement. Returns a TransitionResult.
+    Runs in its own transaction, or joins the caller's.
+    """
+    sources = allowed_sources(field, target)
+    order_ids = sorted(set(order_ids))
+    result = TransitionResult()
+    now = timezone.now()
+
+    with transaction.atomic():
+        for chunk in chunked(order_ids, CHUNK_SIZE):
+            current = Order.objects.filter(pk__in=chunk)
+            if connection.features.has_select_for_update:
+                # Lock the rows so the values we log are the ones we replace
+                current = current.select_for_update()
+            current = dict(current.values_list('pk', field))
+            movable = [pk for pk in chunk if current.get(pk) in sources]
+            result.skipped.update((pk, current.get(pk)) for pk in chunk if current.get(pk) not in sources)
+            if not movable:
+                continue
+            Order.objects.filter(pk__in=movable, **{f'{field}__in': sources}).update(
+                **{field: target, 'updated_at': now}, **(extra or {})
+            )
+            result.changed.update((pk, current[pk]) for pk in movable)
+
+        if result.changed:
+            OrderStatusHistory.objects.bulk_create([
+                OrderStatusHistory(order_id=pk, field=field, from_value=from_value, to_value=target,
+                                   changed_by=user, note=note, changed_at=now)
+                for pk, from_value in result.changed.items()
+            ], batch_size=CHUNK_SIZE)
+            orders_transitioned.send(sender=Order, field=field, target=target, changed=result.changed, user=user)
+    return result
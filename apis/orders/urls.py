@@ -5,6 +5,14 @@ from orders import views
 urlpatterns = [
     path('', views.OrderCreateView.as_view(), name='order-create'), 
     path('<int:pk>/', views.OrderDetailView.as_view(), name='order-detail'),
+    path('<int:pk>/repayments/', views.RepaymentListCreateView.as_view(), name='order-repayments'),
+    path('repayments/due/', views.RepaymentDueView.as_view(), name='repayments-due'),
+    path('history/', views.OrderListView.as_view(), name='order-history'),
+    path('export/', views.OrderExportView.as_view(), name='order-export'),
+    path('transitions/', views.OrderTransitionView.as_view(), name='order-transitions'),
+    path('payments/webhook/', views.PaymentWebhookView.as_view(), name='payment-webhook'),
+    path('reservations/', views.StockReservationCreateView.as_view(), name='stock-reservation-create'),
+    path('reservations/<uuid:token>/', views.StockReservationDetailView.as_view(), name='stock-reservation-detail'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
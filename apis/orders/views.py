@@ -1,166 +1,408 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
 from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
 from decimal import Decimal
 from datetime import date, timedelta
 from django.shortcuts import get_object_or_404
 
-from products.models import Product
+from idempotency.mixins import IdempotentCreateMixin
 from paylater.models import PayLaterApplication
-from .models import Order, OrderItem
-from .serializers import OrderCreateSerializer, OrderDetailSerializer
+from .archive import archived_order_detail_queryset
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Order, OrderItem, PaymentOutbox, Repayment, StockReservation,
+    StockReservationItem
+)
+from .payments import SIGNATURE_HEADER, apply_payment_result, find_payment, queue_payment, verify_signature
+from .filters import filter_orders
+from .serializers import (
+    OrderCreateSerializer, OrderDetailSerializer, OrderSummarySerializer, OrderTransitionSerializer,
+    RepaymentCreateSerializer, RepaymentDueSerializer, RepaymentRequestSerializer, RepaymentSerializer,
+    StockReservationCreateSerializer, StockReservationSerializer
+)
+from .signals import order_placed
+from .stock import CheckoutError, confirm_reservation, decrement_stock, release_reservation, reserve_stock
+from .repayments import RepaymentError, due_within, overdue, take_credit
+from .transitions import transition_orders
+from .exports import CSV_FIELDS, order_csv_rows, order_export_rows
+from apis.pagination import OrderHistoryCursorPagination
+from apis.streaming import EXPORT_FORMATS, csv_response, ndjson_response
 
-class OrderCreateView(generics.CreateAPIView):
+def order_detail_queryset():
+    """
+    Orders with everything OrderDetailSerializer reads loaded up front:
+    the user and Pay Later application are joined in, and the items come
+    back together with their products in a single extra query.
+    """
+    return Order.objects.select_related('user', 'pay_later_application').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+    )
+
+def reservation_lines(user, token):
+    """The held lines of one of `user`'s reservations, shaped like validated order items."""
+    items = StockReservationItem.objects.filter(
+        reservation__token=token, reservation__user=user
+    ).select_related('product')
+    lines = [{'product': item.product, 'quantity': item.quantity} for item in items]
+    if not lines:
+        raise CheckoutError("Reservation not found.", status.HTTP_404_NOT_FOUND)
+    return lines
+
+class OrderCreateView(IdempotentCreateMixin, generics.CreateAPIView):
     serializer_class = OrderCreateSerializer
     permission_classes = [IsAuthenticated]
+    idempotency_scope = 'orders.create'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        user = request.user
-        payment_option = serializer.validated_data['payment_option']
-        items_data = serializer.validated_data['items']
-        delivery_address = serializer.validated_data['delivery_address']
-        delivery_phone_number = serializer.validated_data['delivery_phone_number']
-
-        with transaction.atomic():
-            total_amount = Decimal('0.00')
-            order_items_to_create = []
-
-            # Validate products and calculate total amount based on current prices
-            for item_data in items_data:
-                product = item_data['product'] # This is the Product object from serializer's PrimaryKeyRelatedField
-                quantity = item_data['quantity']
-
-                if product.stock < quantity:
-                    return Response({"detail": f"Not enough stock for product {product.name}. Available: {product.stock}"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-
-                total_amount += product.price * quantity
-                order_items_to_create.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'price': product.price # Store price at time of order for historical accuracy
-                })
-
-            pay_later_app = None
-            instalment_paid = Decimal('0.00')
-            remaining_balance = Decimal('0.00')
-            repayment_due_date = None
-            payment_status = 'PENDING'
-            order_initial_status = 'PENDING' # Default order status
-
-            # --- Handle Pay Later Logic ---
-            if payment_option in ['PAY_LATER_40', 'PAY_LATER_0']:
-                try:
-                    # Check if user has an APPROVED Pay Later application
-                    pay_later_app = PayLaterApplication.objects.get(user=user, is_eligible=True, status='APPROVED_ELIGIBLE')
-                except PayLaterApplication.DoesNotExist:
-                    return Response({"detail": "User is not eligible for Pay Later. Please apply or wait for approval."},
-                                    status=status.HTTP_403_FORBIDDEN)
-
-                # Optional: Check if total_amount exceeds approved_credit_limit
-                if pay_later_app.approved_credit_limit and total_amount > pay_later_app.approved_credit_limit:
-                    return Response({
-                        "detail": f"Order total (${total_amount:.2f}) exceeds your approved credit limit of ${pay_later_app.approved_credit_limit:.2f}."
-                    }, status=status.HTTP_403_FORBIDDEN)
-
-                if payment_option == 'PAY_LATER_40':
-                    instalment_paid = total_amount * Decimal('0.40')
-                    remaining_balance = total_amount - instalment_paid
-                    
-                    # --- Integrate with Payment Gateway for 40% upfront ---
-                    # In a real scenario, this would call your payment gateway API
-                    # (e.g., Paystack, Stripe) to initiate payment.
-                    # This step might involve redirecting the user or waiting for a webhook.
-                    # For now, we simulate success.
-                    payment_success = self._initiate_payment(user, instalment_paid, "40% upfront instalment")
-                    if not payment_success:
-                        return Response({"detail": "Failed to process 40% instalment payment. Please try again."},
-                                        status=status.HTTP_400_BAD_REQUEST)
-                    payment_status = 'PARTIALLY_PAID'
-                    order_initial_status = 'PROCESSING' # Order can proceed once upfront payment is made
-
-                else: # PAY_LATER_0
-                    remaining_balance = total_amount
-                    payment_status = 'PENDING' # No upfront payment
-                    order_initial_status = 'PENDING' # Order remains pending until first payment
-
-                # Calculate repayment due date (e.g., 30 days from now)
-                repayment_due_date = date.today() + timedelta(days=30)
-            
-            else: # OUTRIGHT payment
-                # --- Integrate with Payment Gateway for full payment ---
-                payment_success = self._initiate_payment(user, total_amount, "Full payment")
-                if not payment_success:
-                    return Response({"detail": "Failed to process full payment. Please try again."},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                payment_status = 'PAID'
-                order_initial_status = 'PROCESSING' # Order can proceed as it's fully paid
-
-            # Create the Order
-            order = Order.objects.create(
-                user=user,
-                total_amount=total_amount,
-                payment_option=payment_option,
-                delivery_address=delivery_address,
-                delivery_phone_number=delivery_phone_number,
-                payment_status=payment_status,
-                pay_later_application=pay_later_app,
-                instalment_paid_amount=instalment_paid,
-                remaining_balance=remaining_balance,
-                repayment_due_date=repayment_due_date,
-                status=order_initial_status
+        try:
+            with transaction.atomic():
+                order = self._place_order(request.user, serializer.validated_data)
+        except CheckoutError as exc:
+            return Response({"detail": exc.detail}, status=exc.status_code)
+
+        # Return the created order details, re-read with its items and products prefetched
+        data = OrderDetailSerializer(order_detail_queryset().get(pk=order.pk)).data
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def _place_order(self, user, validated_data):
+        """Creates the order inside the caller's transaction; raises CheckoutError to roll it back."""
+        payment_option = validated_data['payment_option']
+        reservation_token = validated_data.get('reservation')
+        if reservation_token:
+            items_data = reservation_lines(user, reservation_token)
+        else:
+            items_data = validated_data['items']
+        delivery_address = validated_data['delivery_address']
+        delivery_phone_number = validated_data['delivery_phone_number']
+
+        total_amount = Decimal('0.00')
+        order_items_to_create = []
+        quantities = {}
+
+        # Calculate total amount based on current prices
+        for item_data in items_data:
+            product = item_data['product'] # This is the Product object from serializer's PrimaryKeyRelatedField
+            quantity = item_data['quantity']
+
+            total_amount += product.price * quantity
+            quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+            order_items_to_create.append({
+                'product': product,
+                'quantity': quantity,
+                'price': product.price # Store price at time of order for historical accuracy
+            })
+
+        pay_later_app = None
+        instalment_paid = Decimal('0.00')
+        remaining_balance = Decimal('0.00')
+        repayment_due_date = None
+        payment_status = 'PENDING'
+        order_initial_status = 'PENDING' # Default order status
+
+        # --- Handle Pay Later Logic ---
+        if payment_option in ['PAY_LATER_40', 'PAY_LATER_0']:
+            try:
+                # Check if user has an APPROVED Pay Later application
+                pay_later_app = PayLaterApplication.objects.get(user=user, is_eligible=True, status='APPROVED_ELIGIBLE')
+            except PayLaterApplication.DoesNotExist:
+                raise CheckoutError("User is not eligible for Pay Later. Please apply or wait for approval.",
+                                    status.HTTP_403_FORBIDDEN)
+
+            # Take the credit: exposure (unpaid Pay Later balances) + total must stay
+            # within approved_credit_limit. One conditional UPDATE, rolled back with
+            # the rest of the checkout if anything below fails.
+            if not take_credit(pay_later_app, total_amount):
+                available = max(pay_later_app.approved_credit_limit - pay_later_app.outstanding_balance, Decimal('0.00'))
+                raise CheckoutError(
+                    f"Order total (${total_amount:.2f}) exceeds your available credit of ${available:.2f} "
+                    f"(approved credit limit ${pay_later_app.approved_credit_limit:.2f}).",
+                    status.HTTP_403_FORBIDDEN)
+
+        # Take the stock before any payment is attempted (atomic, no oversell).
+        # A reservation already holds it, so confirming it is enough.
+        if reservation_token:
+            confirm_reservation(reservation_token, user, quantities)
+        else:
+            decrement_stock(quantities)
+
+        # Payments are only queued here. The gateway is called by the outbox
+        # dispatcher after this transaction commits and reports back through
+        # the payment webhook, which moves the order on to PROCESSING.
+        payment_kind = payment_amount = None
+        if payment_option in ['PAY_LATER_40', 'PAY_LATER_0']:
+            remaining_balance = total_amount
+            if payment_option == 'PAY_LATER_40':
+                # 40% upfront; the webhook moves it from remaining_balance to instalment_paid_amount
+                payment_kind, payment_amount = PaymentOutbox.UPFRONT_INSTALMENT, (total_amount * Decimal('0.40')).quantize(Decimal('0.01'))
+            # PAY_LATER_0: no upfront payment, order remains pending until first payment
+
+            # Calculate repayment due date (e.g., 30 days from now)
+            repayment_due_date = date.today() + timedelta(days=30)
+
+        else: # OUTRIGHT payment
+            payment_kind, payment_amount = PaymentOutbox.FULL_PAYMENT, total_amount
+
+        # Create the Order
+        order = Order.objects.create(
+            user=user,
+            total_amount=total_amount,
+            payment_option=payment_option,
+            delivery_address=delivery_address,
+            delivery_phone_number=delivery_phone_number,
+            payment_status=payment_status,
+            pay_later_application=pay_later_app,
+            instalment_paid_amount=instalment_paid,
+            remaining_balance=remaining_balance,
+            repayment_due_date=repayment_due_date,
+            status=order_initial_status
+        )
+
+        # Create all Order Items in one statement (stock was already taken above)
+        items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item_data['product'],
+                quantity=item_data['quantity'],
+                price=item_data['price'] # This is the price at time of order
             )
+            for item_data in order_items_to_create
+        ])
+        order_placed.send(sender=Order, order=order, items=items)
+
+        if payment_kind:
+            queue_payment(order, payment_kind, payment_amount)
+        return order
+
+class StockReservationCreateView(IdempotentCreateMixin, generics.CreateAPIView):
+    """
+    Holds stock for the given items for STOCK_RESERVATION_TTL, so it can't be
+    sold to someone else while the user is paying. Pass the returned token as
+    `reservation` when creating the order.
+    """
+    serializer_class = StockReservationCreateSerializer
+    permission_classes = [IsAuthenticated]
+    idempotency_scope = 'orders.reserve'
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        quantities = {}
+        for item_data in serializer.validated_data['items']:
+            product = item_data['product']
+            quantities[product.pk] = quantities.get(product.pk, 0) + item_data['quantity']
+
+        try:
+            with transaction.atomic():
+                reservation = reserve_stock(request.user, quantities)
+        except CheckoutError as exc:
+            return Response({"detail": exc.detail}, status=exc.status_code)
+
+        data = StockReservationSerializer(stock_reservation_queryset().get(pk=reservation.pk)).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+def stock_reservation_queryset():
+    return StockReservation.objects.prefetch_related(
+        Prefetch('items', queryset=StockReservationItem.objects.select_related('product'))
+    )
+
+class StockReservationDetailView(generics.RetrieveDestroyAPIView):
+    """Shows one of the user's reservations; DELETE gives its stock back."""
+    serializer_class = StockReservationSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'token'
+
+    def get_queryset(self):
+        return stock_reservation_queryset().filter(user=self.request.user)
+
+    def destroy(self, request, *args, **kwargs):
+        reservation = self.get_object()
+        if reservation.status == StockReservation.CONFIRMED:
+            return Response({"detail": "This reservation was already used for an order."},
+                            status=status.HTTP_409_CONFLICT)
+        release_reservation(reservation)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-            # Create Order Items and reduce product stock
-            for item_data in order_items_to_create:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item_data['product'],
-                    quantity=item_data['quantity'],
-                    price=item_data['price'] # This is the price at time of order
-                )
-                # Reduce product stock
-                item_data['product'].stock -= item_data['quantity']
-                item_data['product'].save()
-
-            # Return the created order details
-            headers = self.get_success_headers(OrderDetailSerializer(order).data)
-            return Response(OrderDetailSerializer(order).data, status=status.HTTP_201_CREATED, headers=headers)
-
-    # Placeholder for actual payment gateway integration
-    def _initiate_payment(self, user, amount, description):
-        """
-        This method would integrate with your chosen payment gateway (e.g., Paystack, Stripe).
-        It would involve:
-        1. Calling the payment gateway's API to initialize a transaction.
-        2. In a real application, you might return a payment URL to the frontend
-           or specific tokens that the frontend uses to open a payment widget.
-        3. A webhook from the payment gateway would then update the Order's payment_status.
-
-        For this example, we just simulate success.
-        """
-        print(f"Simulating payment initiation for user {user.username}, amount {amount}, for: {description}")
-        # In a real scenario, this would be a complex interaction
-        # For now, assume it always succeeds for the purpose of backend logic flow
-        return True
+def order_summary_queryset(model, item_model, user):
+    """A user's orders from `model` (Order or ArchivedOrder) with what OrderSummarySerializer reads."""
+    return model.objects.filter(user=user).select_related('pay_later_application').only(
+        'id', 'created_at', 'status', 'payment_status', 'payment_option', 'total_amount',
+        'remaining_balance', 'repayment_due_date', 'pay_later_application__status',
+    ).prefetch_related(
+        Prefetch('items', queryset=item_model.objects.select_related('product').only(
+            'id', 'order_id', 'product_id', 'quantity', 'price', 'product__name'
+        ))
+    )
 
 class OrderListView(generics.ListAPIView):
-    serializer_class = OrderDetailSerializer
+    """
+    The user's order history, newest first, as cursor pages of order
+    summaries. Archived orders are merged in, so the history is complete.
+    Filters: ?status=, ?created_after=, ?created_before= (see orders/filters.py).
+    """
+    serializer_class = OrderSummarySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderHistoryCursorPagination
 
     def get_queryset(self):
         # Users can only see their own orders
-        return Order.objects.filter(user=self.request.user).order_by('-created_at')
+        return filter_orders(
+            order_summary_queryset(Order, OrderItem, self.request.user), self.request.query_params
+        )
+
+    def get_archived_queryset(self):
+        return filter_orders(
+            order_summary_queryset(ArchivedOrder, ArchivedOrderItem, self.request.user), self.request.query_params
+        )
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset([self.get_queryset(), self.get_archived_queryset()])
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 class OrderDetailView(generics.RetrieveAPIView):
     serializer_class = OrderDetailSerializer
     permission_classes = [IsAuthenticated]
     queryset = Order.objects.all() # Used for lookup, but get_object will filter by user
 
+    def get_queryset(self):
+        return order_detail_queryset()
+
     def get_object(self):
-        # Ensure users can only retrieve their own specific order
-        return get_object_or_404(Order, pk=self.kwargs['pk'], user=self.request.user)
\ No newline at end of file
+        # Ensure users can only retrieve their own specific order, wherever it is stored
+        lookup = {'pk': self.kwargs['pk'], 'user': self.request.user}
+        order = self.get_queryset().filter(**lookup).first()
+        if order is None:
+            order = get_object_or_404(archived_order_detail_queryset(), **lookup)
+        return order
+
+class OrderExportView(APIView):
+    """
+    Staff-only stream of every order with its items, as NDJSON (default) or
+    CSV with ?export_format=csv (one line per order item).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': "Must be 'ndjson' or 'csv'."})
+        rows = order_export_rows()
+        if export_format == 'csv':
+            return csv_response(order_csv_rows(rows), CSV_FIELDS, 'orders')
+        return ndjson_response(rows, 'orders')
+
+class RepaymentListCreateView(IdempotentCreateMixin, generics.ListCreateAPIView):
+    """
+    GET lists the repayment ledger of one of the user's Pay Later orders.
+    POST {"amount": "25.00"} queues a repayment with the payment gateway;
+    it is added to the ledger, and taken off the balance, once the gateway
+    confirms it through the payment webhook.
+    """
+    permission_classes = [IsAuthenticated]
+    idempotency_scope = 'orders.repay'
+
+    def get_serializer_class(self):
+        return RepaymentCreateSerializer if self.request.method == 'POST' else RepaymentSerializer
+
+    def get_queryset(self):
+        return Repayment.objects.filter(order_id=self.kwargs['pk'], user=self.request.user).order_by('created_at', 'pk')
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        amount = serializer.validated_data['amount']
+        order = get_object_or_404(Order, pk=self.kwargs['pk'], user=request.user)
+
+        if order.payment_option not in ['PAY_LATER_40', 'PAY_LATER_0'] or order.status in ['CANCELLED', 'REFUNDED']:
+            return Response({"detail": "This order has no Pay Later balance to repay."},
+                            status=status.HTTP_409_CONFLICT)
+        if order.payment_option == 'PAY_LATER_40' and order.payment_status in ['PENDING', 'FAILED']:
+            return Response({"detail": "The upfront instalment must be paid first."},
+                            status=status.HTTP_409_CONFLICT)
+        if amount > order.remaining_balance:
+            raise ValidationError({'amount': f"Must not exceed the remaining balance of {order.remaining_balance}."})
+
+        payment = queue_payment(order, PaymentOutbox.REPAYMENT, amount)
+        return Response(RepaymentRequestSerializer(payment).data, status=status.HTTP_202_ACCEPTED)
+
+class RepaymentDueView(generics.ListAPIView):
+    """
+    Staff-only list of open Pay Later balances by due date:
+    ?overdue=true, or ?within_days=N (default 7) for those coming due.
+    """
+    serializer_class = RepaymentDueSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        if self.request.query_params.get('overdue') in ('1', 'true'):
+            orders = overdue()
+        else:
+            try:
+                days = int(self.request.query_params.get('within_days', 7))
+            except ValueError:
+                raise ValidationError({'within_days': "Must be a whole number of days."})
+            if not 0 <= days <= 365:
+                raise ValidationError({'within_days': "Must be between 0 and 365."})
+            orders = due_within(days)
+        return orders.select_related('user').order_by('repayment_due_date', 'id')
+
+class OrderTransitionView(APIView):
+    """
+    Staff-only bulk status change:
+
+        {"order_ids": [1, 2, 3], "field": "status", "to": "SHIPPED", "note": "..."}
+
+    Orders the state machine can't move to the target are left as they are
+    and listed under "skipped" with their current value.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        result = transition_orders(data['order_ids'], data['field'], data['to'], user=request.user, note=data['note'])
+        return Response({
+            'updated': result.updated,
+            'skipped': [{'id': pk, 'current': current} for pk, current in result.skipped.items()],
+        })
+
+class PaymentWebhookView(APIView):
+    """
+    Called by the payment gateway with the outcome of a payment we asked it
+    to collect. The body must be signed with PAYMENT_WEBHOOK_SECRET:
+
+        {"reference": "minimart-12-34", "status": "success", "transaction_ref": "..."}
+
+    Deliveries are idempotent; an order whose payment was already settled is
+    left as it is.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        # Read the raw body before DRF parses it, for the signature check
+        if not verify_signature(request.body, request.headers.get(SIGNATURE_HEADER)):
+            return Response({"detail": "Invalid signature."}, status=status.HTTP_403_FORBIDDEN)
+
+        outcome = request.data.get('status')
+        if outcome not in ('success', 'failed'):
+            raise ValidationError({'status': "Must be 'success' or 'failed'."})
+        payment = find_payment(request.data.get('reference'))
+        if payment is None:
+            return Response({"detail": "Unknown payment reference."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            updated = apply_payment_result(payment, outcome == 'success', request.data.get('transaction_ref'))
+        except RepaymentError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response({"detail": "Payment recorded." if updated else "Payment already recorded."})
@@ -1,3 +1,25 @@
-from django.contrib import admin
+# paylater/admin.py
+from django.contrib import admin, messages
 
-# Register your models here.
+from . import crc_cache
+from .models import PayLaterApplication
+
+
+@admin.register(PayLaterApplication)
+class PayLaterApplicationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'status', 'is_eligible', 'credit_score', 'approved_credit_limit', 'outstanding_balance',
+                    'updated_at']
+    list_filter = ['status', 'is_eligible']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'full_name']
+    readonly_fields = ['credit_score', 'crc_decision_data', 'outstanding_balance', 'crc_lease_token',
+                       'crc_lease_expires_at', 'crc_attempts']
+    actions = ['forget_cached_bureau_results']
+
+    @admin.action(description="Forget cached credit bureau results (next check calls the bureau)")
+    def forget_cached_bureau_results(self, request, queryset):
+        national_ids = list(queryset.values_list('national_id_number', flat=True))
+        for national_id in national_ids:
+            crc_cache.invalidate(national_id)
+        self.message_user(request, f"Cached bureau results forgotten for {len(national_ids)} applicant(s).",
+                          messages.SUCCESS)
@@ -0,0 +1,273 @@
+# paylater/bureau_guard.py
+"""
+Circuit breaker and rate limit in front of the credit bureau, so a slow or
+failing bureau doesn't tie up every worker with calls that will time out.
+
+The breaker is closed while the bureau answers. After
+CRC_BREAKER_FAILURE_THRESHOLD failed calls in a row it opens, and calls
+fail straight away with CircuitOpen. After CRC_BREAKER_RESET_TIMEOUT it is
+half-open: one trial call goes through. Success closes the breaker and
+failure opens it again.
+
+The rate limit is a token bucket refilled at CRC_RATE_LIMIT requests a
+second, holding up to CRC_RATE_BURST. A call that would wait longer than
+CRC_RATE_MAX_WAIT for its tokens raises RateLimited instead of waiting.
+admissible() says how many requests could go now, so a collector can
+size its batch to fit rather than be turned away.
+
+Both raise BureauUnavailable, a RequestException, so callers release
+their leases as for any failed call. Tasks defer the check with a
+jittered backoff() rather than retrying on a fixed delay.
+
+State is kept in the 'crc' cache alias, on the Redis server the Celery
+broker runs on (CRC_STATE_REDIS_URL), so every worker shares one breaker
+and one bucket. Without that setting it is local memory, for development
+and tests. metrics() reports the breaker state and how
+long calls have waited for the rate limit.
+"""
+import math
+import random
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+cache = ConnectionProxy(caches, 'crc')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+BREAKER_KEY = 'crc:breaker'
+BUCKET_KEY = 'crc:bucket'
+METRIC_KEYS = ('breaker_opened', 'breaker_rejected', 'rate_limited', 'rate_waits', 'rate_wait_ms')
+LOCK_WAIT = 0.05 # Seconds to wait for the state lock before going ahead without it
+
+
+class BureauUnavailable(requests.RequestException):
+    """The call wasn't made; try again after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(BureauUnavailable):
+    pass
+
+
+class RateLimited(BureauUnavailable):
+    pass
+
+
+def _count(name, amount=1):
+    key = f'crc:metrics:{name}'
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+
+
+@contextmanager
+def _locked(key):
+    """A short mutex on cache.add(); a holder that died lets it go after a second."""
+    lock, deadline = f'{key}:lock', time.monotonic() + LOCK_WAIT
+    acquired = cache.add(lock, 1, timeout=1)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.001)
+        acquired = cache.add(lock, 1, timeout=1)
+    try:
+        yield
+    finally:
+        if acquired:
+            cache.delete(lock)
+
+
+def is_bureau_failure(exc):
+    """
+    Whether an exception from a bureau call says the bureau is unwell:
+    connection errors, timeouts, 5xx and 429. A 4xx about one check, or an
+    error for one item of a bulk response, is an answer and doesn't count.
+    """
+    if not isinstance(exc, requests.RequestException) or isinstance(exc, BureauUnavailable):
+        return False
+    if isinstance(exc, requests.HTTPError):
+        return exc.response is not None and (exc.response.status_code >= 500 or exc.response.status_code == 429)
+    return True
+
+
+class CircuitBreaker:
+
+    def __init__(self, key, failure_threshold, reset_timeout, trial_timeout):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = trial_timeout # How long a half-open trial call may take before another is allowed
+
+    def _load(self):
+        return cache.get(self.key) or {'failures': 0, 'opened_at': None}
+
+    def state(self, now=None):
+        opened_at = self._load()['opened_at']
+        if opened_at is None:
+            return CLOSED
+        return OPEN if (now or time.time()) - opened_at < self.reset_timeout else HALF_OPEN
+
+    def before_call(self, now=None):
+        """Raises CircuitOpen unless the call may go ahead."""
+        now = now or time.time()
+        opened_at = self._load()['opened_at']
+        if opened_at is None:
+            return
+        retry_after = opened_at + self.reset_timeout - now
+        if retry_after <= 0:
+            if cache.add(f'{self.key}:trial', 1, timeout=self.trial_timeout):
+                return # This caller makes the half-open trial call
+            retry_after = self.trial_timeout
+        _count('breaker_rejected')
+        raise CircuitOpen("Credit bureau circuit breaker is open.", retry_after=retry_after)
+
+    def record_success(self):
+        if self._load() != {'failures': 0, 'opened_at': None}:
+            with _locked(self.key):
+                cache.set(self.key, {'failures': 0, 'opened_at': None}, timeout=None)
+            cache.delete(f'{self.key}:trial')
+
+    def record_failure(self, count=1, now=None):
+        now = now or time.time()
+        with _locked(self.key):
+            state = self._load()
+            state['failures'] += count
+            # A failed half-open trial opens it again, as does reaching the threshold while closed
+            reopen = state['opened_at'] is not None and now - state['opened_at'] >= self.reset_timeout
+            if reopen or (state['opened_at'] is None and state['failures'] >= self.failure_threshold):
+                state['opened_at'] = now
+                _count('breaker_opened')
+            cache.set(self.key, state, timeout=None)
+        cache.delete(f'{self.key}:trial')
+
+    def snapshot(self, now=None):
+        now = now or time.time()
+        state = self._load()
+        return {
+            'state': self.state(now),
+            'consecutive_failures': state['failures'],
+            'retry_after_seconds': max(0.0, round(state['opened_at'] + self.reset_timeout - now, 3))
+            if state['opened_at'] is not None else 0.0,
+        }
+
+
+class TokenBucket:
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def _refilled(self, now):
+        tokens, updated_at = cache.get(self.key) or (self.burst, now)
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+
+    def reserve(self, cost=1, max_wait=0.0, now=None):
+        """
+        Takes `cost` tokens and returns how long to wait before using them
+        (the bucket may go into debt for a batch larger than it holds).
+        Raises RateLimited, taking nothing, if that's longer than max_wait.
+        """
+        now = now or time.time()
+        with _locked(self.key):
+            tokens = self._refilled(now)
+            wait = max(0.0, (cost - tokens) / self.rate)
+            if wait > max_wait:
+                _count('rate_limited')
+                raise RateLimited("Credit bureau rate limit reached.", retry_after=wait)
+            cache.set(self.key, (tokens - cost, now), timeout=None)
+        if wait:
+            _count('rate_waits')
+            _count('rate_wait_ms', round(wait * 1000))
+        return wait
+
+    def available(self, max_wait=0.0, now=None):
+        """Whole tokens reserve() would hand over without waiting longer than max_wait."""
+        return max(0, math.floor(self._refilled(now or time.time()) + max_wait * self.rate))
+
+    def snapshot(self, now=None):
+        return {'tokens': round(self._refilled(now or time.time()), 3), 'rate': self.rate, 'burst': self.burst}
+
+
+def crc_breaker():
+    return CircuitBreaker(
+        BREAKER_KEY, settings.CRC_BREAKER_FAILURE_THRESHOLD, settings.CRC_BREAKER_RESET_TIMEOUT.total_seconds(),
+        trial_timeout=settings.CRC_CONNECT_TIMEOUT + settings.CRC_READ_TIMEOUT,
+    )
+
+
+def crc_rate_limiter():
+    return TokenBucket(BUCKET_KEY, settings.CRC_RATE_LIMIT, settings.CRC_RATE_BURST)
+
+
+def admissible():
+    """How many bureau requests admit() would let through now, within CRC_RATE_MAX_WAIT."""
+    return crc_rate_limiter().available(settings.CRC_RATE_MAX_WAIT)
+
+
+def admit(cost=1):
+    """
+    Lets `cost` bureau requests through, first waiting for the rate limit
+    if need be. Raises CircuitOpen or RateLimited instead.
+    """
+    crc_breaker().before_call()
+    wait = crc_rate_limiter().reserve(cost, max_wait=settings.CRC_RATE_MAX_WAIT)
+    if wait:
+        time.sleep(wait)
+
+
+def record(results):
+    """Tells the breaker how bureau calls went: a result or the exception raised, for each."""
+    breaker = crc_breaker()
+    failures = len({id(result) for result in results if is_bureau_failure(result)}) # A failed bulk request counts once
+    if any(not isinstance(result, Exception) for result in results):
+        breaker.record_success()
+    elif failures:
+        breaker.record_failure(failures)
+
+
+def guarded(call, cost=1):
+    """Runs call() under admit() and record(); `call` raises on failure."""
+    admit(cost)
+    try:
+        result = call()
+    except Exception as exc:
+        record([exc])
+        raise
+    record([result])
+    return result
+
+
+def backoff(retries, retry_after=0.0):
+    """
+    Seconds to defer a check by: random up to CRC_RETRY_BASE_DELAY * 2^retries
+    (capped at CRC_RETRY_MAX_DELAY), so deferred checks don't all come back
+    at once, and never before `retry_after`.
+    """
+    ceiling = min(settings.CRC_RETRY_MAX_DELAY.total_seconds(),
+                  settings.CRC_RETRY_BASE_DELAY.total_seconds() * 2 ** retries)
+    return max(retry_after, random.uniform(0, ceiling))
+
+
+def metrics():
+    """Breaker state, rate limit tokens and wait times, and counters since the cache was last cleared."""
+    counters = cache.get_many([f'crc:metrics:{name}' for name in METRIC_KEYS])
+    counters = {name: counters.get(f'crc:metrics:{name}', 0) for name in METRIC_KEYS}
+    waits = counters['rate_waits']
+    return {
+        'breaker': dict(crc_breaker().snapshot(), opened_total=counters['breaker_opened'],
+                        rejected_total=counters['breaker_rejected']),
+        'rate_limiter': dict(crc_rate_limiter().snapshot(), limited_total=counters['rate_limited'],
+                             waits_total=waits, wait_seconds_total=counters['rate_wait_ms'] / 1000,
+                             average_wait_seconds=round(counters['rate_wait_ms'] / 1000 / waits, 3) if waits else 0.0),
+    }
@@ -0,0 +1,326 @@
+# paylater/crc.py
+"""
+Credit checks in three steps, so no database lock is held while the
+bureau is working:
+
+1. claim_check() takes a lease on the application in one short
+   transaction: a conditional UPDATE that sets PENDING_CRC_CHECK, a fresh
+   lease token and a lease expiry. It only succeeds if the application
+   isn't decided yet and nobody else holds a live lease.
+2. The bureau is called with no transaction open.
+3. commit_result() writes the decision with a compare-and-set on the
+   lease token. If the lease expired and another worker took the check
+   over in the meantime, this worker's result is dropped.
+
+A worker that dies mid-call leaves its lease to expire. stale_checks()
+finds those applications, and the beat sweep queues their checks again.
+
+run_crc_checks() does the same for many applications at once: one UPDATE
+claims them all under a shared lease token, the bureau is sent the batch
+(its bulk endpoint, or concurrent calls on the pooled CRC client), and
+one bulk_update commits the results. During a surge, new applications
+aren't checked one task each. queue_crc_check() just counts them, and
+submit_crc_batches() collects whatever is waiting, every CRC_BATCH_WINDOW
+or as soon as CRC_BATCH_SIZE have arrived.
+
+Bureau results are cached (paylater/crc_cache.py); a check whose result
+is cached commits it without calling the bureau.
+
+Bureau calls go through a circuit breaker and rate limit
+(paylater/bureau_guard.py). A check turned away by them releases its
+lease without using up one of its CRC_MAX_ATTEMPTS.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import bureau_guard, crc_cache
+from .models import PayLaterApplication
+from .services import call_crc_api, call_crc_api_bulk, get_crc_client
+
+FINAL_STATUSES = ('APPROVED_ELIGIBLE', 'REJECTED_INELIGIBLE')
+KYC_FIELDS = ('national_id_number', 'date_of_birth', 'monthly_income', 'address', 'phone_number', 'full_name')
+RESULT_FIELDS = ('status', 'is_eligible', 'credit_score', 'crc_decision_data', 'approved_credit_limit',
+                 'eligibility_reason', 'crc_lease_token', 'crc_lease_expires_at', 'updated_at')
+PENDING_COUNTER_KEY = 'crc:pending'
+
+# run_crc_check() outcomes
+COMPLETED = 'completed' # The decision was saved
+SKIPPED = 'skipped'     # Already decided, unknown, or another worker holds the lease
+LOST = 'lost'           # The lease expired and was taken over before the result came back
+
+
+def claim_check(application_id, ttl=None, now=None):
+    """
+    Leases the application for a credit check. Returns (token, application)
+    with the KYC fields loaded, or None if it can't be claimed right now.
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4()
+    with transaction.atomic():
+        claimed = PayLaterApplication.objects.filter(pk=application_id).exclude(status__in=FINAL_STATUSES).filter(
+            Q(crc_lease_expires_at__isnull=True) | Q(crc_lease_expires_at__lt=now)
+        ).update(
+            status='PENDING_CRC_CHECK', crc_lease_token=token,
+            crc_lease_expires_at=now + (ttl or settings.CRC_CHECK_LEASE_TTL), crc_attempts=F('crc_attempts') + 1,
+            updated_at=now,
+        )
+        if not claimed:
+            return None
+        return token, PayLaterApplication.objects.only(*KYC_FIELDS).get(pk=application_id)
+
+
+def claim_batch(application_ids=None, after=0, limit=None, ttl=None, now=None):
+    """
+    Leases many applications at once under one token, with a single UPDATE.
+    Given ids, claims those of them that claim_check() would. Otherwise
+    collects up to `limit` (CRC_BATCH_SIZE) waiting applications with ids
+    above `after`: submitted, or released after a failed call, and tried
+    fewer than CRC_MAX_ATTEMPTS times. Returns (token, applications), the
+    applications in id order with the KYC fields loaded.
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4()
+    with transaction.atomic():
+        if application_ids is None:
+            waiting = PayLaterApplication.objects.filter(
+                status__in=('SUBMITTED_KYC', 'PENDING_CRC_CHECK'), crc_lease_expires_at__isnull=True,
+                crc_attempts__lt=settings.CRC_MAX_ATTEMPTS, pk__gt=after,
+            ).order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                waiting = waiting.select_for_update(skip_locked=True) # Let concurrent collectors take other rows
+            application_ids = list(waiting.values_list('pk', flat=True)[:limit or settings.CRC_BATCH_SIZE])
+        if not application_ids:
+            return token, []
+        claimed = PayLaterApplication.objects.filter(pk__in=application_ids).exclude(status__in=FINAL_STATUSES).filter(
+            Q(crc_lease_expires_at__isnull=True) | Q(crc_lease_expires_at__lt=now)
+        ).update(
+            status='PENDING_CRC_CHECK', crc_lease_token=token,
+            crc_lease_expires_at=now + (ttl or settings.CRC_CHECK_LEASE_TTL), crc_attempts=F('crc_attempts') + 1,
+            updated_at=now,
+        )
+        if not claimed:
+            return token, []
+        return token, list(PayLaterApplication.objects.only(*KYC_FIELDS).filter(crc_lease_token=token).order_by('pk'))
+
+
+def crc_user_data(application):
+    """The KYC details sent to the bureau alongside the national ID."""
+    return {
+        'date_of_birth': application.date_of_birth,
+        'monthly_income': application.monthly_income,
+        'address': application.address,
+        'phone_number': application.phone_number,
+        'full_name': application.full_name,
+    }
+
+
+def commit_result(application_id, token, result):
+    """
+    Saves a call_crc_api() result if `token` still holds the lease; returns
+    whether it did.
+    """
+    is_approved, credit_score, reason, approved_limit, raw_crc_response = result
+    return bool(PayLaterApplication.objects.filter(
+        pk=application_id, crc_lease_token=token, status='PENDING_CRC_CHECK'
+    ).update(
+        status='APPROVED_ELIGIBLE' if is_approved else 'REJECTED_INELIGIBLE',
+        is_eligible=bool(is_approved),
+        credit_score=credit_score,
+        crc_decision_data=raw_crc_response,
+        approved_credit_limit=approved_limit,
+        eligibility_reason=reason,
+        crc_lease_token=None, crc_lease_expires_at=None, updated_at=timezone.now(),
+    ))
+
+
+def commit_results(token, results):
+    """
+    commit_result() for a batch claimed under one token: `results` maps
+    application ids to call_crc_api() results. The applications that still
+    hold the lease are written with one bulk_update. Returns their ids.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        held = PayLaterApplication.objects.filter(
+            pk__in=list(results), crc_lease_token=token, status='PENDING_CRC_CHECK'
+        ).only('pk')
+        if connection.features.has_select_for_update:
+            held = held.select_for_update()
+        applications = list(held)
+        for application in applications:
+            is_approved, credit_score, reason, approved_limit, raw_crc_response = results[application.pk]
+            application.status = 'APPROVED_ELIGIBLE' if is_approved else 'REJECTED_INELIGIBLE'
+            application.is_eligible = bool(is_approved)
+            application.credit_score = credit_score
+            application.crc_decision_data = raw_crc_response
+            application.approved_credit_limit = approved_limit
+            application.eligibility_reason = reason
+            application.crc_lease_token = application.crc_lease_expires_at = None
+            application.updated_at = now
+        PayLaterApplication.objects.bulk_update(applications, RESULT_FIELDS)
+    return {application.pk for application in applications}
+
+
+def release_claim(application_id, token):
+    """Gives the lease up early (the call failed), so a retry can claim the check straight away."""
+    release_claims([application_id], token)
+
+
+def release_claims(application_ids, token, refund_attempt=False):
+    """release_claim() for many; `refund_attempt` when the bureau was never called."""
+    extra = {'crc_attempts': F('crc_attempts') - 1} if refund_attempt else {}
+    PayLaterApplication.objects.filter(pk__in=application_ids, crc_lease_token=token).update(
+        crc_lease_token=None, crc_lease_expires_at=None, updated_at=timezone.now(), **extra
+    )
+
+
+def cached_result(application):
+    """
+    The cached bureau result for this applicant, or None. A stale one (at
+    most CRC_CACHE_STALE_TTL past its TTL) still decides this application;
+    the background refresh is for the next one.
+    """
+    user_data = crc_user_data(application)
+    result, state = crc_cache.lookup(application.national_id_number, user_data)
+    if state == crc_cache.STALE and crc_cache.claim_refresh(application.national_id_number, user_data):
+        from .tasks import refresh_crc_result_task
+        refresh_crc_result_task.delay(application.pk)
+    return result
+
+
+def fetch_result(application):
+    """Calls the bureau for this applicant and caches what it says."""
+    user_data = crc_user_data(application)
+    result = call_crc_api(application.national_id_number, user_data)
+    crc_cache.store(application.national_id_number, user_data, result)
+    return result
+
+
+def run_crc_check(application_id):
+    """Claims, calls the bureau outside any transaction, and commits; returns one of the outcomes above."""
+    lease = claim_check(application_id)
+    if lease is None:
+        return SKIPPED
+    token, application = lease
+    result = cached_result(application)
+    if result is None:
+        try:
+            result = fetch_result(application)
+        except Exception as exc:
+            release_claims([application_id], token, refund_attempt=isinstance(exc, bureau_guard.BureauUnavailable))
+            raise
+    return COMPLETED if commit_result(application_id, token, result) else LOST
+
+
+def run_batch(token, applications):
+    """
+    Checks applications claimed together under `token`: cached results
+    first, the rest in one call_crc_api_bulk(), then one commit. Returns
+    {application_id: outcome}; a failed call releases its lease and is
+    reported as the exception it raised.
+    """
+    outcomes, results, misses = {}, {}, []
+    for application in applications:
+        result = cached_result(application)
+        if result is None:
+            misses.append(application)
+        else:
+            results[application.pk] = result
+
+    try:
+        fetched = call_crc_api_bulk([
+            (application.national_id_number, crc_user_data(application)) for application in misses
+        ]) if misses else []
+    except bureau_guard.BureauUnavailable as exc:
+        outcomes = {application.pk: exc for application in misses}
+        release_claims(list(outcomes), token, refund_attempt=True)
+        fetched = []
+    for application, result in zip(misses, fetched):
+        if isinstance(result, Exception):
+            outcomes[application.pk] = result
+        else:
+            crc_cache.store(application.national_id_number, crc_user_data(application), result)
+            results[application.pk] = result
+    if fetched and outcomes:
+        release_claims(list(outcomes), token)
+
+    committed = commit_results(token, results) if results else set()
+    outcomes.update({application_id: COMPLETED if application_id in committed else LOST for application_id in results})
+    return outcomes
+
+
+def run_crc_checks(application_ids):
+    """
+    run_crc_check() for many applications: claims each CRC_BATCH_SIZE of
+    them in one UPDATE, checks them as one batch (run_batch()) and commits
+    with one bulk_update. Returns {application_id: outcome}.
+    """
+    outcomes = {application_id: SKIPPED for application_id in application_ids}
+    for start in range(0, len(application_ids), settings.CRC_BATCH_SIZE):
+        token, applications = claim_batch(application_ids[start:start + settings.CRC_BATCH_SIZE])
+        outcomes.update(run_batch(token, applications))
+    return outcomes
+
+
+def submit_crc_batches(max_batches=None):
+    """
+    Collects waiting applications in batches of CRC_BATCH_SIZE and checks
+    each batch, until none are left or `max_batches` have been sent. A
+    check that fails waits for the next run. Nothing is claimed while the
+    bureau's circuit breaker is open. A batch is cut down to what the rate
+    limit would let through now, and the run ends when that is nothing or
+    a batch was turned away anyway; the rest wait, their attempts unused,
+    for the next run. Returns {application_id: outcome}.
+    """
+    outcomes, after, batches = {}, 0, 0
+    while max_batches is None or batches < max_batches:
+        if bureau_guard.crc_breaker().state() == bureau_guard.OPEN:
+            break
+        limit = min(settings.CRC_BATCH_SIZE, get_crc_client().checks_within(bureau_guard.admissible()))
+        if limit < 1:
+            break
+        token, applications = claim_batch(after=after, limit=limit)
+        if not applications:
+            break
+        batch_outcomes = run_batch(token, applications)
+        outcomes.update(batch_outcomes)
+        if any(isinstance(outcome, bureau_guard.BureauUnavailable) for outcome in batch_outcomes.values()):
+            break
+        after, batches = applications[-1].pk, batches + 1
+    return outcomes
+
+
+def queue_crc_check():
+    """
+    Notes a newly submitted application. The beat sends its batch within
+    CRC_BATCH_WINDOW; every CRC_BATCH_SIZE-th submission sends one now.
+    """
+    try:
+        pending = cache.incr(PENDING_COUNTER_KEY)
+    except ValueError:
+        cache.add(PENDING_COUNTER_KEY, 0, timeout=None)
+        pending = cache.incr(PENDING_COUNTER_KEY)
+    if pending % settings.CRC_BATCH_SIZE == 0:
+        from .tasks import submit_crc_batches_task
+        submit_crc_batches_task.delay()
+    return pending
+
+
+def refresh_cached_result(application_id):
+    """Fetches a new bureau result for the applicant into the cache; the application itself is left alone."""
+    application = PayLaterApplication.objects.only(*KYC_FIELDS).filter(pk=application_id).first()
+    if application is not None:
+        fetch_result(application)
+    return application is not None
+
+
+def stale_checks(now=None):
+    """Ids of checks whose worker let the lease expire without committing."""
+    return list(PayLaterApplication.objects.filter(
+        status='PENDING_CRC_CHECK', crc_lease_expires_at__lt=now or timezone.now()
+    ).values_list('pk', flat=True))
@@ -0,0 +1,104 @@
+# paylater/crc_cache.py
+"""
+Cache of parsed credit bureau results, so re-applications, re-checks and
+task retries for the same person don't pay for another bureau call.
+
+Results are keyed on an HMAC (keyed with CRC_CACHE_SALT) of the national
+ID and the KYC details sent to the bureau, so neither appears in a cache
+key and a change to any of them misses the cache. A result is fresh for
+CRC_CACHE_TTL. For CRC_CACHE_STALE_TTL after that it is still served, and
+a background task fetches a new one (stale-while-revalidate). A stale
+result is final for the application it decides: the refresh only updates
+the cache. So the stale window is kept short (an hour by default), and past
+it a result is a miss even if the cache still holds it.
+
+Like the catalog cache, keys include a per-person generation counter.
+invalidate() bumps it, which drops every cached result for that national
+ID without having to find them.
+
+Results and counters live in the 'crc' cache alias, which every worker
+and web process shares, so a hit in one is a hit in all and invalidating
+from the admin reaches the workers that do the lookups.
+"""
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.connection import ConnectionProxy
+
+cache = ConnectionProxy(caches, 'crc')
+
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+def _digest(*parts):
+    message = json.dumps(parts, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return hmac.new(settings.CRC_CACHE_SALT.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+def _generation_key(national_id):
+    return f'crc:generation:{_digest(national_id)}'
+
+
+def _generation(national_id):
+    key = _generation_key(national_id)
+    generation = cache.get(key)
+    if generation is None:
+        # From the clock, so an evicted counter can't come back to an old value
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def result_key(national_id, user_data):
+    kyc = [user_data.get(field) for field in ('date_of_birth', 'monthly_income', 'address', 'phone_number', 'full_name')]
+    return f'crc:result:{_generation(national_id)}:{_digest(national_id, *kyc)}'
+
+
+def lookup(national_id, user_data, now=None):
+    """
+    Returns (result, state) for a cached result, FRESH or STALE, with the
+    hit noted in the raw response for the audit trail. Returns (None, None)
+    on a miss.
+    """
+    entry = cache.get(result_key(national_id, user_data))
+    if entry is None:
+        return None, None
+    age = (now or time.time()) - entry['fetched_at']
+    if age >= (settings.CRC_CACHE_TTL + settings.CRC_CACHE_STALE_TTL).total_seconds():
+        return None, None
+    state = FRESH if age < settings.CRC_CACHE_TTL.total_seconds() else STALE
+    is_approved, credit_score, reason, approved_limit, raw_crc_response = entry['result']
+    audited = dict(raw_crc_response or {}, cache={
+        'hit': True, 'state': state, 'age_seconds': round(age, 3),
+        'fetched_at': datetime.fromtimestamp(entry['fetched_at'], tz=timezone.utc).isoformat(),
+    })
+    return (is_approved, credit_score, reason, approved_limit, audited), state
+
+
+def store(national_id, user_data, result, now=None):
+    """Caches a call_crc_api() result for CRC_CACHE_TTL + CRC_CACHE_STALE_TTL."""
+    cache.set(
+        result_key(national_id, user_data), {'result': list(result), 'fetched_at': now or time.time()},
+        timeout=(settings.CRC_CACHE_TTL + settings.CRC_CACHE_STALE_TTL).total_seconds(),
+    )
+
+
+def invalidate(national_id):
+    """Forgets every cached result for this national ID."""
+    try:
+        cache.incr(_generation_key(national_id))
+    except ValueError:
+        _generation(national_id)
+
+
+def claim_refresh(national_id, user_data):
+    """True for the one caller that should refresh a stale result; the claim lapses after a bureau timeout."""
+    return cache.add(f'crc:refreshing:{result_key(national_id, user_data)}', 1,
+                     timeout=settings.CRC_CONNECT_TIMEOUT + settings.CRC_READ_TIMEOUT)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paylater', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paylaterapplication',
+            name='outstanding_balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Total the user still owes on Pay Later orders.', max_digits=12),
+        ),
+    ]
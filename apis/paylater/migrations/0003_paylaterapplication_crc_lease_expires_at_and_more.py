@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paylater', '0002_paylaterapplication_outstanding_balance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paylaterapplication',
+            name='crc_lease_expires_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Another worker may take the check over after this.', null=True),
+        ),
+        migrations.AddField(
+            model_name='paylaterapplication',
+            name='crc_lease_token',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paylaterapplication',
+            index=models.Index(fields=['status', 'crc_lease_expires_at'], name='paylater_pa_status_95fc80_idx'),
+        ),
+    ]
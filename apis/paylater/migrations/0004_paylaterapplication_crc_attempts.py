@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('paylater', '0003_paylaterapplication_crc_lease_expires_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paylaterapplication',
+            name='crc_attempts',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Credit checks claimed so far; the batch collector gives up at CRC_MAX_ATTEMPTS.'),
+        ),
+    ]
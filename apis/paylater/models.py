@@ -37,6 +37,19 @@ class PayLaterApplication(models.Model):
     approved_credit_limit = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True,
                                                 help_text="Maximum credit limit approved by CRC/system.")
 
+    # Sum of remaining_balance over the user's Pay Later orders, kept in step
+    # by checkout and orders/repayments.py so it is never re-summed
+    outstanding_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False,
+                                              help_text="Total the user still owes on Pay Later orders.")
+
+    # Lease held by the worker running the credit check (paylater/crc.py). The bureau
+    # is called with no transaction open; only the holder of the token may commit.
+    crc_lease_token = models.UUIDField(null=True, blank=True, editable=False)
+    crc_lease_expires_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                                help_text="Another worker may take the check over after this.")
+    crc_attempts = models.PositiveSmallIntegerField(default=0, editable=False,
+                                                    help_text="Credit checks claimed so far; the batch collector gives up at CRC_MAX_ATTEMPTS.")
+
     # Final Eligibility Decision
     is_eligible = models.BooleanField(default=False,
                                       help_text="Final decision on user's Pay Later eligibility.")
@@ -50,4 +63,7 @@ class PayLaterApplication(models.Model):
         return f"Pay Later App for {self.user.username} - {self.status}"
 
     class Meta:
-        verbose_name_plural = "Pay Later Applications"
\ No newline at end of file
+        verbose_name_plural = "Pay Later Applications"
+        indexes = [
+            models.Index(fields=['status', 'crc_lease_expires_at']), # Index for the stale lease sweep
+        ]
\ No newline at end of file
@@ -9,12 +9,12 @@ class PayLaterApplicationSerializer(serializers.ModelSerializer):
             'date_of_birth', 'address', 'phone_number', 'employment_status',
             'monthly_income', 'credit_score', 'crc_decision_data',
             'is_eligible', 'eligibility_reason', 'approved_credit_limit',
-            'created_at', 'updated_at'
+            'outstanding_balance', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'user', 'status', 'credit_score', 'crc_decision_data',
             'is_eligible', 'eligibility_reason', 'approved_credit_limit',
-            'created_at', 'updated_at'
+            'outstanding_balance', 'created_at', 'updated_at'
         ]
         # Make these fields writable for initial submission,
         # but read-only for subsequent checks. The `create` method handles `user` and `status`.
@@ -31,5 +31,5 @@ class PayLaterApplicationSerializer(serializers.ModelSerializer):
 class PayLaterEligibilitySerializer(serializers.ModelSerializer):
     class Meta:
         model = PayLaterApplication
-        fields = ['is_eligible', 'status', 'eligibility_reason', 'approved_credit_limit']
-        read_only_fields = ['is_eligible', 'status', 'eligibility_reason', 'approved_credit_limit']
\ No newline at end of file
+        fields = ['is_eligible', 'status', 'eligibility_reason', 'approved_credit_limit', 'outstanding_balance']
+        read_only_fields = ['is_eligible', 'status', 'eligibility_reason', 'approved_credit_limit', 'outstanding_balance']
\ No newline at end of file
@@ -1,62 +1,226 @@
-import requests
-import json
+import asyncio
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 
-def call_crc_api(national_id: str, user_data: dict):
+from . import bureau_guard
+
+
+class CRCClient:
     """
-    Simulates calling an external CRC (Credit Reference Company) API.
-    In a real scenario, replace this with actual API calls to your chosen CRC.
+    Client for the CRC (Credit Reference Company) bureau API.
+
+    One instance holds a requests.Session with a keep-alive connection pool
+    of `max_in_flight` connections, so checks after the first skip the TCP
+    and TLS handshakes. check() makes one call. check_many() keeps up to
+    `max_in_flight` calls in flight at once from a single worker process:
+    an asyncio loop hands the blocking calls to a thread pool that shares
+    the session's connection pool. check_bulk() sends many checks in one
+    request to the bureau's bulk endpoint, when it has one.
     """
-    print(f"Calling CRC API for national ID: {national_id}")
-
-    # --- Actual CRC API Integration (Uncomment and fill in for production) ---
-    # CRC_API_ENDPOINT = getattr(settings, 'CRC_API_ENDPOINT', 'https://api.crcsoftware.com/credit_check')
-    # CRC_API_KEY = getattr(settings, 'CRC_API_KEY', 'your_actual_crc_api_key')
-    # headers = {'Authorization': f'Bearer {CRC_API_KEY}', 'Content-Type': 'application/json'}
-    # payload = {
-    #     'national_id': national_id,
-    #     'dob': user_data.get('date_of_birth').strftime('%Y-%m-%d') if user_data.get('date_of_birth') else None,
-    #     'income_level': float(user_data.get('monthly_income', 0)) if user_data.get('monthly_income') else None,
-    #     'address': user_data.get('address'),
-    #     'phone_number': user_data.get('phone_number'),
-    # }
-    # try:
-    #     response = requests.post(CRC_API_ENDPOINT, headers=headers, json=payload, timeout=30)
-    #     response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-    #     crc_result = response.json()
-
-    #     # --- LOGIC TO PARSE REAL CRC RESPONSE (Highly dependent on CRC API) ---
-    #     is_approved = crc_result.get('status') == 'approved'
-    #     credit_score = crc_result.get('score')
-    #     decision_reason = crc_result.get('message', 'Credit check completed.')
-    #     approved_limit = crc_result.get('approved_limit') # If CRC returns a limit
-
-    #     return is_approved, credit_score, decision_reason, approved_limit, crc_result
-    # except requests.exceptions.RequestException as e:
-    #     print(f"CRC API call failed for {national_id}: {e}")
-    #     return False, None, f"External credit check failed: {str(e)}", None, None
-    # --- End Actual CRC Integration ---
-
-
-    # --- SIMULATED CRC API RESPONSE (FOR DEVELOPMENT) ---
-    time.sleep(random.uniform(2, 5)) # Simulate network latency
-
-    # Increase chance of approval for testing
-    simulated_approved = random.choices([True, False], weights=[0.7, 0.3], k=1)[0]
-    simulated_score = random.randint(500, 850) if simulated_approved else random.randint(300, 550)
-    simulated_reason = "Approved based on good credit history." if simulated_approved else "Rejected due to low credit score or insufficient history."
-    simulated_limit = round(random.uniform(50000, 200000), 2) if simulated_approved else None
-
-    simulated_response_data = {
-        "status": "success" if simulated_approved else "failed",
-        "score": simulated_score,
-        "decision_message": simulated_reason,
-        "approved_limit": simulated_limit,
-        "timestamp": datetime.now().isoformat()
+
+    def __init__(self, endpoint, api_key='', connect_timeout=3.05, read_timeout=30, max_in_flight=32,
+                 bulk_endpoint='', batch_size=100):
+        self.endpoint = endpoint
+        self.bulk_endpoint = bulk_endpoint
+        self.batch_size = batch_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_in_flight = max_in_flight
+        self.session = requests.Session()
+        # One pool (one bureau host) with a connection per in-flight call; failed
+        # calls are retried by the Celery task rather than here
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def payload(national_id, user_data):
+        return {
+            'national_id': national_id,
+            'dob': user_data.get('date_of_birth').strftime('%Y-%m-%d') if user_data.get('date_of_birth') else None,
+            'income_level': float(user_data.get('monthly_income', 0)) if user_data.get('monthly_income') else None,
+            'address': user_data.get('address'),
+            'phone_number': user_data.get('phone_number'),
+        }
+
+    @staticmethod
+    def parse(crc_result):
+        """Turns the bureau's JSON into (is_approved, credit_score, reason, approved_limit, raw_response)."""
+        is_approved = crc_result.get('status') == 'approved'
+        credit_score = crc_result.get('score')
+        decision_reason = crc_result.get('message', 'Credit check completed.')
+        approved_limit = crc_result.get('approved_limit') # If CRC returns a limit
+        return is_approved, credit_score, decision_reason, approved_limit, crc_result
+
+    def check(self, national_id, user_data):
+        """One credit check. Raises requests.RequestException on timeouts, connection and HTTP errors."""
+        response = self.session.post(self.endpoint, json=self.payload(national_id, user_data), timeout=self.timeout)
+        response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
+        return self.parse(response.json())
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='crc')
+            return self._executor
+
+    async def acheck_many(self, checks):
+        """
+        Runs (national_id, user_data) checks concurrently. Returns a result or
+        the raised exception for each check, in the order given.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        return await asyncio.gather(
+            *[loop.run_in_executor(executor, self.check, national_id, user_data) for national_id, user_data in checks],
+            return_exceptions=True,
+        )
+
+    def check_many(self, checks):
+        """Blocking wrapper around acheck_many(), for Celery tasks."""
+        return asyncio.run(self.acheck_many(list(checks))) if checks else []
+
+    def _check_chunk(self, checks):
+        try:
+            response = self.session.post(
+                self.bulk_endpoint, json={'checks': [self.payload(*check) for check in checks]}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            results = response.json()['results']
+            if len(results) != len(checks):
+                raise requests.RequestException(f"Bulk check returned {len(results)} results for {len(checks)} checks.")
+        except (requests.RequestException, ValueError, KeyError) as exc:
+            return [exc if isinstance(exc, requests.RequestException) else requests.RequestException(exc)] * len(checks)
+        return [
+            requests.HTTPError(result['error']) if result.get('error') else self.parse(result) for result in results
+        ]
+
+    def request_count(self, checks):
+        """HTTP requests check_bulk() makes for this many checks."""
+        return -(-checks // self.batch_size) if self.bulk_endpoint else checks
+
+    def checks_within(self, request_count):
+        """The most checks check_bulk() can make in `request_count` HTTP requests."""
+        return request_count * self.batch_size if self.bulk_endpoint else request_count
+
+    def check_bulk(self, checks):
+        """
+        Like check_many(), but sends up to `batch_size` checks per request to
+        the bulk endpoint; results come back in the order sent. A failed
+        request fails every check in it. Without a bulk endpoint this is
+        check_many().
+        """
+        checks = list(checks)
+        if not self.bulk_endpoint:
+            return self.check_many(checks)
+        results = []
+        for start in range(0, len(checks), self.batch_size):
+            results.extend(self._check_chunk(checks[start:start + self.batch_size]))
+        return results
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.session.close()
+
+
+class SimulatedCRCClient(CRCClient):
+    """Used when CRC_API_ENDPOINT isn't set (development): made-up decisions after a realistic delay."""
+
+    def check(self, national_id, user_data):
+        print(f"Calling CRC API for national ID: {national_id}")
+        time.sleep(random.uniform(2, 5)) # Simulate network latency
+
+        # Increase chance of approval for testing
+        simulated_approved = random.choices([True, False], weights=[0.7, 0.3], k=1)[0]
+        simulated_score = random.randint(500, 850) if simulated_approved else random.randint(300, 550)
+        simulated_reason = "Approved based on good credit history." if simulated_approved else "Rejected due to low credit score or insufficient history."
+        simulated_limit = round(random.uniform(50000, 200000), 2) if simulated_approved else None
+
+        simulated_response_data = {
+            "status": "success" if simulated_approved else "failed",
+            "score": simulated_score,
+            "decision_message": simulated_reason,
+            "approved_limit": simulated_limit,
+            "timestamp": datetime.now().isoformat()
+        }
+
+        return simulated_approved, simulated_score, simulated_reason, simulated_limit, simulated_response_data
+
+    def request_count(self, checks):
+        return checks
+
+    def checks_within(self, request_count):
+        return request_count
+
+    def check_bulk(self, checks):
+        return self.check_many(list(checks))
+
+
+def crc_client_config():
+    return {
+        'endpoint': settings.CRC_API_ENDPOINT,
+        'api_key': settings.CRC_API_KEY,
+        'connect_timeout': settings.CRC_CONNECT_TIMEOUT,
+        'read_timeout': settings.CRC_READ_TIMEOUT,
+        'max_in_flight': settings.CRC_MAX_IN_FLIGHT,
+        'bulk_endpoint': settings.CRC_API_BULK_ENDPOINT,
+        'batch_size': settings.CRC_BATCH_SIZE,
     }
 
-    return simulated_approved, simulated_score, simulated_reason, simulated_limit, simulated_response_data
-    # --- End Simulation ---
\ No newline at end of file
+_client = None
+_client_lock = threading.Lock()
+
+def get_crc_client():
+    """
+    The process-wide client, so every check a worker makes shares one
+    connection pool. It is created on first use, after Celery has forked,
+    and rebuilt if the CRC settings change.
+    """
+    global _client
+    config = crc_client_config()
+    with _client_lock:
+        if _client is None or _client.config != config:
+            if _client is not None:
+                _client.close()
+            _client = (CRCClient if config['endpoint'] else SimulatedCRCClient)(**config)
+            _client.config = config
+        return _client
+
+def call_crc_api(national_id: str, user_data: dict):
+    """
+    Calls the CRC (Credit Reference Company) API for one applicant and
+    returns (is_approved, credit_score, reason, approved_limit, raw_response).
+    Without CRC_API_ENDPOINT the response is simulated. Calls go through the
+    circuit breaker and rate limit (see paylater/bureau_guard.py).
+    """
+    return bureau_guard.guarded(lambda: get_crc_client().check(national_id, user_data))
+
+def call_crc_api_many(checks):
+    """call_crc_api() for many (national_id, user_data) pairs at once; failed checks come back as exceptions."""
+    checks = list(checks)
+    bureau_guard.admit(len(checks))
+    results = get_crc_client().check_many(checks)
+    bureau_guard.record(results)
+    return results
+
+def call_crc_api_bulk(checks):
+    """call_crc_api_many() through the bureau's bulk endpoint when CRC_API_BULK_ENDPOINT is set."""
+    checks, client = list(checks), get_crc_client()
+    bureau_guard.admit(client.request_count(len(checks)))
+    results = client.check_bulk(checks)
+    bureau_guard.record(results)
+    return results
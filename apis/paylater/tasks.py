@@ -1,66 +1,87 @@
 from celery import shared_task
-from django.db import transaction
 import requests # Used for potential retries on network errors
 
-from .models import PayLaterApplication
-from .services import call_crc_api
+from .bureau_guard import BureauUnavailable, backoff
+from .crc import (
+    COMPLETED, LOST, refresh_cached_result, run_crc_check, run_crc_checks, stale_checks, submit_crc_batches
+)
 
-@shared_task(bind=True, max_retries=5, default_retry_delay=60) # Retry up to 5 times, 60s apart
+@shared_task(bind=True, max_retries=5) # Retry up to 5 times, after a jittered backoff
 def perform_crc_check_task(self, application_id):
     """
     Celery task to call the external CRC API and update the PayLaterApplication status.
+    The bureau is called with no transaction open (see paylater/crc.py).
     """
     try:
-        # Use select_for_update to lock the row during update to prevent race conditions
-        with transaction.atomic():
-            application = PayLaterApplication.objects.select_for_update().get(id=application_id)
-            
-            # Prevent re-processing if already approved/rejected
-            if application.status in ['APPROVED_ELIGIBLE', 'REJECTED_INELIGIBLE']:
-                print(f"Application {application_id} already processed. Skipping CRC check.")
-                return
-
-            # Update status to indicate processing (even if it's already PENDING_CRC_CHECK)
-            application.status = 'PENDING_CRC_CHECK'
-            application.save(update_fields=['status'])
-
-            # Prepare comprehensive user data for the CRC service
-            user_data_for_crc = {
-                'date_of_birth': application.date_of_birth,
-                'monthly_income': application.monthly_income,
-                'address': application.address,
-                'phone_number': application.phone_number,
-                'full_name': application.full_name,
-            }
-
-            is_approved, credit_score, reason, approved_limit, raw_crc_response = call_crc_api(
-                application.national_id_number,
-                user_data_for_crc
-            )
-
-            # Update application with CRC results and final decision
-            application.credit_score = credit_score
-            application.crc_decision_data = raw_crc_response
-            application.approved_credit_limit = approved_limit
-            application.eligibility_reason = reason
-
-            if is_approved:
-                application.status = 'APPROVED_ELIGIBLE'
-                application.is_eligible = True
-            else:
-                application.status = 'REJECTED_INELIGIBLE'
-                application.is_eligible = False
-
-            application.save()
-            print(f"CRC check completed for {application.user.username} (App ID: {application.id}). Status: {application.status}")
-
-    except PayLaterApplication.DoesNotExist:
-        print(f"PayLaterApplication with ID {application_id} not found for CRC check.")
+        outcome = run_crc_check(application_id)
+    except BureauUnavailable as exc:
+        # Circuit breaker open or rate limit reached: the bureau wasn't called, so defer without holding a worker
+        countdown = backoff(self.request.retries, exc.retry_after)
+        print(f"CRC check for app {application_id} deferred {countdown:.0f}s: {exc}")
+        self.retry(exc=exc, countdown=countdown)
     except requests.exceptions.RequestException as exc:
-        # Handle network or API errors from the external service
+        # Handle network or API errors from the external service; the lease was released
         print(f"CRC API call failed for app {application_id}: {exc}. Retrying...")
-        self.retry(exc=exc) # Retry the task on request exceptions
+        self.retry(exc=exc, countdown=backoff(self.request.retries)) # Retry the task on request exceptions
     except Exception as e:
         # Catch any other unexpected errors
         print(f"An unexpected error occurred during CRC check for app {application_id}: {e}")
-        # Log this error and/or notify an admin for further investigation
\ No newline at end of file
+        # Log this error and/or notify an admin for further investigation
+    else:
+        if outcome == COMPLETED:
+            print(f"CRC check completed for App ID: {application_id}.")
+        elif outcome == LOST:
+            print(f"CRC check for App ID {application_id} was taken over by another worker; result dropped.")
+        else:
+            print(f"Application {application_id} not found, already processed or being checked. Skipping CRC check.")
+
+@shared_task
+def perform_crc_checks_task(application_ids):
+    """
+    Checks many applications from one task, with their bureau calls in
+    flight at the same time. Checks that failed are queued again one by one,
+    after a jittered delay, so each gets perform_crc_check_task's retries.
+    """
+    outcomes = run_crc_checks(application_ids)
+    failed = [application_id for application_id, outcome in outcomes.items() if isinstance(outcome, Exception)]
+    for application_id in failed:
+        print(f"CRC API call failed for app {application_id}: {outcomes[application_id]}. Retrying...")
+        perform_crc_check_task.apply_async(
+            (application_id,), countdown=backoff(0, getattr(outcomes[application_id], 'retry_after', 0.0))
+        )
+    completed = sum(outcome == COMPLETED for outcome in outcomes.values())
+    print(f"CRC batch of {len(outcomes)}: {completed} completed, {len(failed)} re-queued.")
+    return completed
+
+@shared_task
+def submit_crc_batches_task():
+    """
+    Sends every waiting application to the bureau in batches of
+    CRC_BATCH_SIZE. Run by the beat every CRC_BATCH_WINDOW, and early by
+    queue_crc_check() when a full batch has come in.
+    """
+    outcomes = submit_crc_batches()
+    if outcomes:
+        completed = sum(outcome == COMPLETED for outcome in outcomes.values())
+        failed = sum(isinstance(outcome, Exception) for outcome in outcomes.values())
+        print(f"CRC batches of {len(outcomes)} applications: {completed} completed, {failed} left for the next run.")
+    return len(outcomes)
+
+@shared_task(bind=True, max_retries=2)
+def refresh_crc_result_task(self, application_id):
+    """Replaces a stale cached bureau result with a fresh one (stale-while-revalidate)."""
+    try:
+        refresh_cached_result(application_id)
+    except requests.exceptions.RequestException as exc:
+        print(f"CRC cache refresh failed for app {application_id}: {exc}. Retrying...")
+        self.retry(exc=exc, countdown=backoff(self.request.retries, getattr(exc, 'retry_after', 0.0)))
+
+@shared_task
+def reclaim_stale_crc_checks_task():
+    """Re-queues credit checks whose worker died or stalled past CRC_CHECK_LEASE_TTL."""
+    application_ids = stale_checks()
+    for application_id in application_ids:
+        perform_crc_check_task.delay(application_id)
+    if application_ids:
+        print(f"Re-queued {len(application_ids)} stale CRC checks.")
+    return len(application_ids)
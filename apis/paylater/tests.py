@@ -1,3 +1,548 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from celery.exceptions import Retry
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import bureau_guard, crc_cache
+from .crc import (
+    COMPLETED, LOST, SKIPPED, claim_check, commit_result, crc_user_data, refresh_cached_result, run_crc_check,
+    queue_crc_check, run_crc_checks, stale_checks, submit_crc_batches
+)
+from .models import PayLaterApplication
+from .services import CRCClient, SimulatedCRCClient, call_crc_api, get_crc_client
+from .tasks import perform_crc_check_task, reclaim_stale_crc_checks_task
+
+User = get_user_model()
+
+
+def bureau_result(approved=True):
+    """What call_crc_api returns: (is_approved, credit_score, reason, approved_limit, raw_response)."""
+    return (approved, 720 if approved else 400, 'Approved.' if approved else 'Rejected.',
+            150000.0 if approved else None, {'status': 'success' if approved else 'failed'})
+
+
+class FakeBureau:
+    """
+    A local stand-in for the bureau's HTTP API with injected latency. It
+    records the client port of every request, so tests can count the
+    connections a client really opened. POSTs to `bulk_url` are answered
+    with one decision per check sent.
+    """
+
+    def __init__(self, latency=0.0, status=200):
+        self.latency, self.status = latency, status
+        self.requests, self.lock = [], threading.Lock()
+        bureau = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with bureau.lock:
+                    bureau.requests.append((self.client_address[1], self.headers.get('Authorization'), body))
+                time.sleep(bureau.latency)
+                if self.path.endswith('/bulk'):
+                    payload = json.dumps({'results': [self.decision(check) for check in body['checks']]}).encode()
+                else:
+                    payload = json.dumps(self.decision(body)).encode()
+                self.send_response(bureau.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            @staticmethod
+            def decision(check):
+                approved = check['national_id'][-1] in '02468'
+                return {
+                    'status': 'approved' if approved else 'declined', 'score': 700 if approved else 420,
+                    'message': 'Decision made.', 'approved_limit': 90000.0 if approved else None,
+                }
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                pass # Clients that timed out hang up before the answer is written
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/credit_check'
+        self.bulk_url = f'{self.url}/bulk'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def connections(self):
+        return len({port for port, _, _ in self.requests})
+
+
+class FakeClock:
+    """Stands in for bureau_guard's `time`: the clock only moves when the code sleeps."""
+
+    def __init__(self, now=1000.0):
+        self.now, self.sleeps = now, []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    @staticmethod
+    def monotonic():
+        return time.monotonic()
+
+
+class PayLaterTestMixin:
+
+    def setUp(self):
+        super().setUp()
+        cache.clear() # The pending-check counter would leak between tests,
+        caches['crc'].clear() # as would cached bureau results and the breaker and rate limit
+
+    def create_application(self, index=0, **extra):
+        user = User.objects.create_user(username=f'applicant{index}', password='!')
+        return PayLaterApplication.objects.create(
+            user=user, status='SUBMITTED_KYC', full_name=f'Applicant {index}', national_id_number=f'NIN-{index}',
+            date_of_birth='1990-01-01', address='1 Market Road', phone_number='08000000000', **extra,
+        )
+
+
+class CrcCheckTests(PayLaterTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.application = self.create_application()
+
+    def test_bureau_is_called_with_no_transaction_open(self):
+        # TestCase wraps each test in atomic blocks of its own; any atomic() in
+        # the check would add a savepoint on top of them
+        depth, depth_during_call = len(connection.savepoint_ids), []
+
+        def bureau(national_id, user_data):
+            depth_during_call.append(len(connection.savepoint_ids))
+            return bureau_result()
+
+        with mock.patch('paylater.crc.call_crc_api', side_effect=bureau):
+            self.assertEqual(run_crc_check(self.application.pk), COMPLETED)
+        self.assertEqual(depth_during_call, [depth])
+        self.application.refresh_from_db()
+        self.assertEqual((self.application.status, self.application.is_eligible, self.application.credit_score),
+                         ('APPROVED_ELIGIBLE', True, 720))
+        self.assertIsNone(self.application.crc_lease_token)
+
+        with mock.patch('paylater.crc.call_crc_api') as bureau:
+            self.assertEqual(run_crc_check(self.application.pk), SKIPPED) # Already decided
+        bureau.assert_not_called()
+
+    def test_a_live_lease_keeps_other_workers_out_until_it_expires(self):
+        token, _ = claim_check(self.application.pk)
+        self.assertIsNone(claim_check(self.application.pk))
+        self.assertEqual(stale_checks(), [])
+
+        later = timezone.now() + timedelta(minutes=5)
+        self.assertEqual(stale_checks(now=later), [self.application.pk])
+        with mock.patch('paylater.tasks.stale_checks', return_value=[self.application.pk]), \
+                mock.patch('paylater.tasks.perform_crc_check_task') as task:
+            self.assertEqual(reclaim_stale_crc_checks_task(), 1)
+        task.delay.assert_called_once_with(self.application.pk)
+
+        new_token, _ = claim_check(self.application.pk, now=later)
+        # The first worker's late result is dropped; the new lease holder's is kept
+        self.assertFalse(commit_result(self.application.pk, token, bureau_result(approved=True)))
+        self.assertTrue(commit_result(self.application.pk, new_token, bureau_result(approved=False)))
+        self.application.refresh_from_db()
+        self.assertEqual(self.application.status, 'REJECTED_INELIGIBLE')
+
+    def test_a_failed_call_releases_the_lease_for_the_retry(self):
+        with mock.patch('paylater.crc.call_crc_api', side_effect=requests.ConnectionError('bureau down')):
+            with self.assertRaises(requests.ConnectionError):
+                run_crc_check(self.application.pk)
+        self.application.refresh_from_db()
+        self.assertEqual(self.application.status, 'PENDING_CRC_CHECK')
+        self.assertIsNone(self.application.crc_lease_expires_at)
+        self.assertIsNotNone(claim_check(self.application.pk))
+
+
+class CrcCacheTests(PayLaterTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.application = self.create_application(monthly_income=250000)
+        self.application.refresh_from_db() # KYC values as the check reads them (Decimal income)
+
+    def recheck(self, bureau_result_value=None):
+        """Runs the check again, as a re-application or admin re-check would; returns (bureau mock, elapsed)."""
+        PayLaterApplication.objects.filter(pk=self.application.pk).update(status='SUBMITTED_KYC')
+        with mock.patch('paylater.crc.call_crc_api', return_value=bureau_result_value or bureau_result()) as bureau:
+            started = time.monotonic()
+            self.assertEqual(run_crc_check(self.application.pk), COMPLETED)
+            elapsed = time.monotonic() - started
+        self.application.refresh_from_db()
+        return bureau, elapsed
+
+    def test_repeat_checks_are_served_from_the_cache_and_audited(self):
+        bureau, _ = self.recheck()
+        self.assertEqual(bureau.call_count, 1)
+        self.assertNotIn('cache', self.application.crc_decision_data)
+
+        bureau, elapsed = self.recheck()
+        bureau.assert_not_called()
+        self.assertLess(elapsed, 0.05)
+        self.assertEqual(self.application.status, 'APPROVED_ELIGIBLE')
+        audit = self.application.crc_decision_data['cache']
+        self.assertEqual((audit['hit'], audit['state']), (True, crc_cache.FRESH))
+
+        key = crc_cache.result_key(self.application.national_id_number, crc_user_data(self.application))
+        self.assertNotIn(self.application.national_id_number, key)
+
+    def test_changed_kyc_details_and_invalidation_miss_the_cache(self):
+        self.recheck()
+        PayLaterApplication.objects.filter(pk=self.application.pk).update(monthly_income=90000)
+        self.assertEqual(self.recheck()[0].call_count, 1)
+        self.assertEqual(self.recheck()[0].call_count, 0)
+
+        crc_cache.invalidate(self.application.national_id_number)
+        self.assertEqual(self.recheck()[0].call_count, 1)
+
+    def test_results_are_kept_in_the_shared_crc_cache(self):
+        self.recheck()
+        key = crc_cache.result_key(self.application.national_id_number, crc_user_data(self.application))
+        self.assertIsNotNone(caches['crc'].get(key))
+        self.assertIsNone(cache.get(key))
+
+    def test_stale_results_are_served_while_one_refresh_is_queued(self):
+        user_data = crc_user_data(self.application)
+        stale_at = time.time() - settings.CRC_CACHE_TTL.total_seconds() - 60
+        crc_cache.store(self.application.national_id_number, user_data, bureau_result(approved=False), now=stale_at)
+
+        with mock.patch('paylater.tasks.refresh_crc_result_task') as refresh:
+            self.assertEqual(self.recheck()[0].call_count, 0)
+            self.assertEqual(self.recheck()[0].call_count, 0)
+        refresh.delay.assert_called_once_with(self.application.pk)
+        self.assertEqual(self.application.crc_decision_data['cache']['state'], crc_cache.STALE)
+        self.assertEqual(self.application.status, 'REJECTED_INELIGIBLE')
+
+        with mock.patch('paylater.crc.call_crc_api', return_value=bureau_result(approved=True)):
+            self.assertTrue(refresh_cached_result(self.application.pk))
+        result, state = crc_cache.lookup(self.application.national_id_number, user_data)
+        self.assertEqual((result[0], state), (True, crc_cache.FRESH))
+
+
+    def test_results_past_the_stale_window_are_a_miss(self):
+        user_data = crc_user_data(self.application)
+        expired_at = time.time() - (settings.CRC_CACHE_TTL + settings.CRC_CACHE_STALE_TTL).total_seconds() - 1
+        crc_cache.store(self.application.national_id_number, user_data, bureau_result(approved=False), now=expired_at)
+        self.assertEqual(crc_cache.lookup(self.application.national_id_number, user_data), (None, None))
+        self.assertEqual(self.recheck()[0].call_count, 1) # Decided by a fresh bureau call
+        self.assertEqual(self.application.status, 'APPROVED_ELIGIBLE')
+
+
+class ConcurrentCrcCheckTests(PayLaterTestMixin, TransactionTestCase):
+    """
+    Many workers checking many applications against a slow stand-in bureau.
+    Every check is delivered twice, as Celery may do.
+    """
+
+    APPLICATIONS = 24
+    WORKERS = 16 # Not a divisor of APPLICATIONS, so both deliveries of a check go to different workers
+    BUREAU_LATENCY = 0.25
+
+    def test_concurrent_checks_never_block_the_database_during_bureau_calls(self):
+        applications = [self.create_application(i) for i in range(self.APPLICATIONS)]
+        bystander = User.objects.create_user(username='bystander', password='!')
+        calls, outcomes, lock = {}, [], threading.Lock()
+
+        def bureau(national_id, user_data):
+            with lock:
+                calls[national_id] = calls.get(national_id, 0) + 1
+            time.sleep(self.BUREAU_LATENCY)
+            return bureau_result(approved=national_id[-1] in '02468')
+
+        deliveries = [application.pk for application in applications] * 2
+        barrier = threading.Barrier(self.WORKERS + 1)
+
+        def worker(index):
+            barrier.wait()
+            try:
+                for application_id in deliveries[index::self.WORKERS]:
+                    outcome = run_crc_check(application_id)
+                    with lock:
+                        outcomes.append(outcome)
+            finally:
+                connection.close()
+
+        with mock.patch('paylater.crc.call_crc_api', side_effect=bureau):
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.WORKERS)]
+            for thread in threads:
+                thread.start()
+            started = time.monotonic()
+            barrier.wait()
+            time.sleep(self.BUREAU_LATENCY / 2) # Every worker is now waiting on the bureau
+            write_started = time.monotonic()
+            User.objects.filter(pk=bystander.pk).update(first_name='Unblocked')
+            write_latency = time.monotonic() - write_started
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(calls, {application.national_id_number: 1 for application in applications})
+        self.assertEqual(outcomes.count(COMPLETED), self.APPLICATIONS)
+        self.assertEqual(outcomes.count(SKIPPED), self.APPLICATIONS)
+        self.assertNotIn(LOST, outcomes)
+        self.assertFalse(PayLaterApplication.objects.exclude(
+            status__in=['APPROVED_ELIGIBLE', 'REJECTED_INELIGIBLE']).exists())
+        self.assertFalse(PayLaterApplication.objects.filter(crc_lease_token__isnull=False).exists())
+        self.assertLess(write_latency, self.BUREAU_LATENCY)
+        serial = self.APPLICATIONS * self.BUREAU_LATENCY
+        self.assertLess(elapsed, serial / 3)
+        print(f"\n{len(deliveries)} CRC deliveries on {self.WORKERS} workers in {elapsed:.2f}s "
+              f"(serial bureau time {serial:.2f}s); an unrelated write waited {write_latency * 1000:.1f}ms")
+
+
+class CRCClientTests(SimpleTestCase):
+    USER_DATA = {'date_of_birth': date(1990, 1, 1), 'monthly_income': 250000, 'address': '1 Market Road',
+                 'phone_number': '08000000000', 'full_name': 'Test Applicant'}
+
+    def test_checks_reuse_one_keep_alive_connection(self):
+        with FakeBureau() as bureau:
+            client = CRCClient(bureau.url, api_key='secret')
+            results = [client.check(f'NIN-{i}', self.USER_DATA) for i in range(10)]
+            client.close()
+        self.assertEqual(bureau.connections, 1)
+        self.assertEqual(results[0][:4], (True, 700, 'Decision made.', 90000.0))
+        self.assertEqual(results[1][:4], (False, 420, 'Decision made.', None))
+        _, authorization, body = bureau.requests[0]
+        self.assertEqual(authorization, 'Bearer secret')
+        self.assertEqual((body['dob'], body['income_level']), ('1990-01-01', 250000.0))
+
+    def test_batch_keeps_many_calls_in_flight_from_one_process(self):
+        latency, checks = 0.2, [(f'NIN-{i}', self.USER_DATA) for i in range(40)]
+        with FakeBureau(latency=latency) as bureau:
+            client = CRCClient(bureau.url, max_in_flight=20)
+            started = time.monotonic()
+            results = client.check_many(checks)
+            elapsed = time.monotonic() - started
+            client.check_many(checks) # Second batch rides the pooled connections
+            client.close()
+        self.assertEqual([result[0] for result in results], [i % 2 == 0 for i in range(40)])
+        self.assertLess(elapsed, latency * len(checks) / 5)
+        self.assertLessEqual(bureau.connections, 20)
+        print(f"\n{len(checks)} bureau calls at {latency * 1000:.0f}ms each in {elapsed:.2f}s "
+              f"over {bureau.connections} connections")
+
+    def test_timeouts_and_errors_are_raised_per_check(self):
+        with FakeBureau(latency=0.3) as bureau:
+            client = CRCClient(bureau.url, read_timeout=0.05)
+            with self.assertRaises(requests.Timeout):
+                client.check('NIN-1', self.USER_DATA)
+            results = client.check_many([('NIN-1', self.USER_DATA), ('NIN-2', self.USER_DATA)])
+            client.close()
+        self.assertTrue(all(isinstance(result, requests.Timeout) for result in results))
+        with FakeBureau(status=503) as bureau:
+            client = CRCClient(bureau.url)
+            with self.assertRaises(requests.HTTPError):
+                client.check('NIN-1', self.USER_DATA)
+            client.close()
+
+    def test_bulk_endpoint_takes_a_batch_per_request(self):
+        checks = [(f'NIN-{i}', self.USER_DATA) for i in range(7)]
+        with FakeBureau() as bureau:
+            client = CRCClient(bureau.url, bulk_endpoint=bureau.bulk_url, batch_size=3)
+            results = client.check_bulk(checks)
+            client.close()
+        self.assertEqual([result[0] for result in results], [i % 2 == 0 for i in range(7)])
+        self.assertEqual([len(body['checks']) for _, _, body in bureau.requests], [3, 3, 1])
+        with FakeBureau(status=503) as bureau:
+            client = CRCClient(bureau.url, bulk_endpoint=bureau.bulk_url, batch_size=3)
+            results = client.check_bulk(checks[:2])
+            client.close()
+        self.assertTrue(all(isinstance(result, requests.HTTPError) for result in results))
+
+    def test_client_is_shared_per_process_and_follows_settings(self):
+        with override_settings(CRC_API_ENDPOINT=''):
+            self.assertIsInstance(get_crc_client(), SimulatedCRCClient)
+        with override_settings(CRC_API_ENDPOINT='http://127.0.0.1:9/credit_check'):
+            client = get_crc_client()
+            self.assertIs(type(client), CRCClient)
+            self.assertIs(get_crc_client(), client)
+
+
+class CrcBatchTests(PayLaterTestMixin, TestCase):
+
+    def test_batch_checks_claim_call_concurrently_and_commit(self):
+        applications = [self.create_application(i) for i in range(6)]
+        PayLaterApplication.objects.filter(pk=applications[5].pk).update(status='APPROVED_ELIGIBLE')
+        with FakeBureau(latency=0.1) as bureau, override_settings(CRC_API_ENDPOINT=bureau.url):
+            started = time.monotonic()
+            outcomes = run_crc_checks([application.pk for application in applications])
+            elapsed = time.monotonic() - started
+            get_crc_client().close()
+        self.assertEqual(list(outcomes.values()).count(COMPLETED), 5)
+        self.assertEqual(outcomes[applications[5].pk], SKIPPED)
+        self.assertLess(elapsed, 0.1 * 5)
+        self.assertEqual(
+            list(PayLaterApplication.objects.order_by('pk').values_list('status', flat=True))[:5],
+            ['APPROVED_ELIGIBLE', 'REJECTED_INELIGIBLE'] * 2 + ['APPROVED_ELIGIBLE'],
+        )
+
+        PayLaterApplication.objects.filter(pk=applications[0].pk).update(status='SUBMITTED_KYC')
+        crc_cache.invalidate(applications[0].national_id_number) # Otherwise served from the cache
+        with FakeBureau(status=500) as bureau, override_settings(CRC_API_ENDPOINT=bureau.url):
+            outcome = run_crc_checks([applications[0].pk])[applications[0].pk]
+            get_crc_client().close()
+        self.assertIsInstance(outcome, requests.HTTPError)
+        self.assertIsNotNone(claim_check(applications[0].pk)) # The lease was released
+
+    @override_settings(CRC_BATCH_SIZE=3)
+    def test_collector_claims_and_commits_each_batch_in_one_update(self):
+        applications = [self.create_application(i) for i in range(9)]
+        PayLaterApplication.objects.filter(pk=applications[0].pk).update(status='APPROVED_ELIGIBLE')
+        PayLaterApplication.objects.filter(pk=applications[1].pk).update(crc_attempts=settings.CRC_MAX_ATTEMPTS)
+        with FakeBureau() as bureau, override_settings(CRC_API_ENDPOINT=bureau.url, CRC_API_BULK_ENDPOINT=bureau.bulk_url):
+            with CaptureQueriesContext(connection) as queries:
+                outcomes = submit_crc_batches()
+            get_crc_client().close()
+        self.assertEqual(outcomes, {application.pk: COMPLETED for application in applications[2:]})
+        self.assertEqual([len(body['checks']) for _, _, body in bureau.requests], [3, 3, 1])
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "paylater_paylaterapplication"')]
+        self.assertEqual(len(updates), 3 * 2) # A claim and a commit per batch
+        self.assertEqual(
+            list(PayLaterApplication.objects.filter(pk__in=outcomes).values_list('crc_attempts', flat=True).distinct()),
+            [1],
+        )
+        self.assertEqual(PayLaterApplication.objects.get(pk=applications[1].pk).status, 'SUBMITTED_KYC')
+
+    def test_a_surge_is_sent_in_batches_the_rate_limit_lets_through(self):
+        # The shipped CRC_BATCH_SIZE and rate limit, with single calls fanned out (a token per check)
+        size = settings.CRC_BATCH_SIZE
+        users = User.objects.bulk_create([User(username=f'surge{i}') for i in range(size * 2)])
+        PayLaterApplication.objects.bulk_create([PayLaterApplication(
+            user=user, status='SUBMITTED_KYC', full_name=f'Applicant {i}', national_id_number=f'NIN-{i}',
+            date_of_birth='1990-01-01', address='1 Market Road', phone_number='08000000000',
+        ) for i, user in enumerate(users)])
+        clock = FakeClock()
+        with FakeBureau() as bureau, override_settings(CRC_API_ENDPOINT=bureau.url), \
+                mock.patch.object(bureau_guard, 'time', clock):
+            outcomes = submit_crc_batches()
+            get_crc_client().close()
+        self.assertEqual(list(outcomes.values()), [COMPLETED] * size * 2)
+        self.assertEqual(len(bureau.requests), size * 2)
+        # 100 from the burst and 2s of refill, then 40 per 2s wait until the last 20
+        self.assertEqual(clock.sleeps, [2.0, 2.0, 2.0, 1.0])
+        self.assertEqual(bureau_guard.metrics()['rate_limiter']['limited_total'], 0) # None was turned away
+
+        # With the bucket emptied, the collector claims nothing rather than having its batch turned away
+        application = self.create_application(size * 2)
+        with mock.patch.object(bureau_guard, 'time', clock):
+            limiter = bureau_guard.crc_rate_limiter()
+            limiter.reserve(limiter.available(settings.CRC_RATE_MAX_WAIT + 1), max_wait=settings.CRC_RATE_MAX_WAIT + 1)
+            self.assertEqual(submit_crc_batches(), {})
+        application.refresh_from_db()
+        self.assertEqual((application.status, application.crc_attempts), ('SUBMITTED_KYC', 0))
+
+    def test_failed_batch_checks_wait_for_the_next_run(self):
+        application = self.create_application(1)
+        with FakeBureau(status=503) as bureau, override_settings(CRC_API_ENDPOINT=bureau.url):
+            outcome = submit_crc_batches()[application.pk]
+            get_crc_client().close()
+        self.assertIsInstance(outcome, requests.HTTPError)
+        application.refresh_from_db()
+        self.assertEqual((application.status, application.crc_lease_token, application.crc_attempts),
+                         ('PENDING_CRC_CHECK', None, 1))
+        self.assertEqual(len(bureau.requests), 1) # Not retried within the same run
+
+    @override_settings(CRC_BATCH_SIZE=3)
+    def test_every_full_batch_of_submissions_is_sent_early(self):
+        with mock.patch('paylater.tasks.submit_crc_batches_task') as task:
+            for _ in range(7):
+                queue_crc_check()
+        self.assertEqual(task.delay.call_count, 2)
+
+
+class BureauGuardTests(PayLaterTestMixin, TestCase):
+
+    @override_settings(CRC_BREAKER_FAILURE_THRESHOLD=2, CRC_BREAKER_RESET_TIMEOUT=timedelta(seconds=1))
+    def test_breaker_opens_fails_fast_then_half_opens(self):
+        user_data = {'date_of_birth': date(1990, 1, 1)}
+        with FakeBureau(status=503) as bureau, override_settings(CRC_API_ENDPOINT=bureau.url):
+            for _ in range(2):
+                with self.assertRaises(requests.HTTPError):
+                    call_crc_api('NIN-2', user_data)
+            with self.assertRaises(bureau_guard.CircuitOpen) as raised:
+                call_crc_api('NIN-2', user_data)
+            get_crc_client().close()
+        self.assertEqual(len(bureau.requests), 2) # The third call never reached the bureau
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertEqual(bureau_guard.crc_breaker().state(), bureau_guard.OPEN)
+
+        time.sleep(1.05)
+        self.assertEqual(bureau_guard.crc_breaker().state(), bureau_guard.HALF_OPEN)
+        with FakeBureau() as bureau, override_settings(CRC_API_ENDPOINT=bureau.url):
+            self.assertTrue(call_crc_api('NIN-2', user_data)[0]) # The trial call
+            get_crc_client().close()
+        self.assertEqual(bureau_guard.crc_breaker().state(), bureau_guard.CLOSED)
+        self.assertEqual(bureau_guard.metrics()['breaker']['opened_total'], 1)
+
+    def test_token_bucket_waits_within_limit_and_refuses_beyond(self):
+        bucket, now = bureau_guard.TokenBucket('test:bucket', rate=10, burst=2), 1000.0
+        self.assertEqual(bucket.reserve(2, now=now), 0)
+        self.assertAlmostEqual(bucket.reserve(1, max_wait=0.5, now=now), 0.1)
+        with self.assertRaises(bureau_guard.RateLimited) as raised:
+            bucket.reserve(1, max_wait=0.1, now=now)
+        self.assertAlmostEqual(raised.exception.retry_after, 0.2)
+        self.assertAlmostEqual(bucket.reserve(2, now=now + 0.5), 0) # Refilled
+
+    def test_open_breaker_defers_checks_without_using_attempts(self):
+        application = self.create_application(1)
+        bureau_guard.crc_breaker().record_failure(settings.CRC_BREAKER_FAILURE_THRESHOLD)
+        self.assertEqual(submit_crc_batches(), {}) # The collector doesn't claim anything
+
+        with mock.patch('paylater.crc.crc_cache.lookup', return_value=(None, None)), \
+                mock.patch.object(perform_crc_check_task, 'retry', side_effect=Retry) as retry:
+            with self.assertRaises(Retry):
+                perform_crc_check_task(application.pk)
+        self.assertIsInstance(retry.call_args.kwargs['exc'], bureau_guard.CircuitOpen)
+        self.assertGreaterEqual(retry.call_args.kwargs['countdown'], retry.call_args.kwargs['exc'].retry_after)
+        application.refresh_from_db()
+        self.assertEqual((application.crc_lease_token, application.crc_attempts), (None, 0))
+
+    def test_state_is_kept_in_the_shared_crc_cache(self):
+        bureau_guard.crc_breaker().record_failure(settings.CRC_BREAKER_FAILURE_THRESHOLD)
+        self.assertIsNotNone(caches['crc'].get(bureau_guard.BREAKER_KEY))
+        self.assertIsNone(cache.get(bureau_guard.BREAKER_KEY))
+
+    def test_metrics_are_staff_only(self):
+        url = reverse('pay_later_bureau_metrics')
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='shopper', password='!'))
+        self.assertEqual(client.get(url).status_code, 403)
+        client.force_authenticate(User.objects.create_user(username='staff', password='!', is_staff=True))
+        bureau_guard.crc_breaker().record_failure(settings.CRC_BREAKER_FAILURE_THRESHOLD)
+        metrics = client.get(url).json()
+        self.assertEqual(metrics['breaker']['state'], bureau_guard.OPEN)
+        self.assertEqual(metrics['rate_limiter']['burst'], settings.CRC_RATE_BURST)
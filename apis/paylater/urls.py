@@ -5,6 +5,7 @@ from paylater import views
 urlpatterns = [
     path('', views.PayLaterApplicationCreateView.as_view(), name='pay_later_apply'), 
     path('<int:pk>/', views.PayLaterEligibilityRetrieveView.as_view(), name='pay_later_eligibility'),
+    path('bureau/metrics/', views.BureauMetricsView.as_view(), name='pay_later_bureau_metrics'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
@@ -1,17 +1,21 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.db.models import ObjectDoesNotExist # Import for specific exception handling
 
+from idempotency.mixins import IdempotentCreateMixin
+from . import bureau_guard
 from .models import PayLaterApplication
 from .serializers import PayLaterApplicationSerializer, PayLaterEligibilitySerializer
-from .tasks import perform_crc_check_task
+from .crc import queue_crc_check
 
-class PayLaterApplicationCreateView(generics.CreateAPIView):
+class PayLaterApplicationCreateView(IdempotentCreateMixin, generics.CreateAPIView):
     queryset = PayLaterApplication.objects.all()
     serializer_class = PayLaterApplicationSerializer
     permission_classes = [IsAuthenticated]
+    idempotency_scope = 'paylater.apply'
 
     def create(self, request, *args, **kwargs):
         # Check if an application already exists for the user
@@ -29,8 +33,8 @@ class PayLaterApplicationCreateView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         application = serializer.save()
         
-        # Trigger the asynchronous CRC check
-        perform_crc_check_task.delay(application.id)
+        # The CRC check goes out with the next batch (see paylater/crc.py)
+        queue_crc_check()
         
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -48,4 +52,15 @@ class PayLaterEligibilityRetrieveView(generics.RetrieveAPIView):
         try:
             return PayLaterApplication.objects.get(user=self.request.user)
         except PayLaterApplication.DoesNotExist:
-            raise status.HTTP_404_NOT_FOUND({"detail": "No Pay Later application found for this user."})
\ No newline at end of file
+            raise status.HTTP_404_NOT_FOUND({"detail": "No Pay Later application found for this user."})
+
+
+class BureauMetricsView(APIView):
+    """
+    Staff-only health of the credit bureau integration: circuit breaker
+    state, rate limit tokens, and how often and how long calls have waited.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(bureau_guard.metrics())
@@ -0,0 +1,168 @@
+# products/cache.py
+"""
+Response caching and conditional GET for the read-heavy catalog endpoints.
+
+Every cached response is keyed on a catalog *generation* counter that is
+bumped (after commit) whenever a Product or Category is saved or deleted,
+so a bump invalidates every cached page at once without having to find and
+delete individual keys. ETags are derived from the generation, so a client
+revalidating an unchanged page gets a 304 without touching the database.
+
+Checkouts, reservations and their expiry change stock all the time, so
+they don't bump the catalog generation. The stock-dependent fields
+(LIVE_FIELDS) in a cached product response are read fresh instead, with
+one query by primary key for the page, whenever it is served from the
+cache, and go into its ETag and Last-Modified. Only pages filtered on stock (?in_stock) are also keyed on
+a separate stock generation, which every stock change bumps.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.fields import DateTimeField
+from rest_framework.response import Response
+
+from .models import Product
+from .projection import project
+
+GENERATION_KEY = 'catalog:generation'
+STOCK_GENERATION_KEY = 'catalog:stock_generation'
+CHANGED_AT_KEY = 'catalog:changed_at'
+
+# Product fields every stock change moves; never served from the cache
+LIVE_FIELDS = ('stock', 'available_to_sell', 'updated_at')
+
+
+def _get_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        # Start from the clock rather than 1 so an evicted counter can never
+        # come back to a value that still has cached responses under it.
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump_generation(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _get_generation(key)
+
+
+def get_catalog_generation():
+    return _get_generation(GENERATION_KEY)
+
+
+def bump_catalog_generation():
+    cache.set(CHANGED_AT_KEY, int(time.time()), timeout=None)
+    _bump_generation(GENERATION_KEY)
+
+
+def bump_catalog_generation_on_commit():
+    # Bumping before commit would let a concurrent request cache the old rows
+    # under the new generation.
+    transaction.on_commit(bump_catalog_generation)
+
+
+def get_stock_generation():
+    return _get_generation(STOCK_GENERATION_KEY)
+
+
+def bump_stock_generation_on_commit():
+    """For stock changes: drops only the cached pages filtered on stock."""
+    transaction.on_commit(lambda: _bump_generation(STOCK_GENERATION_KEY))
+
+
+def get_catalog_last_modified(generation):
+    """
+    Newest Product.updated_at (or the last catalog change, which also covers
+    deletions) as a Unix timestamp. Computed once per generation.
+    """
+    key = f'catalog:last_modified:{generation}'
+    last_modified = cache.get(key)
+    if last_modified is None:
+        newest = Product.objects.aggregate(newest=Max('updated_at'))['newest']
+        last_modified = max(int(newest.timestamp()) if newest else 0, cache.get(CHANGED_AT_KEY) or 0)
+        cache.set(key, last_modified, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return last_modified
+
+
+def _items(data):
+    """The product dicts in a response body: a page's results, a list, or one object."""
+    if isinstance(data, dict):
+        return data['results'] if 'results' in data else [data]
+    return data
+
+
+def _refresh_live_fields(items, product_ids, fields):
+    """
+    Overwrites `fields` (of LIVE_FIELDS) in each item with the product's
+    current values, rendered as ProductSerializer does, in one query.
+    Returns the newest updated_at among them as a Unix timestamp.
+    """
+    to_representation = DateTimeField().to_representation
+    rows = {row['id']: row for row in project(Product.objects.filter(pk__in=product_ids).order_by(),
+                                              ['id', 'updated_at', *(name for name in fields if name != 'updated_at')])}
+    for item, product_id in zip(items, product_ids):
+        row = rows.get(product_id)
+        if row is not None:
+            item.update({name: to_representation(row[name]) if name == 'updated_at' else row[name] for name in fields})
+    return max((int(row['updated_at'].timestamp()) for row in rows.values()), default=0)
+
+
+class CatalogCacheMixin:
+    """
+    Serves GET requests from the catalog response cache and answers
+    conditional requests (If-None-Match / If-Modified-Since) with 304.
+
+    A view whose responses hold products sets `live_product_ids` to the
+    ids it rendered, in order, so their LIVE_FIELDS can be refreshed.
+    """
+    live_product_ids = ()
+
+    def depends_on_stock(self, request):
+        """Whether which objects are in the response depends on stock."""
+        return False
+
+    def get(self, request, *args, **kwargs):
+        generation = get_catalog_generation()
+        key_generation = f'{generation}:{get_stock_generation()}' if self.depends_on_stock(request) else generation
+        url = request.build_absolute_uri()
+        digest = hashlib.sha1(f'{key_generation}:{url}'.encode()).hexdigest()
+        last_modified = get_catalog_last_modified(generation)
+
+        cache_key = f'catalog:response:{digest}'
+        response, entry = None, cache.get(cache_key)
+        if entry is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            entry = {'data': response.data, 'product_ids': list(self.live_product_ids)}
+            cache.set(cache_key, entry, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+        items = _items(entry['data'])
+        live_fields = [name for name in LIVE_FIELDS if items and name in items[0]]
+        # A response just rendered is current, and the catalog's Last-Modified
+        # (computed when its generation was first read) already covers it
+        if response is None and live_fields and entry['product_ids']:
+            last_modified = max(last_modified, _refresh_live_fields(items, entry['product_ids'], live_fields))
+        if live_fields:
+            digest = hashlib.sha1(f'{digest}:{[item.get(name) for item in items for name in live_fields]}'
+                                  .encode()).hexdigest()
+        etag = f'"{digest}"'
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        response = response or Response(entry['data'])
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
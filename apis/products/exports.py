@@ -0,0 +1,34 @@
+# products/exports.py
+"""
+Full-catalog export rows. Each row carries the product's category slugs
+under `categories`, the same shape `products.importer` reads, so an export
+can be fed straight back in.
+"""
+from apis.streaming import chunked
+
+from .models import Product
+from .projection import PROJECTABLE_FIELDS, ProductProjection
+
+CSV_FIELDS = [name for name in PROJECTABLE_FIELDS if name != 'image_variants'] + ['categories']
+
+
+def product_export_rows(request=None, chunk_size=2000):
+    """Yields one dict per product, reading the catalog `chunk_size` rows at a time."""
+    projection = ProductProjection(PROJECTABLE_FIELDS, request)
+    through = Product.categories.through
+    rows = projection.apply(Product.objects.order_by('pk')).iterator(chunk_size=chunk_size)
+    for chunk in chunked(rows, chunk_size):
+        category_slugs = {}
+        for product_id, slug in through.objects.filter(
+            product_id__in=[row['id'] for row in chunk]
+        ).order_by('category__slug').values_list('product_id', 'category__slug'):
+            category_slugs.setdefault(product_id, []).append(slug)
+        for row in projection.render(chunk):
+            row['categories'] = category_slugs.get(row['id'], [])
+            yield row
+
+
+def product_csv_rows(rows):
+    for row in rows:
+        row['categories'] = '|'.join(row['categories'])
+        yield row
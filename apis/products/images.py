@@ -0,0 +1,77 @@
+# products/images.py
+"""
+Responsive image variants for Product.image.
+
+Each upload is rendered into fixed-size variants (thumb, card, detail) in
+both WebP and JPEG. Variant files are named after a hash of their content,
+so a URL never changes meaning and can be served with
+`Cache-Control: public, max-age=31536000, immutable`.
+"""
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Longest edge, in pixels; images are scaled to fit without cropping or upscaling
+VARIANT_SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1200,
+}
+
+# extension: (Pillow format, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+VARIANT_DIR = 'products/variants'
+
+
+def _encode(image, image_format, options):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten transparent PNGs onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def _store(content, extension):
+    digest = hashlib.sha256(content).hexdigest()[:32]
+    name = f'{VARIANT_DIR}/{digest[:2]}/{digest}.{extension}'
+    if not default_storage.exists(name): # Same content, same name: nothing to write
+        default_storage.save(name, ContentFile(content))
+    return name
+
+
+def generate_variants(image_field):
+    """
+    Renders and stores every variant of an image file.
+
+    Returns the value stored in Product.image_variants, e.g.
+    {'source': 'products/2025/06/17/mac.jpeg',
+     'thumb': {'width': 160, 'height': 120, 'webp': '...webp', 'jpeg': '...jpeg'}, ...}
+    """
+    with image_field.open('rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    variants = {'source': image_field.name}
+    for variant, longest_edge in VARIANT_SIZES.items():
+        image = original.copy()
+        image.thumbnail((longest_edge, longest_edge), Image.LANCZOS)
+        variants[variant] = {'width': image.width, 'height': image.height}
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            variants[variant][extension] = _store(_encode(image, image_format, options), extension)
+    return variants
+
+
+def variants_are_current(product):
+    return bool(product.image) and (product.image_variants or {}).get('source') == product.image.name
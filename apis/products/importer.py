@@ -0,0 +1,235 @@
+# products/importer.py
+"""
+Streaming bulk import of supplier catalog feeds.
+
+Feeds are CSV (with a header row) or JSON Lines, one product per row:
+
+    name, slug, price, description, stock, available, categories
+
+Only `name` and `price` are required. `slug` defaults to slugify(name) and
+is the key products are matched on. Every value is checked against its
+Product field (type, length, digits, range) before a row is accepted, so
+a bad row is reported rather than failing the batch it would be written
+in. `categories` holds category slugs, '|'-separated in CSV or a list in
+JSONL; when present it replaces the product's categories, when absent
+they are left alone.
+
+Rows are read lazily and written in batches with one upsert per batch, so
+memory stays flat however large the feed is.
+"""
+import csv
+import json
+import time
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.text import slugify
+
+from . import search
+from .cache import bump_catalog_generation_on_commit
+from .models import Category, Product
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+# Columns overwritten when an incoming row matches an existing slug
+UPDATE_FIELDS = ['name', 'price', 'description', 'stock', 'available', 'updated_at']
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+# Keep the report readable when a whole feed is malformed
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.errors = []
+        self.error_count = 0
+        self.unknown_categories = set()
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def add_error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Row {line_number}: {message}")
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def peak_memory_mb(self):
+        """Peak resident set size of this process, in megabytes."""
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB on Linux
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'unknown_categories': sorted(self.unknown_categories),
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'peak_memory_mb': round(self.peak_memory_mb, 1) if self.peak_memory_mb is not None else None,
+        }
+
+
+def read_rows(stream, feed_format):
+    """Yields (row dict, error message) for every row of a text stream."""
+    if feed_format == 'csv':
+        for row in csv.DictReader(stream):
+            if 'categories' in row:
+                row['categories'] = [slug for slug in (row['categories'] or '').split('|') if slug.strip()]
+            yield row, None
+    elif feed_format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield None, f"invalid JSON ({exc})"
+                continue
+            yield (row, None) if isinstance(row, dict) else (None, "expected a JSON object")
+    else:
+        raise ValueError(f"Unsupported feed format: {feed_format}")
+
+
+def _parse_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def _text(row, column):
+    value = row.get(column)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f"{column} must be text")
+    return value.strip()
+
+
+def _clean(column, value):
+    """Runs the Product field's own conversion and validators, as a ValueError naming the column."""
+    try:
+        return Product._meta.get_field(column).clean(value, None)
+    except ValidationError as exc:
+        raise ValueError(f"{column}: {' '.join(exc.messages)}")
+
+
+def build_product(row):
+    """
+    Returns an unsaved Product and its category slugs (or None to keep the
+    current ones). Raises ValueError for anything the database would refuse.
+    """
+    name = _text(row, 'name')
+    if not name:
+        raise ValueError("name is required")
+    price = row.get('price')
+    if price is None or isinstance(price, bool) or not isinstance(price, (str, int, float)):
+        raise ValueError("price must be a decimal number")
+    price = _clean('price', str(price).strip()) # Finite, within max_digits and decimal_places
+    if price < 0:
+        raise ValueError("price cannot be negative")
+    stock = row.get('stock') or 0
+    if isinstance(stock, bool) or not isinstance(stock, (str, int)):
+        raise ValueError("stock must be a whole number")
+    try:
+        stock = int(stock)
+    except ValueError:
+        raise ValueError("stock must be a whole number")
+    if stock < 0:
+        raise ValueError("stock cannot be negative")
+    slug = _text(row, 'slug') or slugify(name)
+    if not slug:
+        raise ValueError("slug is required when the name has no letters or digits")
+    product = Product(
+        name=_clean('name', name),
+        slug=_clean('slug', slug),
+        price=price,
+        description=_text(row, 'description'),
+        stock=_clean('stock', stock),
+        available=_parse_bool(row.get('available')),
+    )
+    category_slugs = row.get('categories')
+    if category_slugs is not None and (
+        not isinstance(category_slugs, list) or not all(isinstance(slug, str) for slug in category_slugs)
+    ):
+        raise ValueError("categories must be a list of slugs")
+    return product, category_slugs
+
+
+def _write_batch(batch, category_ids, report):
+    """Upserts one batch of products and replaces the category links of those that listed any."""
+    through = Product.categories.through
+    with transaction.atomic():
+        Product.objects.bulk_create(
+            [product for product, _ in batch.values()],
+            update_conflicts=True,
+            unique_fields=['slug'],
+            update_fields=UPDATE_FIELDS,
+        )
+        product_ids = dict(Product.objects.filter(slug__in=batch.keys()).values_list('slug', 'id'))
+
+        links = []
+        relinked_ids = []
+        for slug, (_, category_slugs) in batch.items():
+            if category_slugs is None:
+                continue
+            relinked_ids.append(product_ids[slug])
+            for category_slug in category_slugs:
+                category_id = category_ids.get(category_slug)
+                if category_id is None:
+                    report.unknown_categories.add(category_slug)
+                    continue
+                links.append(through(product_id=product_ids[slug], category_id=category_id))
+        through.objects.filter(product_id__in=relinked_ids).delete()
+        through.objects.bulk_create(links, ignore_conflicts=True)
+
+        # bulk_create() skips the post_save handlers, so keep the search index in step here
+        search.index_products(product_ids.values())
+    report.imported += len(batch)
+
+
+def import_catalog(stream, feed_format='csv', batch_size=1000):
+    """Imports a product feed from a text stream and returns an ImportReport."""
+    report = ImportReport()
+    category_ids = dict(Category.objects.values_list('slug', 'id'))
+    batch = {} # slug -> (product, category slugs); a repeated slug keeps its last row
+
+    for line_number, (row, error) in enumerate(read_rows(stream, feed_format), start=1):
+        report.rows += 1
+        if error:
+            report.add_error(line_number, error)
+            continue
+        try:
+            product, category_slugs = build_product(row)
+        except (TypeError, ValueError) as exc:
+            report.add_error(line_number, str(exc))
+            continue
+        batch[product.slug] = (product, category_slugs)
+        if len(batch) >= batch_size:
+            _write_batch(batch, category_ids, report)
+            batch = {}
+    if batch:
+        _write_batch(batch, category_ids, report)
+
+    if report.imported:
+        bump_catalog_generation_on_commit()
+    report.elapsed = time.monotonic() - report.started
+    return report
+
+
+def guess_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
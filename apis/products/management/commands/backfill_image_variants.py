@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from products.images import variants_are_current
+from products.models import Product
+from products.tasks import generate_image_variants_task
+
+
+class Command(BaseCommand):
+    help = "Generates responsive image variants for products uploaded before variants existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help="Queue a Celery task per product instead of rendering inline.")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate variants even where they are already up to date.")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of products read from the database at a time.")
+
+    def handle(self, *args, **options):
+        products = (
+            Product.objects.exclude(image='').exclude(image__isnull=True)
+            .only('id', 'image', 'image_variants').order_by('pk')
+        )
+        queued = 0
+        for product in products.iterator(chunk_size=options['chunk_size']):
+            if not options['force'] and variants_are_current(product):
+                continue
+            if options['run_async']:
+                generate_image_variants_task.delay(product.pk)
+            else:
+                generate_image_variants_task(product.pk)
+            queued += 1
+        verb = "Queued" if options['run_async'] else "Generated"
+        self.stdout.write(self.style.SUCCESS(f"{verb} image variants for {queued} products."))
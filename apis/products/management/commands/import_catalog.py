@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import guess_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Imports (creates or updates) products from a CSV or JSON Lines feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file, or '-' to read from stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Feed format. Defaults to jsonl for .jsonl/.ndjson files, csv otherwise.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of products upserted per statement.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format'] or guess_format(path)
+        try:
+            if path == '-':
+                report = import_catalog(sys.stdin, feed_format, options['batch_size'])
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    report = import_catalog(stream, feed_format, options['batch_size'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        for error in report.errors:
+            self.stderr.write(error)
+        if report.unknown_categories:
+            self.stderr.write(f"Unknown category slugs: {', '.join(sorted(report.unknown_categories))}")
+        stats = report.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['imported']} of {stats['rows']} rows ({stats['error_count']} errors) "
+            f"in {stats['seconds']}s: {stats['rows_per_second']} rows/sec, "
+            f"peak memory {stats['peak_memory_mb']} MB."
+        ))
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+# FTS5 is SQLite-specific; on other backends search falls back to icontains lookups.
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts "
+        "USING fts5(name, description, categories, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS products_product_fts")
+
+
+def populate_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('products', 'Product')
+    through = Product.categories.through
+    category_names = {}
+    for product_id, name in through.objects.values_list('product_id', 'category__name'):
+        category_names.setdefault(product_id, []).append(name)
+    rows = [
+        (pk, name, description, ' '.join(category_names.get(pk, [])))
+        for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator()
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO products_product_fts (rowid, name, description, categories) VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_category_updated_at_tombstone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['available', 'price'], name='products_pr_availab_37dd99_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['available', '-created_at'], name='products_pr_availab_d04b87_idx'),
+        ),
+        # The auto-created categories through table can't declare Meta.indexes,
+        # so add the (category_id, product_id) index for category filters by hand.
+        migrations.RunSQL(
+            "CREATE INDEX products_product_categories_cat_prod_idx "
+            "ON products_product_categories (category_id, product_id)",
+            "DROP INDEX products_product_categories_cat_prod_idx",
+        ),
+    ]
@@ -9,6 +9,7 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True, db_index=True)
     slug = models.SlugField(max_length=100, unique=True, blank=True)
     description = models.TextField(blank=True, verbose_name="Category Description")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) # Used by delta sync
 
     class Meta:
         verbose_name_plural = "Categories" # Correct plural name for admin interface
@@ -37,10 +38,14 @@ class Product(models.Model):
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2) # e.g., 700.00 - crucial for currency
     image = models.ImageField(upload_to='products/%Y/%m/%d/', blank=True, null=True) # Requires Pillow library
+    image_variants = models.JSONField(default=dict, blank=True, editable=False,
+                                      help_text="Resized copies of the image, filled in by a background task.")
     description = models.TextField(blank=True)
 
     # Inventory and Availability
     stock = models.PositiveIntegerField(default=0) # Number of items currently in stock
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False,
+                                                 help_text="Units held by active stock reservations.")
     available = models.BooleanField(default=True) # Whether the product is currently available for purchase
 
     # Relationships
@@ -57,12 +62,22 @@ class Product(models.Model):
             models.Index(fields=['name']),
             models.Index(fields=['slug']),
             models.Index(fields=['-created_at']), # Index for latest products
+            models.Index(fields=['updated_at']), # Index for the catalog's Last-Modified
+            models.Index(fields=['available', 'price']), # Index for price filters and sorting
+            models.Index(fields=['available', '-created_at']), # Index for "newest" sorting
         ]
 
+    @property
+    def available_to_sell(self):
+        """Stock that isn't held by someone's active reservation."""
+        return max(self.stock - self.reserved_stock, 0)
+
     def save(self, *args, **kwargs):
         """Generates a slug from the name if not provided."""
         if not self.slug:
             self.slug = slugify(self.name)
+        if not self.image:
+            self.image_variants = {}
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -70,4 +85,27 @@ class Product(models.Model):
 
     def get_absolute_url(self):
         """Returns the URL to the product detail page."""
-        return reverse('product_detail', args=[self.slug])
\ No newline at end of file
+        return reverse('product_detail', args=[self.slug])
+
+
+class Tombstone(models.Model):
+    """
+    Records the deletion of a catalog object so offline clients can drop it
+    from their local store on their next delta sync.
+    """
+    MODEL_CHOICES = [
+        ('product', 'Product'),
+        ('category', 'Category'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'deleted_at']), # Index for "deleted since" queries
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.model} {self.object_id}"
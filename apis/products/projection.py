@@ -0,0 +1,150 @@
+# products/projection.py
+"""
+Sparse fieldsets and a fast read-only representation for the product endpoints.
+
+    GET /api/?fields=id,name,price,image
+    GET /api/?fields=id,name&expand=categories
+
+Only the requested columns are selected, with `.values()`, and rows are
+turned into JSON-ready dicts by one precomputed formatter per field instead
+of a DRF serializer per row. Every field renders exactly as it does in
+ProductSerializer, so a projected row is always a subset of the full one.
+"""
+from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.core.files.storage import default_storage
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import DateTimeField
+
+from .models import Category, Product
+from .serializers import image_variant_urls
+
+CATEGORIES_FIELD = 'categories_read'
+
+# Product columns a client may ask for, in the order ProductSerializer emits them
+PROJECTABLE_FIELDS = [
+    'id', 'name', 'slug', 'price', 'image', 'image_variants', 'description',
+    'stock', 'available_to_sell', 'available', 'created_at', 'updated_at',
+]
+
+# Projectable fields that aren't columns, computed in SQL like the model properties of the same name
+COMPUTED_FIELDS = {
+    'available_to_sell': Greatest(F('stock') - F('reserved_stock'), Value(0), output_field=models.IntegerField()),
+}
+
+EXPANSIONS = {'categories': CATEGORIES_FIELD}
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def project(queryset, fields):
+    """queryset.values() for projectable field names, computed ones included."""
+    return queryset.values(
+        *[name for name in fields if name not in COMPUTED_FIELDS],
+        **{name: COMPUTED_FIELDS[name] for name in fields if name in COMPUTED_FIELDS},
+    )
+
+
+def _formatter(field, request):
+    """Returns a function rendering one column value the way ProductSerializer would."""
+    if field is None: # Computed, already an int
+        return None
+    if field.name == 'image_variants':
+        return lambda value: image_variant_urls(value, request)
+    if isinstance(field, models.DecimalField):
+        return lambda value: None if value is None else f'{value:.{field.decimal_places}f}'
+    if isinstance(field, models.DateTimeField):
+        return DateTimeField().to_representation
+    if isinstance(field, models.FileField):
+        def file_url(value):
+            if not value:
+                return None
+            url = default_storage.url(value)
+            return request.build_absolute_uri(url) if request else url
+        return file_url
+    return None # Already JSON-ready
+
+
+class ProductProjection:
+
+    def __init__(self, fields, request=None):
+        self.fields = fields
+        self.request = request
+        self.columns = [name for name in fields if name != CATEGORIES_FIELD]
+        self.formatters = {
+            name: _formatter(None if name in COMPUTED_FIELDS else Product._meta.get_field(name), request)
+            for name in self.columns
+        }
+
+    @classmethod
+    def from_request(cls, request):
+        """Builds a projection from ?fields= and ?expand=, or returns None to use the full serializer."""
+        requested = _split(request.query_params.get('fields', ''))
+        expand = _split(request.query_params.get('expand', ''))
+        if not requested:
+            return None
+
+        unknown = [name for name in requested if name not in PROJECTABLE_FIELDS + [CATEGORIES_FIELD]]
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}."})
+        unknown = [name for name in expand if name not in EXPANSIONS]
+        if unknown:
+            raise ValidationError({'expand': f"Unknown expansions: {', '.join(unknown)}."})
+
+        fields = requested + [EXPANSIONS[name] for name in expand if EXPANSIONS[name] not in requested]
+        return cls(fields, request)
+
+    def apply(self, queryset, extra_columns=()):
+        """
+        Narrows a Product queryset to the projected columns. `extra_columns`
+        are selected as well (e.g. ordering keys the paginator reads) and
+        dropped again by render().
+        """
+        columns = list(self.columns)
+        if CATEGORIES_FIELD in self.fields:
+            columns.append('id')
+        columns += [name for name in extra_columns if name not in columns]
+        return project(queryset.prefetch_related(None), columns)
+
+    def _categories_by_product(self, product_ids):
+        through = Product.categories.through
+        category_fields = [field.attname for field in Category._meta.concrete_fields]
+        formatters = {
+            name: _formatter(Category._meta.get_field(name), self.request) for name in category_fields
+        }
+        rows = (
+            through.objects.filter(product_id__in=product_ids)
+            .order_by('category__name')
+            .values_list('product_id', *[f'category__{name}' for name in category_fields])
+        )
+        categories = {}
+        for product_id, *values in rows:
+            category = {}
+            for name, value in zip(category_fields, values):
+                formatter = formatters[name]
+                category[name] = formatter(value) if formatter else value
+            categories.setdefault(product_id, []).append(category)
+        return categories
+
+    def render(self, rows):
+        """Turns `.values()` rows into output dicts, in the requested field order."""
+        rows = list(rows)
+        categories = None
+        if CATEGORIES_FIELD in self.fields:
+            categories = self._categories_by_product([row['id'] for row in rows])
+
+        formatters = self.formatters
+        results = []
+        for row in rows:
+            item = {}
+            for name in self.fields:
+                if name == CATEGORIES_FIELD:
+                    item[name] = categories.get(row['id'], [])
+                    continue
+                formatter = formatters[name]
+                item[name] = formatter(row[name]) if formatter else row[name]
+            results.append(item)
+        return results
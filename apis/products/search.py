@@ -0,0 +1,133 @@
+# products/search.py
+"""
+Full-text product search backed by an SQLite FTS5 index.
+
+`products_product_fts` holds one row per product (rowid = product id) with
+the product name, description and the names of its categories. The index is
+kept in sync incrementally by the signal handlers in `products.signals` and
+can be rebuilt from scratch with `manage.py rebuild_search_index`.
+
+On other database backends search falls back to `icontains` lookups.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+SEARCH_TABLE = 'products_product_fts'
+
+# bm25() weights for (name, description, categories): a hit in the product
+# name ranks far above a hit buried in the description.
+RANK_WEIGHTS = (10.0, 1.0, 4.0)
+
+# Keep statements well under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def index_products(product_ids):
+    """(Re)writes the index rows for the given products."""
+    if not is_supported():
+        return
+    through = Product.categories.through
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            category_names = {}
+            for product_id, name in through.objects.filter(product_id__in=chunk).values_list(
+                'product_id', 'category__name'
+            ):
+                category_names.setdefault(product_id, []).append(name)
+            rows = [
+                (pk, name, description, ' '.join(category_names.get(pk, [])))
+                for pk, name, description in Product.objects.filter(pk__in=chunk).values_list(
+                    'pk', 'name', 'description'
+                )
+            ]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", chunk)
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, categories) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+
+def remove_products(product_ids):
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        for chunk in _chunks(product_ids):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", chunk)
+
+
+def rebuild_index(batch_size=CHUNK_SIZE):
+    """Rebuilds the whole index in batches of product ids. Returns the number of products indexed."""
+    if not is_supported():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    indexed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        index_products(ids)
+        indexed += len(ids)
+        last_id = ids[-1]
+    with connection.cursor() as cursor:
+        # Merge the b-tree segments written by the batches above
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def build_match_query(term):
+    """
+    Turns free text into an FTS5 query: every word must match, and the last
+    word is matched as a prefix so results show up while the user is typing.
+    Only word characters are kept, so user input can't inject FTS5 syntax.
+    """
+    words = re.findall(r'\w+', term)
+    if not words:
+        return None
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_product_ids(term, limit=None):
+    """Returns the ids of matching products, best match first."""
+    if limit is None:
+        limit = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 1000)
+    if not is_supported():
+        words = re.findall(r'\w+', term)
+        queryset = Product.objects.all()
+        for word in words:
+            queryset = queryset.filter(Q(name__icontains=word) | Q(description__icontains=word))
+        return list(queryset.order_by('name', 'id').values_list('pk', flat=True)[:limit]) if words else []
+
+    match_query = build_match_query(term)
+    if match_query is None:
+        return []
+    weights = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s",
+            [match_query, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
@@ -1,3 +1,4 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from .models import Category, Product
 
@@ -6,21 +7,38 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = '__all__'
 
+def image_variant_urls(image_variants, request=None):
+    variants = {}
+    for variant, files in (image_variants or {}).items():
+        if variant == 'source':
+            continue
+        variants[variant] = dict(files)
+        for extension in ('webp', 'jpeg'):
+            url = default_storage.url(files[extension])
+            variants[variant][extension] = request.build_absolute_uri(url) if request else url
+    return variants
+
 class ProductSerializer(serializers.ModelSerializer):
     categories_read = CategorySerializer(many=True, read_only=True, source='categories')
     category_ids = serializers.PrimaryKeyRelatedField(
         many=True, queryset=Category.objects.all(), write_only=True, source='categories'
     )
+    image_variants = serializers.SerializerMethodField()
+    available_to_sell = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'slug', 'price', 'image', 'description',
-            'stock', 'available', 'categories_read', 'category_ids',
+            'id', 'name', 'slug', 'price', 'image', 'image_variants', 'description',
+            'stock', 'available_to_sell', 'available', 'categories_read', 'category_ids',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'slug', 'created_at', 'updated_at']
 
+    def get_image_variants(self, obj):
+        """URLs of the resized images, e.g. {'thumb': {'webp': url, 'jpeg': url, 'width': 160, 'height': 120}}"""
+        return image_variant_urls(obj.image_variants, self.context.get('request'))
+
     def create(self, validated_data):
         categories_data = validated_data.pop('categories', [])
         product = Product.objects.create(**validated_data)
@@ -0,0 +1,104 @@
+# products/signals.py
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import search
+from .cache import bump_catalog_generation_on_commit
+from .images import variants_are_current
+from .models import Category, Product, Tombstone
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if raw: # Loading fixtures; rebuild_search_index afterwards
+        return
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def reindex_products_on_category_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keeps the category names in the index in step with product.categories."""
+    if action == 'pre_clear' and reverse:
+        # category.products.clear(): remember which products lose the category
+        instance._search_cleared_product_ids = list(instance.products.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.index_products([instance.pk])
+    elif action == 'post_clear':
+        search.index_products(getattr(instance, '_search_cleared_product_ids', []))
+    else:
+        search.index_products(pk_set)
+
+
+@receiver(post_save, sender=Category)
+def reindex_products_on_category_rename(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    search.index_products(instance.products.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_products_of_deleted_category(sender, instance, **kwargs):
+    # The M2M rows are gone by post_delete, so collect the affected products now
+    instance._search_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_products_of_deleted_category(sender, instance, **kwargs):
+    search.index_products(getattr(instance, '_search_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Product.categories.through)
+def invalidate_catalog_cache(sender, **kwargs):
+    if kwargs.get('raw'):
+        return
+    bump_catalog_generation_on_commit()
+
+
+@receiver(post_save, sender=Product)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    """Renders variants for a new or replaced image once the upload is committed."""
+    if raw or not instance.image or variants_are_current(instance):
+        return
+    from .tasks import generate_image_variants_task
+    product_id = instance.pk
+    transaction.on_commit(lambda: generate_image_variants_task.delay(product_id))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def touch_products_on_category_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """A product's category list is part of its synced state, so bump its updated_at."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_search_cleared_product_ids', [])
+    else:
+        product_ids = pk_set
+    Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Category)
+def touch_products_of_deleted_category(sender, instance, **kwargs):
+    product_ids = getattr(instance, '_search_product_ids', [])
+    Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk)
@@ -0,0 +1,174 @@
+# products/sync.py
+"""
+Delta sync of the catalog for offline-capable clients.
+
+A sync returns everything that changed in a time window: product and
+category upserts ordered by `updated_at`, then tombstones for deletions.
+Responses are capped at SYNC_PAGE_SIZE rows; while `has_more` is true the
+client calls again with the returned watermark, and once it is false it
+stores the watermark for its next sync.
+
+The watermark is an opaque token. A final watermark holds the end of the
+window just synced; the next sync starts SYNC_WATERMARK_OVERLAP before it so
+rows written by transactions that were still in flight are not missed
+(clients apply upserts idempotently, so the few repeats are harmless). A
+continuation token also holds the stream being read and the last
+(updated_at, id) seen, so paging through a window never repeats or skips a
+row even when thousands share one timestamp.
+"""
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Category, Product, Tombstone
+from .projection import PROJECTABLE_FIELDS, ProductProjection, project
+from .serializers import CategorySerializer
+
+# Read in this order; upserts come before the deletions from the same window
+STREAMS = ['categories', 'products', 'deleted_categories', 'deleted_products']
+
+
+def encode_watermark(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode()
+
+
+def _parse_time(value):
+    """An aware datetime from a watermark; watermarks we issue always carry an offset."""
+    parsed = parse_datetime(value)
+    if parsed is None or timezone.is_naive(parsed):
+        raise ValueError(f"not an aware datetime: {value!r}")
+    return parsed
+
+
+def decode_watermark(token):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode()))
+        state['since'] = _parse_time(state['since']) if state.get('since') else None
+        state['until'] = _parse_time(state['until']) if state.get('until') else None
+        if state.get('after'):
+            state['after'] = (_parse_time(state['after'][0]), int(state['after'][1]))
+        state['stream'] = int(state.get('stream', 0))
+        if not 0 <= state['stream'] <= len(STREAMS):
+            raise ValueError("unknown stream")
+    except (binascii.Error, ValueError, TypeError, KeyError, IndexError, AttributeError):
+        raise ValidationError({'watermark': "Invalid watermark; start a full sync without one."})
+    return state
+
+
+def _stream_queryset(stream):
+    """Returns (queryset, timestamp field) for a stream."""
+    if stream == 'categories':
+        return Category.objects.all(), 'updated_at'
+    if stream == 'products':
+        return Product.objects.all(), 'updated_at'
+    model = 'category' if stream == 'deleted_categories' else 'product'
+    return Tombstone.objects.filter(model=model), 'deleted_at'
+
+
+def _read_stream(stream, since, until, after, limit):
+    queryset, timestamp = _stream_queryset(stream)
+    if since is not None:
+        queryset = queryset.filter(**{f'{timestamp}__gt': since})
+    queryset = queryset.filter(**{f'{timestamp}__lte': until})
+    if after is not None:
+        after_time, after_pk = after
+        queryset = queryset.filter(
+            Q(**{f'{timestamp}__gt': after_time}) | Q(**{timestamp: after_time, 'pk__gt': after_pk})
+        )
+    if stream == 'products':
+        queryset = project(queryset, PROJECTABLE_FIELDS)
+    elif stream.startswith('deleted_'):
+        queryset = queryset.values('pk', 'object_id', 'deleted_at')
+    rows = list(queryset.order_by(timestamp, 'pk')[:limit + 1])
+
+    last = rows[limit - 1] if len(rows) > limit else None
+    rows = rows[:limit]
+    if last is None:
+        return rows, None
+    if isinstance(last, dict):
+        return rows, (last.get('updated_at') or last['deleted_at'], last.get('id') or last['pk'])
+    return rows, (last.updated_at, last.pk)
+
+
+def _render_products(rows, request):
+    through = Product.categories.through
+    category_ids = {}
+    for product_id, category_id in through.objects.filter(
+        product_id__in=[row['id'] for row in rows]
+    ).values_list('product_id', 'category_id'):
+        category_ids.setdefault(product_id, []).append(category_id)
+    products = ProductProjection(PROJECTABLE_FIELDS, request).render(rows)
+    for product in products:
+        product['category_ids'] = sorted(category_ids.get(product['id'], []))
+    return products
+
+
+def sync(token=None, request=None):
+    """Returns the sync response body for a watermark (None for a full sync)."""
+    page_size = settings.SYNC_PAGE_SIZE
+    now = timezone.now()
+    reset = False
+    if token:
+        state = decode_watermark(token)
+    else:
+        state = {'since': None, 'until': None, 'stream': 0, 'after': None}
+
+    if state['until'] is None:
+        # Starting a new window; rewind a little to catch late commits
+        since = state['since']
+        if since is not None:
+            if since < now - settings.SYNC_TOMBSTONE_RETENTION:
+                # Tombstones this old are pruned: the client must start over
+                since = None
+            else:
+                since = since - settings.SYNC_WATERMARK_OVERLAP
+        reset = since is None
+        state = {'since': since, 'until': now, 'stream': 0, 'after': None}
+
+    body = {'reset': reset, 'products': [], 'categories': [],
+            'deleted': {'products': [], 'categories': []}}
+    remaining = page_size
+    stream_index = state['stream']
+    after = state['after']
+    while stream_index < len(STREAMS) and remaining > 0:
+        stream = STREAMS[stream_index]
+        if state['since'] is None and stream.startswith('deleted_'):
+            stream_index, after = stream_index + 1, None # A full sync has nothing to delete
+            continue
+        rows, last = _read_stream(stream, state['since'], state['until'], after, remaining)
+        remaining -= len(rows)
+        if stream == 'categories':
+            body['categories'] = CategorySerializer(rows, many=True).data
+        elif stream == 'products':
+            body['products'] = _render_products(rows, request)
+        else:
+            body['deleted'][stream.split('_', 1)[1]] = [row['object_id'] for row in rows]
+        if last is not None: # Page is full in the middle of this stream
+            after = last
+            break
+        stream_index, after = stream_index + 1, None
+
+    body['has_more'] = stream_index < len(STREAMS)
+    if body['has_more']:
+        body['watermark'] = encode_watermark({
+            'since': state['since'].isoformat() if state['since'] else None,
+            'until': state['until'].isoformat(),
+            'stream': stream_index,
+            'after': [after[0].isoformat(), after[1]] if after else None,
+        })
+    else:
+        body['watermark'] = encode_watermark({'since': state['until'].isoformat()})
+    return body
+
+
+def prune_tombstones():
+    """Deletes tombstones older than the retention window. Returns how many were removed."""
+    cutoff = timezone.now() - settings.SYNC_TOMBSTONE_RETENTION
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,45 @@
+from celery import shared_task
+from django.utils import timezone
+
+from .cache import bump_catalog_generation
+from .images import generate_variants
+from .models import Product
+from .sync import prune_tombstones
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def generate_image_variants_task(self, product_id):
+    """
+    Celery task to render the thumb/card/detail variants of a product image
+    and record them on the product.
+    """
+    try:
+        product = Product.objects.only('id', 'image').get(pk=product_id)
+    except Product.DoesNotExist:
+        print(f"Product with ID {product_id} not found for image variants.")
+        return
+    if not product.image:
+        return
+
+    try:
+        variants = generate_variants(product.image)
+    except OSError as exc: # Unreadable upload or storage hiccup
+        print(f"Generating image variants failed for product {product_id}: {exc}. Retrying...")
+        raise self.retry(exc=exc)
+
+    # Only record the variants if the image wasn't replaced while we were rendering.
+    # A queryset update skips the post_save handlers, so bump the catalog cache here.
+    updated = Product.objects.filter(pk=product_id, image=variants['source']).update(
+        image_variants=variants, updated_at=timezone.now()
+    )
+    if updated:
+        bump_catalog_generation()
+
+
+@shared_task
+def prune_sync_tombstones_task():
+    """
+    Celery task to delete deletion records older than SYNC_TOMBSTONE_RETENTION.
+    Clients that haven't synced within that window are sent a full resync.
+    """
+    deleted = prune_tombstones()
+    print(f"Pruned {deleted} sync tombstones.")
@@ -1,3 +1,602 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.stock import decrement_stock
+from . import search
+from . import sync as sync_module
+from .cache import LIVE_FIELDS, get_catalog_generation
+from .exports import product_export_rows
+from .filters import SORT_OPTIONS, filter_products
+from .importer import import_catalog
+from .tasks import generate_image_variants_task
+from .models import Category, Product
+
+
+class CatalogTestMixin:
+    """Builds a small catalog where every product belongs to several categories."""
+
+    def create_catalog(self, product_count, categories_per_product=3):
+        offset = Product.objects.count()
+        categories = [
+            Category.objects.get_or_create(name=f'Category {i}')[0] for i in range(categories_per_product)
+        ]
+        products = []
+        for i in range(offset, offset + product_count):
+            product = Product.objects.create(
+                name=f'Product {i:04d}', price=Decimal('10.00') + i, stock=5 + i,
+            )
+            product.categories.set(categories)
+            products.append(product)
+        return products
+
+
+class ProductQueryBudgetTests(CatalogTestMixin, TestCase):
+    """
+    The catalog endpoints must cost a fixed number of queries no matter how
+    many products are on the page or how many categories each one has.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_product_list_budget_is_independent_of_page_size(self):
+        self.create_catalog(1)
+        # COUNT(*) for the page, the products, and one prefetch for all categories,
+        # plus the newest updated_at for Last-Modified
+        with self.assertNumQueries(4):
+            self.client.get(reverse('product-list'))
+
+        self.create_catalog(15)
+        cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('product-list'))
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(response.data['results'][0]['categories_read']), 3)
+
+    def test_product_detail_budget(self):
+        product = self.create_catalog(1, categories_per_product=8)[0]
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('product-detail', args=[product.pk]))
+        self.assertEqual(len(response.data['categories_read']), 8)
+
+    def test_category_list_budget_is_independent_of_catalog_size(self):
+        self.create_catalog(1, categories_per_product=1)
+        # The newest updated_at for Last-Modified, COUNT(*) for the page and the categories
+        with self.assertNumQueries(3):
+            self.client.get(reverse('category-list'))
+
+        self.create_catalog(15, categories_per_product=12)
+        cache.clear()
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('category-list'))
+        self.assertEqual(len(response.data['results']), 10)
+        with self.assertNumQueries(0): # Served from the catalog cache
+            self.client.get(reverse('category-list'))
+
+    def test_category_detail_budget(self):
+        self.create_catalog(5, categories_per_product=2)
+        category = Category.objects.get(name='Category 1')
+        with self.assertNumQueries(2): # Last-Modified and the category
+            response = self.client.get(reverse('category-detail', args=[category.pk]))
+        self.assertEqual(response.data['name'], 'Category 1')
+
+
+class ProductCursorPaginationTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.create_catalog(25, categories_per_product=1)
+
+    def test_page_numbers_remain_the_default(self):
+        response = self.client.get(reverse('product-list'))
+        self.assertEqual(response.data['count'], 25)
+
+    def test_cursor_pages_skip_count_and_walk_the_whole_catalog(self):
+        self.client.get(reverse('product-list')) # Warm the catalog Last-Modified
+        url = reverse('product-list') + '?pagination=cursor'
+        seen = []
+        while url:
+            # No COUNT(*): just the page of products and their categories
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(row['name'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, sorted(Product.objects.values_list('name', flat=True)))
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.audio = Category.objects.create(name='Audio')
+        self.headphones = Product.objects.create(
+            name='Wireless Headphones', price=Decimal('120.00'), description='Noise cancelling over-ear.'
+        )
+        self.speaker = Product.objects.create(
+            name='Bluetooth Speaker', price=Decimal('80.00'), description='Pairs with wireless headphones.'
+        )
+        self.laptop = Product.objects.create(name='Laptop', price=Decimal('900.00'))
+
+    def search(self, term):
+        response = self.client.get(reverse('product-search'), {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('wireless'), ['Wireless Headphones', 'Bluetooth Speaker'])
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search('lap'), ['Laptop'])
+
+    def test_index_follows_category_changes(self):
+        self.assertEqual(self.search('audio'), [])
+        self.speaker.categories.add(self.audio)
+        self.assertEqual(self.search('audio'), ['Bluetooth Speaker'])
+
+        self.audio.name = 'Sound'
+        self.audio.save()
+        self.assertEqual(self.search('audio'), [])
+        self.assertEqual(self.search('sound'), ['Bluetooth Speaker'])
+
+        self.audio.delete()
+        self.assertEqual(self.search('sound'), [])
+
+    def test_index_follows_product_updates_and_deletes(self):
+        self.laptop.name = 'Gaming Laptop'
+        self.laptop.save()
+        self.assertEqual(self.search('gaming'), ['Gaming Laptop'])
+        self.laptop.delete()
+        self.assertEqual(self.search('gaming'), [])
+
+    def test_fts_syntax_in_user_input_is_ignored(self):
+        self.assertEqual(self.search('"laptop*('), ['Laptop'])
+
+    def test_rebuild_restores_a_wiped_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.SEARCH_TABLE}")
+        self.assertEqual(self.search('laptop'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('laptop'), ['Laptop'])
+
+    def test_query_is_required(self):
+        response = self.client.get(reverse('product-search'))
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogCacheTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.product = self.create_catalog(3)[0]
+
+    def test_repeat_requests_are_served_from_cache(self):
+        first = self.client.get(reverse('product-list'))
+        with self.assertNumQueries(1): # Only the page's stock, read fresh
+            second = self.client.get(reverse('product-list'))
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('Last-Modified', second)
+        self.client.get(reverse('product-list'), {'fields': 'name,price'})
+        with self.assertNumQueries(0): # No stock fields to refresh
+            self.client.get(reverse('product-list'), {'fields': 'name,price'})
+
+    def test_matching_etag_returns_304_without_loading_the_product(self):
+        etag = self.client.get(reverse('product-detail', args=[self.product.pk]))['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('product-detail', args=[self.product.pk]), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_sales_keep_the_cache_but_serve_fresh_stock(self):
+        url = reverse('product-detail', args=[self.product.pk])
+        before = self.client.get(url)
+        in_stock = self.client.get(reverse('product-list'), {'in_stock': 'true', 'fields': 'name'})
+        generation = get_catalog_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            decrement_stock({self.product.pk: self.product.stock})
+        self.assertEqual(get_catalog_generation(), generation) # Nothing else was dropped
+
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual((after.data['stock'], after.data['available_to_sell']), (0, 0))
+        self.assertEqual({name: value for name, value in after.data.items() if name not in LIVE_FIELDS},
+                         {name: value for name, value in before.data.items() if name not in LIVE_FIELDS})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=after['ETag']).status_code, 304)
+        # Which products a stock filter matches changed, so that page was dropped
+        self.assertNotIn(self.product.name, [row['name'] for row in self.client.get(
+            reverse('product-list'), {'in_stock': 'true', 'fields': 'name'}).data['results']])
+        self.assertIn(self.product.name, [row['name'] for row in in_stock.data['results']])
+
+    def test_if_modified_since_returns_304(self):
+        last_modified = self.client.get(reverse('category-list'))['Last-Modified']
+        response = self.client.get(reverse('category-list'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_changes_invalidate_cached_responses(self):
+        before = self.client.get(reverse('product-list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed Product'
+            self.product.save()
+        after = self.client.get(reverse('product-list'), HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertIn('Renamed Product', [row['name'] for row in after.data['results']])
+
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+    def upload(self, size=(2000, 1500), mode='RGB', image_format='JPEG', name='photo.jpg'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, image_format)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_upload_schedules_variant_generation_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.objects.create(name='Camera', price=Decimal('300.00'), image=self.upload())
+        self.assertEqual(len(callbacks), 2) # Catalog cache bump and the variants task
+
+    def test_variants_are_resized_content_hashed_and_exposed(self):
+        product = Product.objects.create(name='Camera', price=Decimal('300.00'), image=self.upload())
+        generate_image_variants_task(product.pk)
+        product.refresh_from_db()
+
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertEqual(
+            (product.image_variants['thumb']['width'], product.image_variants['thumb']['height']), (160, 120)
+        )
+        self.assertEqual(product.image_variants['detail']['width'], 1200)
+        thumb_webp = product.image_variants['thumb']['webp']
+        self.assertRegex(thumb_webp, r'^products/variants/[0-9a-f]{2}/[0-9a-f]{32}\.webp$')
+
+        response = APIClient().get(reverse('product-detail', args=[product.pk]))
+        self.assertTrue(response.data['image_variants']['card']['jpeg'].startswith('http://testserver/media/'))
+
+    def test_identical_uploads_share_variant_files(self):
+        first = Product.objects.create(name='One', price=Decimal('1.00'), image=self.upload(name='a.jpg'))
+        second = Product.objects.create(name='Two', price=Decimal('1.00'), image=self.upload(name='b.jpg'))
+        generate_image_variants_task(first.pk)
+        generate_image_variants_task(second.pk)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image_variants['card'], second.image_variants['card'])
+
+    def test_transparent_png_gets_a_jpeg_variant(self):
+        product = Product.objects.create(
+            name='Logo', price=Decimal('1.00'),
+            image=self.upload(mode='RGBA', image_format='PNG', name='logo.png'),
+        )
+        generate_image_variants_task(product.pk)
+        product.refresh_from_db()
+        self.assertTrue(product.image_variants['thumb']['jpeg'].endswith('.jpeg'))
+
+    def test_backfill_renders_missing_variants(self):
+        product = Product.objects.create(name='Camera', price=Decimal('300.00'), image=self.upload())
+        out = StringIO()
+        call_command('backfill_image_variants', stdout=out)
+        self.assertIn('Generated image variants for 1 products.', out.getvalue())
+        product.refresh_from_db()
+        self.assertIn('thumb', product.image_variants)
+        call_command('backfill_image_variants', stdout=out)
+        self.assertIn('Generated image variants for 0 products.', out.getvalue())
+
+
+class CatalogImportTests(TestCase):
+
+    def setUp(self):
+        self.phones = Category.objects.create(name='Phones')
+        self.audio = Category.objects.create(name='Audio')
+        self.existing = Product.objects.create(name='Old Pixel', slug='pixel-9', price=Decimal('500.00'), stock=1)
+        self.existing.categories.add(self.audio)
+
+    def import_csv(self, text, batch_size=2):
+        return import_catalog(StringIO(text), 'csv', batch_size=batch_size)
+
+    def test_csv_feed_creates_and_updates_products_in_batches(self):
+        report = self.import_csv(
+            "name,slug,price,stock,available,categories\n"
+            "Pixel 9,pixel-9,650.00,12,true,phones\n"
+            "AirPods,,199.99,40,yes,audio|phones\n"
+            "Desk Lamp,,25,3,false,\n"
+        )
+        self.assertEqual((report.rows, report.imported, report.error_count), (3, 3, 0))
+        self.assertEqual(Product.objects.count(), 3)
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.price, self.existing.stock), ('Pixel 9', Decimal('650.00'), 12))
+        self.assertEqual(list(self.existing.categories.all()), [self.phones])
+
+        airpods = Product.objects.get(slug='airpods')
+        self.assertEqual(set(airpods.categories.all()), {self.audio, self.phones})
+        self.assertFalse(Product.objects.get(slug='desk-lamp').available)
+        self.assertEqual(search.search_product_ids('airpods'), [airpods.pk])
+
+    def test_rows_without_categories_keep_their_links(self):
+        self.import_csv("name,slug,price\nPixel 9,pixel-9,610\n")
+        self.assertEqual(list(self.existing.categories.all()), [self.audio])
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        report = import_catalog(StringIO(
+            '{"name": "Good", "price": "1.50", "categories": ["nope"]}\n'
+            '{"name": "", "price": "1"}\n'
+            'not json\n'
+            '{"name": "Bad price", "price": "abc"}\n'
+        ), 'jsonl')
+        self.assertEqual((report.rows, report.imported, report.error_count), (4, 1, 3))
+        self.assertEqual(report.unknown_categories, {'nope'})
+        self.assertIn('rows_per_second', report.as_dict())
+
+    def test_rows_the_database_would_refuse_are_reported_not_raised(self):
+        report = import_catalog(StringIO(
+            '{"name": 42, "price": "1"}\n'
+            '{"name": "Slug", "slug": ["x"], "price": "1"}\n'
+            '{"name": "Not a number", "price": "NaN"}\n'
+            '{"name": "Infinite", "price": "Infinity"}\n'
+            '{"name": "Too big", "price": "123456789012.00"}\n'
+            '{"name": "Too precise", "price": "1.005"}\n'
+            '{"name": "Negative", "price": "-5"}\n'
+            '{"name": "Bool price", "price": true}\n'
+            '{"name": "Float stock", "price": "1", "stock": 2.5}\n'
+            '{"name": "Odd categories", "price": "1", "categories": [1]}\n'
+            '{"name": "Fine", "price": 9.99}\n'
+        ), 'jsonl')
+        self.assertEqual((report.rows, report.imported, report.error_count), (11, 1, 10))
+        self.assertEqual(Product.objects.get(slug='fine').price, Decimal('9.99'))
+        self.assertIn('Row 5: price:', report.errors[4])
+        self.assertEqual(report.errors[6], 'Row 7: price cannot be negative')
+
+    def test_import_endpoint_is_staff_only(self):
+        feed = SimpleUploadedFile('feed.csv', b"name,price\nKettle,30\n")
+        client = APIClient()
+        self.assertEqual(client.post(reverse('product-import'), {'file': feed}).status_code, 401)
+
+        staff = get_user_model().objects.create_user('staff', password='pass12345', is_staff=True)
+        client.force_authenticate(staff)
+        feed.seek(0)
+        response = client.post(reverse('product-import'), {'file': feed})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['imported'], 1)
+        self.assertTrue(Product.objects.filter(slug='kettle').exists())
+
+
+class ProductProjectionTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.create_catalog(12, categories_per_product=2)
+        self.client.get(reverse('category-list')) # Warm the catalog Last-Modified
+
+    def test_projected_rows_match_the_full_serializer(self):
+        Product.objects.filter(pk__in=Product.objects.order_by('name').values('pk')[:3]).update(reserved_stock=7)
+        full = self.client.get(reverse('product-list')).data['results']
+        fields = ('id,name,slug,price,image,image_variants,description,stock,available_to_sell,available,'
+                  'created_at,updated_at')
+        projected = self.client.get(reverse('product-list'), {'fields': fields, 'expand': 'categories'})
+        for full_row, row in zip(full, projected.data['results']):
+            self.assertEqual(row, {name: full_row[name] for name in row})
+
+    def test_only_requested_columns_are_selected(self):
+        with self.assertNumQueries(2) as queries: # COUNT(*) and one narrow SELECT, no categories
+            response = self.client.get(reverse('product-list'), {'fields': 'id,price'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'price'])
+        self.assertNotIn('description', queries.captured_queries[1]['sql'])
+
+    def test_expand_categories_costs_one_query(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('product-list'), {'fields': 'name', 'expand': 'categories'})
+        self.assertEqual(len(response.data['results'][0]['categories_read']), 2)
+
+    def test_cursor_pages_work_with_projections(self):
+        response = self.client.get(reverse('product-list'), {'fields': 'price', 'pagination': 'cursor'})
+        self.assertEqual(list(response.data['results'][0]), ['price'])
+        self.assertEqual(len(self.client.get(response.data['next']).data['results']), 2)
+
+    def test_detail_projection(self):
+        product = Product.objects.first()
+        response = self.client.get(reverse('product-detail', args=[product.pk]), {'fields': 'name,stock'})
+        self.assertEqual(response.data, {'name': product.name, 'stock': product.stock})
+        missing = self.client.get(reverse('product-detail', args=[999999]), {'fields': 'name'})
+        self.assertEqual(missing.status_code, 404)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse('product-list'), {'fields': 'name,password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogExportTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        self.create_catalog(5, categories_per_product=2)
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('partner', password='pass12345'))
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export_streams_every_product(self):
+        response = self.client.get(reverse('product-export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.read(response).splitlines()]
+        self.assertEqual([row['name'] for row in rows], [f'Product {i:04d}' for i in range(5)])
+        self.assertEqual(rows[0]['categories'], ['category-0', 'category-1'])
+
+    def test_export_reads_categories_once_per_chunk(self):
+        rows = product_export_rows(chunk_size=2)
+        with self.assertNumQueries(4): # One streamed read of products, then categories per chunk of 2
+            self.assertEqual(len(list(rows)), 5)
+
+    def test_csv_export_round_trips_through_the_importer(self):
+        exported = self.read(self.client.get(reverse('product-export'), {'export_format': 'csv'}))
+        Product.objects.update(stock=0)
+        report = import_catalog(StringIO(exported), 'csv')
+        self.assertEqual((report.imported, report.error_count), (5, 0))
+        self.assertEqual(Product.objects.get(name='Product 0003').stock, 8)
+        self.assertEqual(Product.objects.get(name='Product 0003').categories.count(), 2)
+
+
+class CatalogSyncTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.products = self.create_catalog(4, categories_per_product=2)
+        # Age the catalog so the watermark overlap window doesn't re-send it
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Product.objects.update(updated_at=an_hour_ago)
+        Category.objects.update(updated_at=an_hour_ago)
+
+    def sync(self, watermark=None):
+        response = self.client.get(reverse('catalog-sync'), {'watermark': watermark} if watermark else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_sync_then_delta_with_tombstones(self):
+        full = self.sync()
+        self.assertTrue(full['reset'])
+        self.assertFalse(full['has_more'])
+        self.assertEqual(len(full['products']), 4)
+        self.assertEqual(len(full['categories']), 2)
+        self.assertEqual(len(full['products'][0]['category_ids']), 2)
+
+        unchanged = self.sync(full['watermark'])
+        self.assertEqual((unchanged['products'], unchanged['categories']), ([], []))
+        self.assertFalse(unchanged['reset'])
+
+        self.products[0].price = Decimal('1.00')
+        self.products[0].save()
+        deleted_pk = self.products[1].pk
+        self.products[1].delete()
+        Category.objects.get(name='Category 1').delete()
+
+        delta = self.sync(unchanged['watermark'])
+        # The edited product, plus the survivors whose category list just changed
+        self.assertEqual(
+            {row['id'] for row in delta['products']},
+            {self.products[0].pk, self.products[2].pk, self.products[3].pk},
+        )
+        self.assertEqual(delta['products'][0]['category_ids'], [Category.objects.get().pk])
+        self.assertEqual(delta['deleted']['products'], [deleted_pk])
+        self.assertEqual(len(delta['deleted']['categories']), 1)
+
+    @override_settings(SYNC_PAGE_SIZE=3)
+    def test_paging_through_rows_sharing_one_timestamp(self):
+        self.create_catalog(6, categories_per_product=0)
+        Product.objects.update(updated_at=timezone.now())
+        seen = []
+        body = self.sync()
+        while True:
+            self.assertLessEqual(len(body['products']) + len(body['categories']), 3)
+            seen.extend(row['id'] for row in body['products'])
+            if not body['has_more']:
+                break
+            body = self.sync(body['watermark'])
+        # Every product exactly once
+        self.assertEqual(sorted(seen), sorted(Product.objects.values_list('pk', flat=True)))
+
+    def test_expired_watermark_forces_a_full_resync(self):
+        stale = sync_module.encode_watermark({'since': (timezone.now() - timedelta(days=365)).isoformat()})
+        body = self.sync(stale)
+        self.assertTrue(body['reset'])
+        self.assertEqual(len(body['products']), 4)
+
+    def test_invalid_watermark_is_rejected(self):
+        response = self.client.get(reverse('catalog-sync'), {'watermark': 'garbage!'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_watermark_without_a_timezone_is_rejected(self):
+        for state in ({'since': '2026-10-17T00:00:00'}, {'since': 'yesterday'},
+                      {'since': '2026-10-17T00:00:00+00:00', 'until': '2026-10-18T00:00:00', 'stream': 1}):
+            response = self.client.get(reverse('catalog-sync'), {'watermark': sync_module.encode_watermark(state)})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('watermark', response.json())
+
+
+class ProductFilterTests(CatalogTestMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.phones = Category.objects.create(name='Phones')
+        self.audio = Category.objects.create(name='Audio')
+        self.cheap = Product.objects.create(name='Earbuds', price=Decimal('20.00'), stock=0)
+        self.mid = Product.objects.create(name='Speaker', price=Decimal('80.00'), stock=4, available=False)
+        self.dear = Product.objects.create(name='Phone', price=Decimal('700.00'), stock=2)
+        self.cheap.categories.add(self.audio)
+        self.mid.categories.add(self.audio, self.phones)
+        self.dear.categories.add(self.phones)
+
+    def names(self, **params):
+        response = self.client.get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['name'] for row in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.names(min_price='50', max_price='100'), ['Speaker'])
+        self.assertEqual(self.names(available='true'), ['Earbuds', 'Phone'])
+        self.assertEqual(self.names(in_stock='true'), ['Phone', 'Speaker'])
+        self.assertEqual(self.names(category='audio'), ['Earbuds', 'Speaker'])
+        self.assertEqual(self.names(category='audio,phones'), ['Earbuds', 'Phone', 'Speaker'])
+        self.assertEqual(self.names(category='phones', available='true', fields='name'), ['Phone'])
+
+    def test_fully_reserved_products_are_not_in_stock(self):
+        Product.objects.filter(pk=self.dear.pk).update(reserved_stock=2)
+        self.assertEqual(self.names(in_stock='true'), ['Speaker'])
+        self.assertEqual(self.names(in_stock='false'), ['Earbuds', 'Phone'])
+        response = self.client.get(reverse('product-list'), {'fields': 'name,stock,available_to_sell', 'sort': 'name'})
+        self.assertIn({'name': 'Phone', 'stock': 2, 'available_to_sell': 0}, response.data['results'])
+
+    def test_sorting(self):
+        self.assertEqual(self.names(sort='price'), ['Earbuds', 'Speaker', 'Phone'])
+        self.assertEqual(self.names(sort='-price'), ['Phone', 'Speaker', 'Earbuds'])
+        self.assertEqual(self.names(sort='newest'), ['Phone', 'Speaker', 'Earbuds'])
+
+    def test_cursor_pages_follow_the_requested_sort(self):
+        response = self.client.get(reverse('product-list'), {'sort': '-price', 'pagination': 'cursor', 'fields': 'name'})
+        self.assertEqual([row['name'] for row in response.data['results']], ['Phone', 'Speaker', 'Earbuds'])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'min_price': 'cheap'}, {'available': 'maybe'}, {'sort': 'stock'}, {'max_price': 'NaN'}):
+            self.assertEqual(self.client.get(reverse('product-list'), params).status_code, 400)
+
+    def test_every_filter_and_sort_combination_uses_an_index(self):
+        """No combination may fall back to a full scan of the products table."""
+        filters = [
+            {}, {'min_price': '10'}, {'min_price': '10', 'max_price': '90'}, {'available': 'true'},
+            {'available': 'false', 'max_price': '90'}, {'in_stock': 'true'}, {'category': 'audio'},
+            {'category': 'audio,phones', 'available': 'true', 'min_price': '10'},
+        ]
+        for params in filters:
+            for sort in SORT_OPTIONS:
+                queryset = filter_products(Product.objects.all(), {**params, 'sort': sort})[:10]
+                plan = queryset.explain()
+                with self.subTest(params=params, sort=sort, plan=plan):
+                    for line in plan.splitlines():
+                        self.assertNotRegex(line, r'SCAN products_product(?! USING)')
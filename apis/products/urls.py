@@ -5,6 +5,12 @@ from products import views
 urlpatterns = [
     path('', views.ProductList.as_view(), name='product-list'), 
     path('<int:pk>/', views.ProductDetail.as_view(), name='product-detail'),
+    path('search/', views.ProductSearch.as_view(), name='product-search'),
+    path('sync/', views.CatalogSync.as_view(), name='catalog-sync'),
+    path('export/', views.ProductExport.as_view(), name='product-export'),
+    path('import/', views.ProductImport.as_view(), name='product-import'),
+    path('categories/', views.CategoryList.as_view(), name='category-list'),
+    path('categories/<int:pk>/', views.CategoryDetail.as_view(), name='category-detail'),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
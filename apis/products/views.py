@@ -1,30 +1,153 @@
 # products/views.py
+import io
 
 from rest_framework import generics
-from rest_framework.permissions import AllowAny, IsAuthenticated # Import these if not already
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated # Import these if not already
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from apis.pagination import ProductCursorPagination
+from apis.streaming import EXPORT_FORMATS, csv_response, ndjson_response
 from .models import Category, Product
 from .serializers import CategorySerializer, ProductSerializer
 from .permissions import IsAdminOrReadOnly # Import your custom permission
+from . import search
+from .cache import CatalogCacheMixin
+from .filters import filter_products, get_ordering
+from .exports import CSV_FIELDS, product_csv_rows, product_export_rows
+from .importer import guess_format, import_catalog
+from .projection import ProductProjection
+from .sync import sync
 
-class ProductList(generics.ListCreateAPIView):
-    queryset = Product.objects.all().order_by('name')
+class ProductList(CatalogCacheMixin, generics.ListCreateAPIView):
+    # Prefetch categories so a page costs one query for products and one for
+    # all of their categories, instead of one extra query per product.
+    queryset = Product.objects.prefetch_related('categories').order_by('name', 'id')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination # ?pagination=cursor for constant-time pages
     # Apply the permission class here
     permission_classes = [IsAdminOrReadOnly] # GET (list) is allowed for any, POST (create) only for staff/admin
 
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+    def get_queryset(self):
+        # ?min_price, ?max_price, ?available, ?in_stock, ?category and ?sort (see products.filters)
+        self.cursor_ordering = get_ordering(self.request.query_params)
+        return filter_products(super().get_queryset(), self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        # ?fields=... skips the serializer and selects only the requested columns
+        projection = ProductProjection.from_request(request)
+        if projection is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        # The id is also selected for paginate_queryset() to note, even if it isn't shown
+        queryset = projection.apply(queryset, extra_columns=[name.lstrip('-') for name in self.cursor_ordering] + ['id'])
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(projection.render(queryset))
+        return self.get_paginated_response(projection.render(page))
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # For the catalog cache to refresh their stock
+        self.live_product_ids = [row['id'] if isinstance(row, dict) else row.pk for row in page or ()]
+        return page
+
+    def depends_on_stock(self, request):
+        return 'in_stock' in request.query_params
+
+class ProductDetail(CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.prefetch_related('categories')
     serializer_class = ProductSerializer
     # Apply the permission class here
     permission_classes = [IsAdminOrReadOnly] # GET (retrieve) is allowed for any, PUT/PATCH/DELETE only for staff/admin
 
+    def retrieve(self, request, *args, **kwargs):
+        self.live_product_ids = [kwargs['pk']] # For the catalog cache to refresh its stock
+        projection = ProductProjection.from_request(request)
+        if projection is None:
+            return super().retrieve(request, *args, **kwargs)
+        queryset = projection.apply(self.get_queryset().filter(pk=kwargs['pk']))
+        row = queryset.first()
+        if row is None:
+            raise NotFound()
+        return Response(projection.render([row])[0])
+
+class ProductSearch(generics.ListAPIView):
+    """
+    Ranked full-text search over product names, descriptions and category
+    names: GET /api/search/?q=wireless+head
+    """
+    serializer_class = ProductSerializer
+    permission_classes = [AllowAny]
+
+    def list(self, request, *args, **kwargs):
+        term = request.query_params.get('q', '').strip()
+        if not term:
+            raise ValidationError({'q': "This query parameter is required."})
+
+        # Rank in the index, then load only the products on the requested page
+        page_ids = self.paginate_queryset(search.search_product_ids(term))
+        products = Product.objects.prefetch_related('categories').in_bulk(page_ids)
+        results = [products[pk] for pk in page_ids if pk in products]
+        serializer = self.get_serializer(results, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class ProductImport(APIView):
+    """
+    Staff-only bulk import of a CSV or JSON Lines feed uploaded as `file`
+    (multipart). Products are matched on slug and created or updated in
+    batches; the response is the import report.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': "Upload a CSV or JSON Lines product feed."})
+        feed_format = request.query_params.get('feed_format') or guess_format(upload.name)
+        if feed_format not in ('csv', 'jsonl'):
+            raise ValidationError({'feed_format': "Must be 'csv' or 'jsonl'."})
+
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        report = import_catalog(stream, feed_format)
+        return Response(report.as_dict())
+
+class ProductExport(APIView):
+    """
+    Streams the whole catalog as NDJSON (default) or CSV with
+    ?export_format=csv, reading the table in chunks with constant memory.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': "Must be 'ndjson' or 'csv'."})
+        rows = product_export_rows(request)
+        if export_format == 'csv':
+            return csv_response(product_csv_rows(rows), CSV_FIELDS, 'products')
+        return ndjson_response(rows, 'products')
+
+class CatalogSync(APIView):
+    """
+    Delta sync for offline clients: GET /api/sync/?watermark=<token>.
+    Without a watermark the whole catalog is sent (with `reset: true`);
+    keep calling with the returned watermark while `has_more` is true.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        return Response(sync(request.query_params.get('watermark'), request))
+
 # You would also create similar views for Category if needed:
-class CategoryList(generics.ListCreateAPIView):
+class CategoryList(CatalogCacheMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all().order_by('name')
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
 
-class CategoryDetail(generics.RetrieveUpdateDestroyAPIView):
+class CategoryDetail(CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
\ No newline at end of file